@@ -0,0 +1,144 @@
+"""
+Defines how voice session time is split into hourly, daily and monthly
+activity buckets.
+
+Buckets are aligned to UTC. Each bucket is identified by its span and the
+timestamp it starts at.
+
+"""
+
+import time
+import calendar
+
+HOUR = 0                      # Span of hourly buckets.
+DAY = 1                       # Span of daily buckets.
+MONTH = 2                     # Span of monthly buckets.
+SPANS = (HOUR, DAY, MONTH)
+SPAN_NAMES = {"hour": HOUR, "day": DAY, "month": MONTH}
+
+_HOUR_SECONDS = 3600
+_DAY_SECONDS = 86400
+_WEEK_DAYS = 7
+
+
+def bucket_start(span, timestamp):
+    """Finds the start of the bucket a moment falls in.
+
+    Args:
+        span (int): HOUR, DAY or MONTH.
+        timestamp (float): Moment to find the bucket of.
+
+    Returns:
+        int: Timestamp the bucket starts at.
+
+    """
+    if span == HOUR:
+        return int(timestamp // _HOUR_SECONDS) * _HOUR_SECONDS
+    if span == DAY:
+        return int(timestamp // _DAY_SECONDS) * _DAY_SECONDS
+    year, month = time.gmtime(timestamp)[:2]
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+
+def next_bucket(span, bucket):
+    """Finds the start of the bucket following another.
+
+    Args:
+        span (int): HOUR, DAY or MONTH.
+        bucket (int): Timestamp a bucket starts at.
+
+    Returns:
+        int: Timestamp the following bucket starts at.
+
+    """
+    if span == HOUR:
+        return bucket + _HOUR_SECONDS
+    if span == DAY:
+        return bucket + _DAY_SECONDS
+    year, month = time.gmtime(bucket)[:2]
+    year, month = divmod(year * 12 + month, 12)
+    return calendar.timegm((year, month + 1, 1, 0, 0, 0))
+
+
+def split_session(start, end):
+    """Splits a session interval over the buckets of every span.
+
+    Args:
+        start (float): Timestamp the interval began at.
+        end (float): Timestamp the interval ended at.
+
+    Yields:
+        tuple: (span, bucket, seconds) where seconds is how much of the
+            interval falls in the bucket.
+
+    """
+    for span in SPANS:
+        bucket = bucket_start(span, start)
+        while bucket < end:
+            following = next_bucket(span, bucket)
+            seconds = min(end, following) - max(start, bucket)
+            if seconds > 0:
+                yield span, bucket, seconds
+            bucket = following
+
+
+def rollup_sessions(sessions):
+    """Sums session intervals into activity buckets.
+
+    Args:
+        sessions (iterable): (server_id, user_id, start, end) tuples.
+
+    Returns:
+        list: (server_id, user_id, span, bucket, seconds) tuples, one per
+            bucket a member was active in.
+
+    """
+    totals = dict()
+    for server_id, user_id, start, end in sessions:
+        for span, bucket, seconds in split_session(start, end):
+            key = (server_id, user_id, span, bucket)
+            totals[key] = totals.get(key, 0) + seconds
+    return [key + (seconds,) for key, seconds in totals.items()]
+
+
+def prune_cutoffs(retention, now=None):
+    """Works out the oldest bucket of each span worth keeping.
+
+    Args:
+        retention (dict): Holds (span_name, int) pairs where int is how many
+            seconds buckets of that span are kept. Spans left out are kept
+            forever.
+        now (float): Timestamp to count back from. Defaults to the current
+            time.
+
+    Returns:
+        list: (span, bucket) tuples. Buckets of span starting before bucket
+            can be removed.
+
+    """
+    now = time.time() if now is None else now
+    return [(SPAN_NAMES[name], bucket_start(SPAN_NAMES[name], now - kept))
+            for name, kept in retention.items()]
+
+
+def period_start(period, now=None):
+    """Works out which buckets make up a leaderboard period.
+
+    "week" covers the last seven days including today and "month" the
+    current calendar month.
+
+    Args:
+        period (string): "week" or "month".
+        now (float): Timestamp the period ends at. Defaults to the current
+            time.
+
+    Returns:
+        tuple: (span, since) where buckets of span starting at or after
+            since make up the period.
+
+    """
+    now = time.time() if now is None else now
+    if period == "week":
+        return DAY, (bucket_start(DAY, now) -
+                (_WEEK_DAYS - 1) * _DAY_SECONDS)
+    return MONTH, bucket_start(MONTH, now)
@@ -0,0 +1,150 @@
+"""
+Defines awaitable counterparts to the storage backend queries for use on the
+bot's event loop.
+
+"""
+
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("discord")
+
+
+class AsyncSQLWrapper():
+    """Runs storage backend queries on a dedicated executor.
+
+    Coroutines await these methods instead of calling the Storage
+    directly, so a slow query only holds up the coroutine waiting on it
+    rather than the whole event loop. The executor has its own threads,
+    which never outnumber the connections in a SQLWrapper's pool.
+
+    Attributes:
+        _sql (Storage): Backend whose queries are run.
+
+        _executor (ThreadPoolExecutor): Threads the queries are run on.
+
+    """
+
+    def __init__(self, sql, workers):
+        """Initializes the executor.
+
+        Args:
+            sql (Storage): Backend whose queries are run.
+            workers (int): Maximum amount of queries run at the same time.
+
+        """
+        self._sql = sql
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def _run(self, query, *args):
+        """Private helper to run a query on the executor.
+
+        Args:
+            query (function): Storage method to run.
+            *args: Arguments to pass to the method.
+
+        Returns:
+            Whatever the method returns.
+
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor,
+                functools.partial(query, *args))
+
+    async def add_users(self, rows):
+        """Awaitable Storage.add_users."""
+
+        await self._run(self._sql.add_users, rows)
+
+    async def add_user(self, server_id, user_id):
+        """Awaitable Storage.add_user."""
+
+        await self._run(self._sql.add_user, server_id, user_id)
+
+    async def update_rank(self, server_id, user_id, rank):
+        """Awaitable Storage.update_rank."""
+
+        await self._run(self._sql.update_rank, server_id, user_id, rank)
+
+    async def update_whitelist(self, rows):
+        """Awaitable Storage.update_whitelist."""
+
+        await self._run(self._sql.update_whitelist, rows)
+
+    async def flush(self, queue):
+        """Drains a WriteQueue or SessionLedger without blocking the loop.
+
+        Args:
+            queue (WriteQueue): Queue to flush. Anything with a blocking
+                flush method works.
+
+        """
+        await self._run(queue.flush)
+
+    async def append_sessions(self, sessions):
+        """Awaitable Storage.append_sessions."""
+
+        await self._run(self._sql.append_sessions, sessions)
+
+    async def reset_user(self, server_id, user_id):
+        """Awaitable Storage.reset_user."""
+
+        await self._run(self._sql.reset_user, server_id, user_id)
+
+    async def whitelist_user(self, server_id, user_id):
+        """Awaitable Storage.whitelist_user."""
+
+        await self._run(self._sql.whitelist_user, server_id, user_id)
+
+    async def unwhitelist_user(self, server_id, user_id):
+        """Awaitable Storage.unwhitelist_user."""
+
+        await self._run(self._sql.unwhitelist_user, server_id, user_id)
+
+    async def whitelist_all(self, server_id):
+        """Awaitable Storage.whitelist_all."""
+
+        await self._run(self._sql.whitelist_all, server_id)
+
+    async def unwhitelist_all(self, server_id):
+        """Awaitable Storage.unwhitelist_all."""
+
+        await self._run(self._sql.unwhitelist_all, server_id)
+
+    async def fetch_user(self, server_id, user_id):
+        """Awaitable Storage.fetch_user."""
+
+        return await self._run(self._sql.fetch_user, server_id, user_id)
+
+    async def fetch_all(self, server_id):
+        """Awaitable Storage.fetch_all."""
+
+        return await self._run(self._sql.fetch_all, server_id)
+
+    async def fetch_activity(self, server_id, span, since):
+        """Awaitable Storage.fetch_activity."""
+
+        return await self._run(self._sql.fetch_activity, server_id, span,
+                since)
+
+    async def fetch_servers(self, server_ids, before=None):
+        """Awaitable Storage.fetch_servers.
+
+        Returns:
+            list: Every row the iterator yields.
+
+        """
+        return await self._run(lambda: list(
+                self._sql.fetch_servers(server_ids, before)))
+
+    async def snapshot_token(self):
+        """Awaitable Storage.snapshot_token."""
+
+        return await self._run(self._sql.snapshot_token)
+
+    def close(self):
+        """Waits for queries already submitted and stops the executor."""
+
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,40 @@
+"""
+Defines how a server's members are re-ranked in bulk after its milestones
+change.
+
+"""
+
+from array import array
+
+
+def plan_rerank(table, previous, members, now):
+    """Works out which members' ranks a milestone change affects.
+
+    Every member's time is packed into one contiguous array and ranked in a
+    single pass against the table, so nothing is decided member by member.
+    Only members whose rank or role actually changed are returned.
+
+    Args:
+        table (MilestoneTable): Milestones to rank against.
+        previous (MilestoneTable): Milestones the members' current ranks
+            were given under.
+        members (list): (user_id, MemberState) pairs to re-rank.
+        now (float): Timestamp to compute totals at.
+
+    Returns:
+        tuple: (ranked, reroled) where ranked holds (user_id, rank) pairs of
+            members whose rank integer changed but who keep their role, and
+            reroled holds (user_id, rank, role) tuples of members who must be
+            given role, the name of their new highest role or None.
+
+    """
+    spent = array("d", (state.total(now) for user_id, state in members))
+    ranked = []
+    reroled = []
+    for (user_id, state), rank in zip(members, table.rank_many(spent)):
+        role = table.role(rank)
+        if role != previous.role(state.rank):
+            reroled.append((user_id, rank, role))
+        elif rank != state.rank:
+            ranked.append((user_id, rank))
+    return ranked, reroled
@@ -0,0 +1,323 @@
+"""
+Defines the parsed server configurations and the store that keeps them on
+disk.
+
+"""
+
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger("discord")
+_SECONDS = 60                 # Seconds in a minute.
+_MINUTES = 60                 # Minutes in an hour.
+_SEND_MESSAGES = "_send_messages324906"   # Named as such to be unique from
+                                          # any possible role names.
+
+
+def parse_time(time):
+    """Converts hhh:mm:ss to seconds.
+
+    hhh represents hours, mm represents minutes, ss represents seconds.
+
+    Args:
+        time (string): Time to parse into seconds.
+
+    Returns:
+        None: If the total seconds is less than 0 (somehow) or a ValueError
+            occurs.
+        int: Returns total seconds if successful and positive.
+
+    """
+    try:
+        hours, minutes, seconds = time.split(':')
+        hours = int(hours) * _MINUTES * _SECONDS
+        minutes = int(minutes) * _SECONDS
+        seconds = int(seconds)
+        final_time = hours + minutes + seconds
+        if final_time < 0:
+            return None
+        return final_time
+    except ValueError as e:
+        return None
+
+
+def format_time(seconds):
+    """Converts seconds to hhh:mm:ss.
+
+    Args:
+        seconds (int): Seconds to format.
+
+    Returns:
+        string: Formatted time.
+
+    """
+    minutes, seconds = divmod(seconds, _SECONDS)
+    hours, minutes = divmod(minutes, _MINUTES)
+    return '%03d:%02d:%02d' % (hours, minutes, seconds)
+
+
+class ServerConfig():
+    """A server's rank milestones and other configurations.
+
+    Never changed in place. The with_ and without_ methods return a changed
+    copy instead, so anyone holding on to a configuration keeps a consistent
+    view of it.
+
+    Attributes:
+        milestones (dict): Holds (role, int) pairs where role is assigned to
+            any member who reaches int seconds in the server's voice
+            channels.
+
+        send_messages (bool): If true, upon rank up, congratulations are sent
+            to the server's default channel, otherwise it is sent directly to
+            the user.
+
+    """
+
+    __slots__ = ("milestones", "send_messages")
+
+    def __init__(self, milestones=None, send_messages=True):
+        """Initializes a configuration.
+
+        Args:
+            milestones (dict): Holds (role, int) pairs. Copied.
+            send_messages (bool): Where to send congratulations.
+
+        """
+        self.milestones = dict(milestones or ())
+        self.send_messages = send_messages
+
+    def __repr__(self):
+        return "ServerConfig(%r, %r)" % (self.milestones, self.send_messages)
+
+    def __eq__(self, other):
+        return (isinstance(other, ServerConfig) and
+                self.milestones == other.milestones and
+                self.send_messages == other.send_messages)
+
+    def with_milestone(self, role, seconds):
+        """Returns a copy with a role's milestone set.
+
+        Args:
+            role (string): Name of the role.
+            seconds (int): Milestone in seconds.
+
+        Returns:
+            ServerConfig: The changed copy.
+
+        """
+        milestones = dict(self.milestones)
+        milestones[role] = seconds
+        return ServerConfig(milestones, self.send_messages)
+
+    def without_milestone(self, role):
+        """Returns a copy without a role's milestone.
+
+        Args:
+            role (string): Name of the role.
+
+        Returns:
+            ServerConfig: The changed copy.
+
+        """
+        milestones = dict(self.milestones)
+        milestones.pop(role, None)
+        return ServerConfig(milestones, self.send_messages)
+
+    def with_send_messages(self, send_messages):
+        """Returns a copy with send_messages set.
+
+        Args:
+            send_messages (bool): Where to send congratulations.
+
+        Returns:
+            ServerConfig: The changed copy.
+
+        """
+        return ServerConfig(self.milestones, send_messages)
+
+    def encode(self):
+        """Formats the configuration for its file.
+
+        Returns:
+            string: key=value pairs separated by semi-colons.
+
+        """
+        pairs = [_SEND_MESSAGES + '=' + str(self.send_messages)]
+        for role, seconds in self.milestones.items():
+            pairs.append(role + '=' + format_time(seconds))
+        return ';'.join(pairs)
+
+    @staticmethod
+    def decode(readable):
+        """Parses a configuration written by encode.
+
+        Args:
+            readable (string): Contents of the configuration's file.
+
+        Returns:
+            ServerConfig: The parsed configuration.
+
+        """
+        milestones = dict()
+        send_messages = True
+        for pair in readable.split(';'):
+            key, value = pair.split('=')
+            if key == _SEND_MESSAGES:
+                send_messages = value == 'True'
+                continue
+            seconds = parse_time(value)
+            if seconds is None:
+                logger.warning("Skipping unreadable milestone %s", pair)
+                continue
+            milestones[key] = seconds
+        return ServerConfig(milestones, send_messages)
+
+
+class ConfigStore(threading.Thread):
+    """Keeps server configurations in files and saves changes in batches.
+
+    Each server's configuration lives in a <server_id>.txt file. Changes are
+    saved in the background every save_time seconds, so a burst of changes
+    to a server costs one write. Files are replaced atomically by writing a
+    temporary file and renaming it over the old one, so a crash never
+    leaves a half written configuration behind.
+
+    Attributes:
+        _directory (string): Directory configuration files are kept in.
+
+        _save_time (float): Maximum seconds a change waits before it is saved.
+
+        _pending (dict): Holds (server_id, ServerConfig) pairs waiting to be
+            saved.
+
+        _lock (Lock): Guards _pending.
+
+        _flush_lock (Lock): Held while saving so saves never overlap.
+
+    """
+
+    def __init__(self, directory, save_time):
+        """Initializes the store thread.
+
+        Args:
+            directory (string): Directory to keep configuration files in.
+            save_time (float): Maximum seconds a change waits before it is
+                saved.
+
+        """
+        super().__init__(daemon=True)
+        self._directory = directory
+        self._save_time = save_time
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, server_id):
+        """Private helper to build the path of a server's file.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        Returns:
+            string: Path to the file.
+
+        """
+        return os.path.join(self._directory, server_id + '.txt')
+
+    def load(self, server_id):
+        """Reads a server's configuration.
+
+        Servers without a configuration get the default one, which is saved
+        with the next batch.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        Returns:
+            ServerConfig: The server's configuration.
+
+        """
+        with self._lock:
+            if server_id in self._pending:
+                return self._pending[server_id]
+        try:
+            with open(self._path(server_id), 'r') as curr_config:
+                return ServerConfig.decode(curr_config.read())
+        except FileNotFoundError as e:
+            settings = ServerConfig()
+            self.save(server_id, settings)
+            return settings
+
+    def load_all(self, server_ids):
+        """Reads many servers' configurations.
+
+        Args:
+            server_ids (list): Unique identifiers for the servers.
+
+        Returns:
+            dict: Holds (server_id, ServerConfig) pairs.
+
+        """
+        return {server_id:self.load(server_id) for server_id in server_ids}
+
+    def save(self, server_id, settings):
+        """Queues a server's configuration to be saved.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            settings (ServerConfig): Configuration to save.
+
+        """
+        with self._lock:
+            self._pending[server_id] = settings
+
+    def _write(self, server_id, settings):
+        """Private helper to atomically replace a server's file.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            settings (ServerConfig): Configuration to write.
+
+        """
+        path = self._path(server_id)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as new_config:
+            new_config.write(settings.encode())
+            new_config.flush()
+            os.fsync(new_config.fileno())
+        os.replace(temp_path, path)
+
+    def flush(self):
+        """Saves every queued configuration and waits for it.
+
+        Configurations that could not be saved are queued again unless a
+        newer one was queued meanwhile.
+
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = dict()
+            try:
+                for server_id in list(pending):
+                    self._write(server_id, pending[server_id])
+                    del pending[server_id]
+            except:
+                with self._lock:
+                    for server_id, settings in pending.items():
+                        self._pending.setdefault(server_id, settings)
+                raise
+
+    def run(self):
+        """Saves queued configurations periodically."""
+
+        while True:
+            time.sleep(self._save_time)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Failed to save server configurations")
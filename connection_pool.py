@@ -0,0 +1,244 @@
+"""
+Defines the bounded database connection pool.
+
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger("discord")
+_CHECK_AFTER = 30             # Seconds a connection can sit idle before it is
+                              # checked again when taken from the pool.
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection frees up before the pool's timeout."""
+
+
+class ConnectionPool():
+    """Hands out a bounded amount of database connections.
+
+    Up to size connections are kept open and reused. Under a burst, up to
+    overflow extra connections are opened and closed again as soon as they
+    are returned. Beyond that, callers wait for a connection to be returned
+    and give up with PoolTimeoutError after timeout seconds, so a burst
+    slows down instead of exhausting the server's connection limit.
+    Connections that sat idle for a while are checked before being handed
+    out and replaced if they died.
+
+    Attributes:
+        _connect (function): Opens a new connection.
+
+        _check (function): Returns True if a connection still works.
+
+        _size (int): Amount of connections kept open.
+
+        _overflow (int): Amount of extra connections allowed under a burst.
+
+        _timeout (float): Seconds to wait for a connection to be returned.
+
+        _idle (list): (connection, float) pairs of open connections not in
+            use. The float is when the connection was returned.
+
+        _open (int): Amount of connections open, in use or idle.
+
+        _waiting (int): Amount of callers waiting for a connection.
+
+        _available (Condition): Guards the attributes above and is notified
+            when a connection is returned.
+
+        waits (int): Times a caller had to wait for a connection.
+
+        timeouts (int): Times a caller gave up waiting.
+
+        overflows (int): Times an overflow connection was opened.
+
+        replaced (int): Times a dead idle connection was replaced.
+
+    """
+
+    def __init__(self, connect, check, size, overflow, timeout):
+        """Initializes an empty pool. Connections are opened on demand.
+
+        Args:
+            connect (function): Opens a new connection.
+            check (function): Returns True if a connection still works.
+            size (int): Amount of connections kept open.
+            overflow (int): Amount of extra connections allowed under a burst.
+            timeout (float): Seconds to wait for a connection to be returned.
+
+        """
+        self._connect = connect
+        self._check = check
+        self._size = size
+        self._overflow = overflow
+        self._timeout = timeout
+        self._idle = []
+        self._open = 0
+        self._waiting = 0
+        self._available = threading.Condition()
+        self.waits = 0
+        self.timeouts = 0
+        self.overflows = 0
+        self.replaced = 0
+
+    def stats(self):
+        """Returns the pool's counters.
+
+        Returns:
+            dict: Holds (counter, int) pairs.
+
+        """
+        with self._available:
+            return {"open": self._open, "idle": len(self._idle),
+                    "waits": self.waits, "timeouts": self.timeouts,
+                    "overflows": self.overflows, "replaced": self.replaced}
+
+    def get_connection(self):
+        """Takes a connection from the pool.
+
+        Returns:
+            PooledConnection: Connection which goes back to the pool when
+                closed.
+
+        Raises:
+            PoolTimeoutError: If no connection was returned in time.
+
+        """
+        deadline = None
+        with self._available:
+            while True:
+                if self._idle:
+                    cnx, returned = self._idle.pop()
+                    break
+                if self._open < self._size + self._overflow:
+                    self._open += 1
+                    if self._open > self._size:
+                        self.overflows += 1
+                    cnx = None
+                    break
+                if deadline is None:
+                    self.waits += 1
+                    deadline = time.monotonic() + self._timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    logger.warning("Timed out waiting for a database "
+                            "connection: %s", self._stats())
+                    raise PoolTimeoutError()
+                self._waiting += 1
+                try:
+                    self._available.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            if cnx is None:
+                cnx = self._connect()
+            elif (time.monotonic() - returned > _CHECK_AFTER and
+                    not self._healthy(cnx)):
+                self.replaced += 1
+                cnx = self._connect()
+        except:
+            self._forget()
+            raise
+        return PooledConnection(self, cnx)
+
+    def _stats(self):
+        """Private helper to format the counters while holding the lock."""
+
+        return ("open=%s idle=%s waits=%s timeouts=%s overflows=%s" %
+                (self._open, len(self._idle), self.waits, self.timeouts,
+                self.overflows))
+
+    def _healthy(self, cnx):
+        """Private helper to check a connection, closing it if it died.
+
+        Args:
+            cnx: Connection to check.
+
+        Returns:
+            bool: True if the connection still works.
+
+        """
+        try:
+            if self._check(cnx):
+                return True
+        except Exception as e:
+            pass
+        try:
+            cnx.close()
+        except Exception as e:
+            pass
+        return False
+
+    def _forget(self):
+        """Private helper to stop counting a connection that is gone."""
+
+        with self._available:
+            self._open -= 1
+            self._available.notify()
+
+    def _release(self, cnx, broken):
+        """Private helper to take a connection back.
+
+        Overflow and broken connections are closed rather than kept, unless
+        someone is waiting for a connection.
+
+        Args:
+            cnx: Connection being returned.
+            broken (bool): True if the connection should not be reused.
+
+        """
+        with self._available:
+            if not broken and (self._open <= self._size or self._waiting):
+                self._idle.append((cnx, time.monotonic()))
+                self._available.notify()
+                return
+        try:
+            cnx.close()
+        finally:
+            self._forget()
+
+
+class PooledConnection():
+    """Connection borrowed from a ConnectionPool.
+
+    Behaves like the connection it wraps except that closing it returns it
+    to the pool. Any transaction left open is rolled back first.
+
+    Attributes:
+        _pool (ConnectionPool): Pool the connection belongs to.
+
+        _cnx: Connection being wrapped, or None once returned.
+
+    """
+
+    def __init__(self, pool, cnx):
+        """Wraps a connection taken from a pool.
+
+        Args:
+            pool (ConnectionPool): Pool the connection belongs to.
+            cnx: Connection to wrap.
+
+        """
+        self._pool = pool
+        self._cnx = cnx
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def close(self):
+        """Returns the connection to the pool."""
+
+        cnx, self._cnx = self._cnx, None
+        if cnx is None:
+            return
+        broken = False
+        try:
+            if getattr(cnx, "in_transaction", False):
+                cnx.rollback()
+        except Exception as e:
+            broken = True
+        self._pool._release(cnx, broken)
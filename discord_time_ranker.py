@@ -11,45 +11,63 @@ Example:
 
 Attributes:
     
-    sql (SQLWrapper) Wrapper for sql python connector.
+    sql (Storage) Storage backend named in config.json, either MySQL through
+        SQLWrapper or SQLite through SQLiteStorage. Only used from threads
+        other than the event loop's.
+
+    async_sql (AsyncSQLWrapper) Awaitable queries for coroutines. Runs the
+        same queries as sql on its own threads so the event loop never waits
+        on the database.
     
     bot (Bot): The bot object running on each server.
 
-    server_configs (dict): Holds (server_id, dict) pairs where 
-        server_id indicates what server the dictionary value belongs to. The 
-        dictionary value holds mainly (role, time_milestone) pairs where
-        role is assigned to any member in the same server upon reaching the
-        time_milestone (in seconds). Also is meant to hold other server 
-        configurations, the only other one being (_send_messages324906, bool) 
-        where if bool is true, upon rank up, congratulations are sent to the 
-        server's defaultchannel, otherwise it is sent directly to the user.
+    server_configs (dict): Holds (server_id, ServerConfig) pairs where
+        server_id indicates what server the ServerConfig value belongs to.
+        ServerConfig holds (role, time_milestone) pairs where role is
+        assigned to any member in the same server upon reaching the
+        time_milestone (in seconds), parsed once when the server is loaded.
+        It also holds whether congratulations are sent to the server's
+        default channel or directly to the user. ServerConfig is explained
+        in its class definition.
         Note that:
             server_id is always (string),
             time_milestone is always (int).
 
+    config_store (ConfigStore): Reads server configurations from their files
+        and saves changes to them in batches. ConfigStore is explained in its
+        class definition.
+
     global_member_times (dict): Holds (server_id, dict) pairs where server_id
         indicates what server the dictionary value belongs to. The dictionary
-        value holds (user_id, list) pairs where user_id is a unique user id
-        assigned by Discord and list holds two elemnts, [time, role]. Time
-        is an integer representing a users total accumulated time.
-        Role is an integer representing the users next role in the role
-        hierarchy organized by role orders.
+        value holds (user_id, MemberState) pairs where user_id is a unique
+        user id assigned by Discord. MemberState holds the time a user banked
+        from closed sessions, when their open session started (if they have
+        one) and their rank. A user's total accumulated time is always read
+        through MemberState.total(). Rank is an integer representing the
+        users next role in the role hierarchy organized by role orders.
         Ex.
 
                     Role Hierarchy: [Peasant, Craftsman, Noble, Royalty]
             Integer Representation: [      0,         1,     2,       3]
 
-            [1000, 2] means user_id is a Craftsman with 1000 seconds spent in
-            the server's voice channels.
+            A total of 1000 with a rank of 2 means user_id is a Craftsman
+            with 1000 seconds spent in the server's voice channels.
+
+        Rank only records which role the user was last given. The rank a
+        user should have is always worked out from their total through the
+        server's MilestoneTable.
 
         Note that:
             user_id is always (string)
 
-    role_orders (dict): Holds (server_id, list) pairs where server_id indicates
-        what server the list value belongs to. The list holds server roles
-        ordered by their time_milestones in ascending order. This way, we
-        know where each role stands in the heirarchy and can represent each
-        person's role as an integer
+    milestone_tables (dict): Holds (server_id, MilestoneTable) pairs where
+        server_id indicates what server the MilestoneTable value belongs to.
+        The MilestoneTable holds the server's roles with time milestones
+        ordered by their time_milestones in ascending order, compiled
+        whenever server_configs changes. This way, we know where each role
+        stands in the heirarchy and can work out each person's role as an
+        integer by bisecting the milestones with their time. MilestoneTable
+        is explained in its class definition.
 
     server_wl (dict): Holds (server_id, set) pairs where server_id indicates
         what server the list value belongs to. The set holds whitelisted 
@@ -59,52 +77,148 @@ Attributes:
         without reprecussions. (As in the bot's functionality might break for
         that specific server).
 
-    server_events (dict): Holds (server_id, Event) pairs where server_id 
-        indicates what server the Event value belongs to. Event is the Event 
-        object from the threading module. Used to help prevent race conditions.
-
-    active_threads (dict): Holds (server_id, dict) pairs where server_id
-        indicates what server the dict value belongs to. The dictionary
-        value holds (user_id, TimeTracker) pairs. TimeTracker extends the 
-        Thread from the threading module. TimeTracker is explained in the class
-        definition.
+    server_locks (dict): Holds (server_id, Lock) pairs where server_id
+        indicates what server the Lock value belongs to. Lock is the Lock
+        object from the asyncio module. Held by commands and events that
+        reconfigure the server's ranks so they never interleave. Rank ups
+        skip the server while it is held rather than wait.
+
+    ready_servers (set): Holds the server_ids whose attribute dictionaries
+        are all set up. Commands in other servers wait for them to load and
+        are answered with a request to try again if that takes too long.
+        (see: on_message, ServerLoading)
+
+    last_used (dict): Holds (server_id, float) pairs where the float is the
+        last time a command or event touched the server. Servers unused for
+        a while are evicted from memory once their changes are flushed.
+
+    loading (dict): Holds (server_id, Task) pairs for servers being set up.
+        Anyone needing the server awaits the same Task so it is never loaded
+        twice.
+
+    config_versions (dict): Holds (server_id, int) pairs where server_id
+        indicates what server the int value belongs to. Bumped whenever
+        server_configs and milestone_tables are replaced for the server.
+        Both are only ever replaced, never changed in place, so holding on
+        to one is a consistent snapshot of that version.
+
+    wl_versions (dict): Holds (server_id, int) pairs where server_id
+        indicates what server the int value belongs to. Bumped whenever
+        server_wl changes for the server.
+
+    render_cache (RenderCache): Replies of the help, settup, leaderboard and
+        list_whitelist commands kept for reuse. Entries are rendered from a
+        version of the server's times, configs or whitelist and are dropped
+        once that version is bumped. Replies showing times also expire after
+        a few seconds since time passes in open sessions. RenderCache is
+        explained in its class definition.
+
+    role_index (RoleIndex): Finds each server's roles by name in O(1).
+        Rebuilt for a server whenever one of its roles is created, deleted or
+        updated. Members are found by id through Server.get_member, which
+        discord.py already keeps indexed and current. RoleIndex is explained
+        in its class definition.
+
+    member_index (MemberIndex): Finds each server's members by their exact
+        username in O(1) and suggests members by the start of their name,
+        ignoring case. Kept current from member join, leave and update
+        events. MemberIndex is explained in its class definition.
+
+    snapshot (StateSnapshot): Binary snapshot of the servers loaded when the
+        previous run last saved one. Open only while the servers restored
+        from it are reconciled with the database after startup, then None.
+        StateSnapshot is explained in its class definition.
+
+    unreconciled (set): Holds the server_ids restored from the snapshot
+        which have not been reconciled with the database yet.
+
+    boot_time (float): When this run started. Ledger sessions from before
+        it are what the snapshot is reconciled against.
+
+    write_ahead_log (WriteAheadLog): Local log of time and rank changes which
+        have not reached the database yet. Replayed on startup if the bot
+        was killed before it could write them. WriteAheadLog is explained in
+        its class definition.
+
+    write_queue (WriteQueue): Queues new members, rank changes and whitelist
+        changes, merging repeated writes to the same member, and writes them
+        in batches. WriteQueue is explained in its class definition.
+
+    session_ledger (SessionLedger): Buffers closed voice session intervals and
+        appends them to the database's session ledger in batches. Also folds
+        the ledger into member totals in the background. SessionLedger is
+        explained in its class definition.
+
+    session_engine (SessionEngine): Records when each member in a voice
+        channel began accumulating time and works out accrued time on demand.
+        SessionEngine is explained in its class definition.
+
+    role_dispatcher (RoleDispatcher): Sends every role change to Discord.
+        Queues changes per server, merging changes to the same member, and
+        sends them concurrently while taking turns between servers and
+        backing off when rate limited. RoleDispatcher is explained in its
+        class definition.
+
+    rank_scheduler (RankScheduler): Holds the moment each member accumulating
+        time reaches their next time milestone and fires rank_up when it does.
+        RankScheduler is explained in its class definition.
 
     config (dict): Holds (key, value) pairs parsed from config.json.
 
 
 """
 import re
-import sys
 import json
 import time
-import copy
+import random
 import asyncio
 import logging
-import os.path
-import discord
 import traceback
 import threading
+import concurrent.futures
 from signal import *
 from discord import Game
-from discord import utils
 from discord import Embed
+from discord import ChannelType
 from discord.ext import commands
 from discord.ext.commands import Bot
-from sql_wrapper import SQLWrapper
+from storage import create_storage
+from config_store import ConfigStore
+from config_store import parse_time
+from config_store import format_time
+from activity_rollups import period_start
+from state_snapshot import StateSnapshot
+from state_snapshot import write_snapshot
+from async_sql_wrapper import AsyncSQLWrapper
+from member_state import MemberState
+from session_engine import SessionEngine
+from rank_scheduler import RankScheduler
+from session_ledger import SessionLedger
+from write_queue import WriteQueue
+from write_ahead_log import WriteAheadLog
+from render_cache import RenderCache
+from role_index import RoleIndex
+from member_index import MemberIndex
+from milestone_table import MilestoneTable
+from bulk_rerank import plan_rerank
+from role_dispatcher import RoleDispatcher
 
 #------------CONSTANTS------------#
 
-_HIGH_RANK = 2                # Minimum number of roles user must be above in
-                              # the hierarchy for some edge cases.
-                             
 _HELP_COLOR = 26575           # Color to embed.
 _SETTUP_COLOR = 3866383
 _BOARD_COLOR = 16755456
 _WHITELIST_COLOR = 16777215
 _LINK_COLORS = 26575
 
+_MAX_SUGGESTIONS = 5          # Maximum amount of members suggested when a
+                              # username can't be found.
+
 _MAX_BOARD_SIZE = 15          # Maximum amount of people to be shown on a
                               # leaderboard.
+_BOARD_TITLES = {"all": "", "week": " This Week", "month": " This Month"}
+                              # Periods a leaderboard can cover and what they
+                              # add to its title.
 
 _SECONDS = 60                 # Seconds in a minute.
 _MINUTES = 60                 # Minutes in an hour.
@@ -113,6 +227,8 @@ _ID_INDEX = 0                 # Index of returned sql row where user id is
 _TIME_INDEX = 1               # Index of returned sql row where user time is
 _RANK_INDEX = 2               # Index of returned sql row where rank is
 _WL_STATUS_INDEX = 3          # Index of returned sql row where wl_status is
+_SERVER_INDEX = 4             # Index of returned sql row where server id is
+                              # (only when fetching many servers)
 
 #------------LOGGING------------#
 
@@ -132,14 +248,37 @@ logger.addHandler(handler)
 with open('config.json', 'r') as file:
     config = json.load(file)
 
-sql = SQLWrapper(config["db_config"])
+sql = create_storage(config)
+async_sql = AsyncSQLWrapper(sql, config["db_workers"])
+write_ahead_log = WriteAheadLog(config["wal_path"], config["wal_commit_time"])
+session_ledger = SessionLedger(sql, write_ahead_log,
+        config["ledger_flush_time"], config["compact_time"],
+        config["activity_retention"])
+write_queue = WriteQueue(sql, write_ahead_log, config["write_flush_time"],
+        config["write_batch_size"])
+config_store = ConfigStore(config["config_path"], config["config_save_time"])
 bot = Bot(command_prefix='~', case_insensitve=True)
 server_configs = dict()
 global_member_times = dict()
-role_orders = dict()
+milestone_tables = dict()
 server_wl = dict()
-server_events = dict()
-active_threads = dict()
+server_locks = dict()
+ready_servers = set()
+last_used = dict()
+loading = dict()
+config_versions = dict()
+wl_versions = dict()
+render_cache = RenderCache(config["render_cache_size"])
+role_index = RoleIndex()
+member_index = MemberIndex()
+snapshot = None
+unreconciled = set()
+boot_time = time.time()
+session_engine = SessionEngine(global_member_times, session_ledger)
+rank_scheduler = RankScheduler()
+role_dispatcher = RoleDispatcher(bot.replace_roles, config["role_workers"],
+        config["role_server_workers"], config["role_retries"],
+        config["role_backoff"])
 bot.remove_command('help')
 
 # Used for determining if user should be notified on role update.
@@ -154,16 +293,49 @@ message_user = True
 async def on_ready():
     """Event called when bot begins to run.
 
-    Calls on_server_join event for each server to set up server stats and
-    configurations. Also begins the PeriodicUpdater thread. PeriodicUpdater
-    is explained in the class definition.
+    Sets up server stats and configurations for servers with members in
+    voice channels and servers in the snapshot, which are restored from it
+    straight away and reconciled with the database in the background. Every
+    other server is loaded when first used. Also
+    begins the PeriodicUpdater, SessionLedger, WriteQueue, ConfigStore and
+    WriteAheadLog threads, the rank scheduler, the write ahead log's
+    heartbeats and eviction of idle servers. PeriodicUpdater is explained in
+    the class definition.
 
     """
-    for server in bot.servers:
-        await bot.on_server_join(server)
+    # Write changes a previous run did not get to, including those of servers
+    # that will not be loaded yet.
+    for server_id in write_ahead_log.recovered_servers():
+        await replay_wal(server_id)
+    write_ahead_log.discard_recovered()
+
+    # Servers loaded when the snapshot was taken are likely to be used again,
+    # and restoring them is cheap.
+    restored = set()
+    if not session_ledger.is_alive():
+        restored = await open_snapshot()
+    await join_all_servers([server for server in bot.servers
+            if server.id in restored or any(
+            channel.voice_members for channel in server.channels)])
+    if snapshot is not None:
+        bot.loop.create_task(reconcile_snapshot())
 
     PeriodicUpdater().start()
-    await bot.change_presence(game=Game(name'~help'))
+    if not write_ahead_log.is_alive():
+        write_ahead_log.start()
+    if not session_ledger.is_alive():
+        session_ledger.start()
+    if not write_queue.is_alive():
+        write_queue.start()
+    if not config_store.is_alive():
+        config_store.start()
+    if not role_dispatcher.running:
+        bot.loop.create_task(role_dispatcher.run())
+    if not rank_scheduler.running:
+        bot.loop.create_task(rank_scheduler.run(rank_up))
+        bot.loop.create_task(wal_heartbeat())
+        bot.loop.create_task(evict_idle_servers())
+    await bot.change_presence(game=Game(name='~help'))
     logger.info(str(server_configs))
 
 
@@ -173,40 +345,11 @@ async def on_server_join(server):
 
     Creates appropriate files to write server configurations and stats to.
     Sets up appropriate attribute dictionaries for the server joined. Also
-    starts TimeTracker threads to start accumulating times for users 
-    in voice channels upon the bot joining.
+    starts sessions to start accumulating times for users in voice channels
+    upon the bot joining.
 
     """
-
-    if server.name is not None:
-        logger.info('Joining server ' + server.name)
-
-    # Fills up attribute dictionaries and creates appropriate text files.
-    stats_start(server)
-    config_start(server)
-    role_orders.update({server.id:get_roles_in_order(server)})
-    active_threads.update({server.id:dict()})
-    stat_event = threading.Event()
-    stat_event.set()
-    server_events.update({server.id:stat_event})
-
-    # Check if people joined since bot was last on since on_ready relies on this
-    # function as well.
-    for person in server.members:
-        check_stats_presence(person) 
-
-    # Start TimeTrackers threads for people in voice channels.
-    message_user = False
-    for channel in server.channels:
-        for person in channel.voice_members:
-            m_voice = person.voice
-            if (not m_voice.is_afk and not m_voice.deaf and 
-                    not m_voice.self_deaf
-                    and person.id not in active_threads[server.id]):
-                new_thread = TimeTracker(server, person)
-                new_thread.start()
-                active_threads[server.id].update({person.id:new_thread})
-    message_user = True
+    await ensure_server(server)
 
 @bot.event
 async def on_server_remove(server):
@@ -217,59 +360,75 @@ async def on_server_remove(server):
 
     """
     logger.info('Leaving server ' + server.name)
-
-    # Deletion of dictionary values.
-    try:
-        del global_member_times[server.id]
-        del server_configs[server.id]
-        del role_orders[server.id]
-        del server_wl[server.id]
-        del server_events[server.id]
-    except (ValueError, KeyError) as e:
-        logger.error('Failed to remove server information from ' + server.id)
-
-    # Stops all running threads in that server.
-    try:
-        for person in active_threads[server.id]:
-            active_threads[server.id][person].bot_in_server = False
-        del active_threads[server.id]
-    except KeyError as e:
-        return
+    unload_server(server.id)
 
 @bot.event
 async def on_voice_state_update(before, after):
     """Event called whenever a user's voice state changes.
 
-    Checks various cases and acts on TimeTracker thread accordingly.
+    Checks various cases and starts or ends the user's session accordingly.
     If the user is deafened, stop accumulating time.
     If the user is in an afk channel, stop accumulating time.
     Otherwise, as long as the user is in a voice channel, accumulate time.
     
     """
 
+    # Loading the server starts sessions for everyone already in a voice
+    # channel, this user included.
+    await ensure_server(after.server)
+
     # Check if user is not deafened or afk and in a voice channel.
     if (after.voice.voice_channel is not None and not after.voice.is_afk
             and not after.voice.deaf and not after.voice.self_deaf):
 
         # Possible another event occured that still allows user to have time 
-        # kept. Checks if that is the case by checking if there is already a 
-        # thread for the user.
-        if after.id not in active_threads[after.server.id]:
-            new_thread = TimeTracker(after.server, after)
-            new_thread.start()
-            active_threads[after.server.id].update({after.id:new_thread})
+        # kept. start_session does nothing if the user already has a session.
+        if session_engine.start_session(after.server.id, after.id):
+            schedule_rank_up(after.server.id, after.id)
 
     # Otherwise, check if we should stop accumulating time for the user.
     elif (after.voice.voice_channel is None or after.voice.is_afk
             or after.voice.deaf or after.voice.self_deaf):
+        session_engine.end_session(after.server.id, after.id)
+        rank_scheduler.cancel(after.server.id, after.id)
+
+@bot.event
+async def on_message(message):
+    """Event called for every message the bot can see.
+
+    Commands sent in a server that is not loaded yet wait for it to load,
+    for up to config["load_wait_time"] seconds, before they are processed.
+    Commands are only turned away by server_ready if loading takes longer.
+
+    """
+    server = message.server
+    if (server is not None and server.id not in ready_servers and
+            message.content.startswith(bot.command_prefix)):
         try:
-            del active_threads[after.server.id][after.id]
-        except KeyError as e:
-            return
+            await asyncio.wait_for(ensure_server(server),
+                    config["load_wait_time"])
+        except asyncio.TimeoutError as e:
+            pass
+    await bot.process_commands(message)
 
 @bot.event
 async def on_member_join(member):
-    check_stats_presence(member) 
+    member_index.add(member)
+
+    # A server still loading may have read its members before this one
+    # joined, so wait for it to be ready before checking.
+    await ensure_server(member.server)
+    check_stats_presence(member)
+
+@bot.event
+async def on_member_remove(member):
+    member_index.remove(member)
+
+@bot.event
+async def on_member_update(before, after):
+    if (before.name != after.name or
+            before.discriminator != after.discriminator):
+        member_index.add(after)
 
 @bot.event
 async def on_server_role_create(role):
@@ -283,10 +442,10 @@ async def on_server_role_create(role):
         
     """
     reciever = role.server.default_channel
+    role_index.refresh(role.server)
 
     # Checks if at least two ranks have the same name but have a different id.
-    if (utils.find(lambda rank: role.name == rank.name and 
-            role.id != rank.id, role.server.roles) is not None):
+    if len(role_index.named(role.server, role.name)) > 1:
 
         # Checks where to send the message.
         if reciever is None or reciever.type != ChannelType.text:
@@ -322,106 +481,32 @@ async def on_server_role_delete(role):
         
     """
     server_id = role.server.id
+    role_index.refresh(role.server)
 
     # If role didn't have a time associated with it, don't do anything.
-    if role.name not in server_configs[server_id]:
+    await ensure_server(role.server)
+    if role.name not in server_configs[server_id].milestones:
         return
-    times = global_member_times[server_id]
 
-    # Block any threads that might cause a race condition until roles are done
-    # updating.
-    server_events[server_id].clear()
-    for person in active_threads[server_id]:
-        while not active_threads[server_id][person].block_update:
-            continue
+    # Other reconfigurations of this server wait for this one to finish while
+    # rank ups skip the server until it is rescheduled.
+    async with server_locks[server_id]:
 
-    # Reorder role heirarchy, again, based on their associated times in
-    # ascending order.
-    role_index = role_orders[server_id].index(role.name)
-    old_server_configs = copy.deepcopy(server_configs[server_id])
-    previous_role_orders = copy.deepcopy(role_orders[server_id])
-
-    # Remove the role and any configuartions relying on it.
-    delete_config(server_id, role.name)
-    role_orders[server_id].remove(role.name)
-
-    # Looping over the difference in the two sets to ignore people on the
-    # whitelist.
-    for person in (set(times.keys()) - server_wl[server_id]):
-        person_obj = utils.find(lambda member: member.id == person,
-                                role.server.members)
-        if person_obj == None:
-            logger.error("%s: person_obj evaluated to None: %s" % 
-                    (role.server.id, person))
-
-        # given_roles is a list of a user's roles that do not have a time
-        # milestone associated with them. These should be returned to the user.
-        given_roles = [role for role in person_obj.roles 
-                if role.name not in role_orders[server_id]]
-
-        # If the user has achieved at least the role with the lowest time
-        # milestone, they could be affected
-        if times[person][1] - 1 >= 0:
-            curr_rank = previous_role_orders[times[person][1] - 1]
-            curr_rank_time = convert_time(old_server_configs[curr_rank])
-            curr_rank_pos = previous_role_orders.index(curr_rank)
-        else:
-            curr_rank = None
-            curr_rank_time = -1
-            curr_rank_pos = -1
-
-        # If the user can demote one role (they have a role below them that
-        # they can revert back to)
-        if times[person][1] - _HIGH_RANK >= 0:
-            previous_rank = previous_role_orders[times[person][1] - _HIGH_RANK]
-        else:
-            previous_rank = None
+        # Another reconfiguration may have removed the role while we waited.
+        settings = server_configs[server_id]
+        if role.name in settings.milestones:
+            await set_milestones(role.server,
+                    settings.without_milestone(role.name))
+    reschedule_server(server_id)
 
-        # If the user is the role that is being removed.
-        if curr_rank is not None and curr_rank == role.name:
+@bot.event
+async def on_server_role_update(before, after):
+    """Event called when a server's role is edited.
 
-            # Attempt to revoke their current role and replace it with a lower
-            # role or none at all (and give them back given_roles)
-            try:
-                await bot.replace_roles(person_obj, utils.find(
-                        lambda prev_obj: (prev_obj.name == previous_rank), 
-                        role.server.roles), *given_roles)
-
-            except (discord.errors.Forbidden, AttributeError) as e:
-                logger.info('%s:%s : Exception Occured' % 
-                        (person_obj.name, person))
-            times[person][1] -= 1
-            sql.update_user(role.server.id, person, 
-                    times[person][0], times[person][1])
-        
-        # User might have a role with higher time milestone than the one being
-        # removed. If so, just update underlying ranking structure to represent
-        # this. 
-        elif (times[person][1] > 0 and curr_rank is not None and
-                role_index < curr_rank_pos):
-            times[person][1] -= 1
-            sql.update_user(role.server.id, person, 
-                    times[person][0], times[person][1])
-
-        # Attempts to update some TimeTracker fields which are needed to update
-        # roles properly.
-        try:
-            
-            try:
-                next_rank = role_orders[server_id][times[person][1]]
-                next_rank_time = convert_time(
-                        server_configs[server_id][next_rank])
-                active_threads[server_id][person].next_rank = next_rank
-                active_threads[server_id][person].rank_time = next_rank_time
-
-            # Handles if user is already highest role.
-            except IndexError as e:
-                active_threads[server_id][person].rank_time = None
-
-        # Thread might not exist.
-        except (AttributeError, KeyError) as exc:
-            continue
-    server_events[server_id].set()
+    Keeps the role index current when roles are renamed.
+
+    """
+    role_index.refresh(after.server)
 
 @bot.event
 async def on_command_error(error, context):
@@ -439,6 +524,10 @@ async def on_command_error(error, context):
         await bot.send_message(channel, "You didn't provide me enough arguments"
                             + ". Checkout out the ~help command and try again!")
 
+    elif isinstance(error, ServerLoading):
+        await bot.send_message(channel, "I'm still loading this server's "
+                + "times. Give me a moment and try again!")
+
     elif isinstance(error, commands.CheckFailure):
         await bot.send_message(channel, "You're missing role managing"
               + "permissions!")
@@ -458,6 +547,40 @@ async def on_command_error(error, context):
 #------------COMMANDS------------#
 
 
+class ServerLoading(commands.CheckFailure):
+    """Raised when a command is used in a server that is still being set up."""
+
+
+@bot.check
+def server_ready(context):
+    """Global check that stops commands in servers still being set up.
+
+    Only fails if on_message gave up waiting for the server to load.
+
+    Args:
+        context (Context): Described in the discord.ext.commands API referece.
+
+    Returns:
+        bool: True if the command was not sent from a server or the server is
+            ready.
+
+    Raises:
+        ServerLoading: If the server is still being set up.
+
+    """
+    server = context.message.server
+    if server is None:
+        return True
+    last_used[server.id] = time.time()
+    if server.id in ready_servers:
+        return True
+
+    # Checks cannot wait, so make sure the server keeps loading for the next
+    # attempt.
+    bot.loop.create_task(ensure_server(server))
+    raise ServerLoading()
+
+
 @bot.command(pass_context=True)
 async def help(context, *cmd):
     """Sends custom help message to text channel.
@@ -469,6 +592,12 @@ async def help(context, *cmd):
             a help message with a list of acceptable arguments is sent.
         
     """
+    # Help messages never change, so any of them is built at most once.
+    key = (None, 'help', cmd[:1])
+    embeder = render_cache.get(key, None)
+    if embeder is not None:
+        await bot.send_message(context.message.channel, embed=embeder)
+        return
     embeder = Embed(colour=_HELP_COLOR, type='rich')
 
     # Attempts to find first argument from command.
@@ -478,14 +607,16 @@ async def help(context, *cmd):
 
     # Prepares default help message if could not find first argument.
     except (ValueError, KeyError, IndexError) as e:
+        key = (None, 'help', ())
         embeder.title = 'Command List'
-        embeder.description = ('~help settup\n~help my_time\n~help leaderboard'
-                        + '\n~help whitelist\n'
+        embeder.description = ('~help settup\n~help my_time\n~help my_rank'
+                        + '\n~help leaderboard\n~help whitelist\n'
                         + '~help unwhitelist\n~help whitelist_all\n~'
                         + 'help unwhitelist_all\n~help list_whitelist\n'
                         + '~help cleanslate\n~help ranktime\n'
                         + '~help rm_ranktime\n~help rm_usertime'
                         + '\n~help toggle_messages\n~github\n~donate')
+    render_cache.put(key, None, embeder)
     await bot.send_message(context.message.channel, embed=embeder)
 
 @bot.command(pass_context=True)
@@ -501,14 +632,17 @@ async def settup(context):
 
     """
     server_id = context.message.server.id
-    to_send = ''
-
-    # Loop prepares settup message.
-    for role in role_orders[server_id][::-1]:
-        to_send = (to_send + role + ': ' 
-                + server_configs[server_id][role] + '\n')
-    embeder = Embed(title='Rank Settup', colour=_SETTUP_COLOR, type='rich', 
-            description=to_send)
+    key = (server_id, 'settup', ())
+    version = config_versions.get(server_id, 0)
+    embeder = render_cache.get(key, version)
+    if embeder is None:
+        table = milestone_tables[server_id]
+        to_send = ''.join(role + ': ' + format_time(seconds) + '\n'
+                for role, seconds in zip(table.roles[::-1],
+                table.seconds[::-1]))
+        embeder = Embed(title='Rank Settup', colour=_SETTUP_COLOR,
+                type='rich', description=to_send)
+        render_cache.put(key, version, embeder)
     await bot.send_message(context.message.channel, embed=embeder)
     logger.debug(embeder.fields)
 
@@ -522,7 +656,8 @@ async def my_time(context):
     """
     try:
         times = global_member_times[context.message.server.id]
-        curr_time = convert_from_seconds(times[context.message.author.id][0])
+        curr_time = convert_from_seconds(
+                times[context.message.author.id].total())
         await bot.say('%s Hours, %s Minutes, %s Seconds' % curr_time)
     except KeyError as e:
         await bot.say('You haven\'t entered a voice channel in this server '
@@ -530,65 +665,76 @@ async def my_time(context):
                 + 'your time.')
 
 @bot.command(pass_context=True)
-async def leaderboard(context, amount):
+async def leaderboard(context, *args):
     """Lists users with the most time spent in voice channels in the server.
 
+    Time is counted over the last seven days, the current month or all time.
+    Weekly and monthly times are read from the precomputed activity buckets
+    rather than from session history. Members past the first page are shown
+    by asking for later pages.
+
     Args:
         context (Context): Described in the discord.ext.commands API referece.
-        amount (int): Amount of people to show on the leaderboard. Max is 15.
+        *args: Optionally "week", "month" or "all", the amount of people to
+            show on the leaderboard and the page to show. Max amount is 15,
+            which is the default. Page 1 is the default.
 
     """
+    period = 'all'
+    numbers = []
+    for arg in args:
+        if arg.lower() in _BOARD_TITLES:
+            period = arg.lower()
+        else:
+            numbers.append(arg)
+    amount = numbers[0] if numbers else str(_MAX_BOARD_SIZE)
+    page = numbers[1] if len(numbers) > 1 else '1'
+
     # Check if valid argument
     try:
         int_amount = int(amount)
+        int_page = int(page)
     except ValueError as e:
         await bot.say('A valid number must be entered. e.g., 1, 2, 3...')
         return
     if int_amount < 1 or int_amount > _MAX_BOARD_SIZE:
         await bot.say('Sorry! I only support numbers between 1 and 15.')
         return
+    if int_page < 1:
+        await bot.say('Pages start at 1.')
+        return
 
     server = context.message.server
-    times = global_member_times[server.id]
-    embeder = Embed(title=('Top %s Server Member Times' % amount), 
-            colour=_BOARD_COLOR, type='rich')
-
-    # Get users sorted by their accumuluated time in ascending order
-    to_sort = dict()
-    for person in times:
-        to_sort.update({person:times[person][0]})
-    sorted_list = sorted(to_sort, key=to_sort.get)
-    thumbnail = None
-
-    # top_x denotes the index of the last user on the leaderboard (when to stop
-    # looping)
-    top_x = (-1 * int_amount) - 1
-
-    # Loop backwards from sorted list of members to get people with the most
-    # time.
-    for person in sorted_list[:top_x:-1]:
-        try:
-            top_memb = utils.find(lambda member: member.id == person, 
-                    server.members)
-            time_spent = convert_from_seconds(times[person][0])
-
-            # If user has a default profile picture.
-            if thumbnail is None:
-                thumbnail = top_memb.avatar_url
+    key = (server.id, 'leaderboard', (period, int_amount, int_page))
+    version = session_engine.version(server.id)
+    embeder = render_cache.get(key, version)
+    if embeder is None:
+        embeder = await render_leaderboard(server, period, int_amount,
+                int_page)
+        if embeder is None:
+            await bot.say('There is no one on page %s of the leaderboard.'
+                    % int_page)
+            return
+        render_cache.put(key, version, embeder, config["render_cache_ttl"])
+    await bot.send_message(context.message.channel, embed=embeder)
 
-            # If user has a custom profile picture.
-            if thumbnail == '':
-                thumbnail = top_memb.default_avatar_url
+@bot.command(pass_context=True)
+async def my_rank(context):
+    """Tells users where they stand on the server's all time leaderboard.
 
-            embeder.add_field(name=top_memb.name, value=
-                    ('%s Hours, %s minutes, and %s seconds' % time_spent),
-                    inline=False)
-        except (AttributeError, ValueError, KeyError) as e:
-            logger.error(str(e))
-            top_x -= 1
+    Args:
+        context (Context): Described in the discord.ext.commands API referece.
 
-    embeder.set_thumbnail(url=thumbnail)
-    await bot.send_message(context.message.channel, embed=embeder)
+    """
+    try:
+        position, count = session_engine.position(context.message.server.id,
+                context.message.author.id)
+        await bot.say('You are #%s of %s members, in the top %.1f%% of the '
+                'server.' % (position, count, 100 * position / count))
+    except KeyError as e:
+        await bot.say('You haven\'t entered a voice channel in this server '
+                + 'since you last joined it! Join a voice channel to recieve '
+                + 'your rank.')
         
 
 @bot.command(pass_context=True)
@@ -621,14 +767,17 @@ async def whitelist(context, *name):
                 + 'Remember that the format for this command is \n\n'
                 + '`~whitelist [discord_username#XXXX]` '
                 + '(Names are case sensitive)'
-                + '\n\nExample usage: ```~whitelist Shouko Nishimiya#1234```')
+                + '\n\nExample usage: ```~whitelist Shouko Nishimiya#1234```'
+                + suggest_users(server, name))
 
     elif to_list.id in server_wl[server.id]:
         await bot.say('Member is already on the whitelist.')
 
     else:
         server_wl[server.id].add(to_list.id)
-        sql.whitelist_user(server.id, to_list.id)
+        wl_versions[server.id] = wl_versions.get(server.id, 0) + 1
+        rank_scheduler.cancel(server.id, to_list.id)
+        write_queue.whitelist_user(server.id, to_list.id)
         await bot.say('Whitelist successful!')
 
 @bot.command(pass_context=True)
@@ -658,32 +807,22 @@ async def unwhitelist(context, *name):
                 + '`~unwhitelist [discord_username#XXXX]` '
                 + '(Names are case sensitive)'
                 + '\n\n Example usage: '
-                + '```~unwhitelist Shouko Nishimiya#1234```')
+                + '```~unwhitelist Shouko Nishimiya#1234```'
+                + suggest_users(server, name))
     elif to_list.id not in server_wl[server.id]:
         await bot.say('Member is already not on the whitelist.')
 
     # This part updates the user's roles
     elif to_list.id in server_wl[server.id]:
         server_wl[server.id].remove(to_list.id)
-        times[to_list.id][1] = 0
-
-        try:
-
-            # Attempt to update TimeTracker thread if one exists. TimeTracker
-            # will handle the role updates.
-            try:
-                new_rank = role_orders[server.id][times[to_list.id][1]]
-                new_rank_time = convert_time(
-                        server_configs[server.id][new_rank])
-                active_threads[server.id][to_list.id].next_rank = new_rank
-                active_threads[server.id][to_list.id].rank_time = new_rank_time
-            except IndexError as e:
-                active_threads[server.id][to_list.id].rank_time = None
-
-        except (AttributeError, KeyError) as exc:
-            pass
-
-        sql.unwhitelist_user(server.id, to_list.id)
+        wl_versions[server.id] = wl_versions.get(server.id, 0) + 1
+
+        # If the user is in a voice channel, the rank scheduler will handle
+        # the role updates.
+        times[to_list.id].rank = 0
+        save_rank(server.id, to_list.id)
+        schedule_rank_up(server.id, to_list.id)
+        write_queue.unwhitelist_user(server.id, to_list.id)
         await bot.say('Member has been removed from the whitelist! Rank '
                         + 'should be given back after rejoining a voice '
                         + 'channel if not already returned.')
@@ -700,7 +839,13 @@ async def whitelist_all(context):
     server = context.message.server
     # Update server_wl dictionary.
     server_wl[server.id] = {member for member in global_member_times[server.id]}
-    sql.whitelist_all(server.id)
+    wl_versions[server.id] = wl_versions.get(server.id, 0) + 1
+    rank_scheduler.cancel_server(server.id)
+    write_ahead_log.append("whitelist_all", server.id, True)
+
+    # Queued whitelist changes must land first or they would undo this one.
+    await async_sql.flush(write_queue)
+    await async_sql.whitelist_all(server.id)
     await bot.say('Done!')
 
 @bot.command(pass_context=True)
@@ -716,20 +861,17 @@ async def unwhitelist_all(context):
     server = context.message.server
     times = global_member_times[server.id]
     server_wl[server.id] = set()
-    for person in times:
-        times[person][1] = 0
-        try:
-            try: 
-                new_rank = role_orders[server.id][times[person][1]]
-                new_rank_time = convert_time(
-                        server_configs[server.id][new_rank])
-                active_threads[server.id][person].next_rank = new_rank
-                active_threads[server.id][person].rank_time = new_rank_time
-            except IndexError as e:
-                active_threads[server.id][person].rank_time = None
-        except (AttributeError, KeyError) as exc:
-            pass
-    sql.unwhitelist_all(server.id)
+    wl_versions[server.id] = wl_versions.get(server.id, 0) + 1
+    reset = [(person, 0) for person in times if times[person].rank != 0]
+    for person, rank in reset:
+        times[person].rank = rank
+    write_queue.update_ranks(server.id, reset)
+    write_ahead_log.append("whitelist_all", server.id, False)
+    reschedule_server(server.id)
+
+    # Queued whitelist changes must land first or they would undo this one.
+    await async_sql.flush(write_queue)
+    await async_sql.unwhitelist_all(server.id)
     await bot.say('Done!')
 
 @bot.command(pass_context=True)
@@ -741,12 +883,20 @@ async def list_whitelist(context):
 
     """
     server = context.message.server
-    to_send = ''
-    for person in server_wl[server.id]:
-        to_list = utils.find(lambda member: member.id == person, server.members)
-        to_send = '%s%s#%s\n' % (to_send, to_list.name, to_list.discriminator)
-    embeder = Embed(title='Whitelist', colour=_WHITELIST_COLOR, type='rich', 
-            description=to_send)
+    key = (server.id, 'list_whitelist', ())
+    version = wl_versions.get(server.id, 0)
+    embeder = render_cache.get(key, version)
+    if embeder is None:
+        to_send = ''
+        for person in server_wl[server.id]:
+            to_list = server.get_member(person)
+            to_send = '%s%s#%s\n' % (to_send, to_list.name,
+                    to_list.discriminator)
+        embeder = Embed(title='Whitelist', colour=_WHITELIST_COLOR,
+                type='rich', description=to_send)
+
+        # Names can change without the whitelist changing.
+        render_cache.put(key, version, embeder, config["render_cache_ttl"])
     await bot.send_message(context.message.channel, embed=embeder)
 
 @bot.command(name='cleanslate', pass_context=True)
@@ -758,17 +908,19 @@ async def clean_slate(context):
     issues with manual assignment of roles as described before.
     (see: whitelist, server_wl) 
     Roles will be returned immediately to a user if they have a running
-    TimeTracker thread or whenever they start one. (Basically if they
-    are already in a voice channel or whenever they join one while not
-    deafened).
+    session or whenever they start one. (Basically if they are already in a
+    voice channel or whenever they join one while not deafened).
 
     Args:
         context (Context): Described in the discord.ext.commands API referece.
 
     """
     times = global_member_times[context.message.server.id]
-    for person in times:
-        times[person][1] = 0
+    reset = [(person, 0) for person in times if times[person].rank != 0]
+    for person, rank in reset:
+        times[person].rank = rank
+    write_queue.update_ranks(context.message.server.id, reset)
+    reschedule_server(context.message.server.id)
     await bot.say('Done!')
 
 @bot.command(name='ranktime', pass_context=True)
@@ -803,17 +955,13 @@ async def rank_time(context, *args):
     rank = ' '.join(args[:-1])
     time = args[-1]
     server_id = context.message.server.id
-    times = global_member_times[server_id]
-    count = 0
 
     # Search for roles with the same name.
-    for role in context.message.server.roles:
-        if role.name == rank:
-            count += 1
-            if(count > 1):
-                await bot.say('Cannot change rank time if multiple ranks have '
-                        + 'the same name.')
-                return
+    count = len(role_index.named(context.message.server, rank))
+    if count > 1:
+        await bot.say('Cannot change rank time if multiple ranks have '
+                + 'the same name.')
+        return
 
     # Couldn't find role at all.
     if count == 0:
@@ -821,12 +969,11 @@ async def rank_time(context, *args):
         return
 
     # Search for ranks with the same time
-    for a_rank in role_orders[server_id]:
-        if (server_configs[server_id][a_rank]) == time:
-            await bot.say('Sorry, we do not support ranks having the same times'
-                    + ' at this moment.')
-            return
-    new_time = convert_time(time)
+    new_time = parse_time(time)
+    if new_time in milestone_tables[server_id].seconds:
+        await bot.say('Sorry, we do not support ranks having the same times'
+                + ' at this moment.')
+        return
 
     # Incorrect arg format
     if new_time == None:
@@ -835,271 +982,12 @@ async def rank_time(context, *args):
                         + 'Example: ```~ranktime A Cool Role 002:06:34```')
         return
 
-
-    if rank in role_orders[server_id]:
-        # Attempt to prevent race conditions
-        server_events[server_id].clear()
-        for person in active_threads[server_id]:
-            while not active_threads[server_id][person].block_update:
-                continue
-
-        # We initialize deep copies of the old 
-        # configuration before the updates to be able to compare previous 
-        # role times and role positions in the hierarchy against the new ones.
-        old_server_configs = copy.deepcopy(server_configs[server_id])
-        change_config(server_id, rank, str(time))
-        previous_role_orders = copy.deepcopy(role_orders[server_id])
-        role_orders.update(
-                {server_id:get_roles_in_order(context.message.server)})
-
-        # Get integer role value.
-        rank_after_new = role_orders[server_id].index(rank)
-        rank_before_new = previous_role_orders.index(rank)
-        rank_obj = utils.find(lambda role: role.name == rank, 
-                context.message.server.roles)
-
-        # For all people not on the whitelist
-        for person in (set(times.keys()) - server_wl[server_id]):
-            person_obj = utils.find(lambda member: member.id == person,
-                                    context.message.server.members)
-
-            if person_obj == None:
-                logger.error("%s: person_obj evaluated to None: %s" % 
-                        (context.message.server.id, person))
-                continue
-
-            try:
-
-                # Get all roles without time milestones associated with them.
-                given_roles = [role for role in person_obj.roles 
-                        if role.name not in role_orders[server_id]]
-
-            except AttributeError as e:
-                pass
-
-            # Gets users' current role name with time milestone prior the
-            # server_config update.
-            if times[person][1] - 1 >= 0:
-                curr_rank = previous_role_orders[times[person][1] - 1]
-                curr_rank_time = convert_time(old_server_configs[curr_rank])
-                curr_rank_pos = previous_role_orders.index(curr_rank) 
-
-            # Users might not have one so set fields to these values to skip
-            # some steps.
-            else:
-                curr_rank = None
-                curr_rank_time = -1
-                curr_rank_pos = -1
-
-            # Check if user has roles in the role hierarchy below their own.
-            if times[person][1] - 2 >= 0:
-                previous_rank = previous_role_orders[times[person][1] - 2]
-                previous_rank_time = convert_time(
-                        old_server_configs[previous_rank])
-
-            # Skip some steps if not.
-            else:
-                previous_rank = None
-                previous_rank_time = 0
-
-            # If user has reached / passed new time milestone but does not yet
-            # have the rank, assign them the rank.
-            if  (curr_rank_time < new_time and times[person][0] >= new_time 
-                    and curr_rank != rank):
-                try:
-                    await bot.replace_roles(person_obj, rank_obj, *given_roles)
-                except discord.errors.Forbidden as e:
-                    logger.info('%s:%s : Failed to update' % 
-                            (person_obj.name, person))
-
-                # Sets up next rank to attain if there is one
-                if (times[person][1] < len(role_orders[server_id]) and 
-                        rank_before_new > curr_rank_pos):
-                    times[person][1] += 1
-                    sql.update_user(server_id, person, 
-                            times[person][0], times[person][1])
-
-            # We allow roles with existing time milestones to change as well. 
-            # This elif accounts for that.
-            elif curr_rank is not None and curr_rank == rank:
-
-                # If you are no longer at or beyond the required time milestone
-                # for your role.
-                if times[person][0] < new_time:
-
-                    # If you are already the lowest role, just revoke the role.
-                    # (And give back roles without milestones)
-                    if times[person][1] - 1 == 0:
-                        try:
-                            await bot.replace_roles(person_obj, *given_roles)
-                        except discord.errors.Forbidden as e:
-                            logger.info('%s:%s : Failed to update' % 
-                                    (person_obj.name, person))
-                            continue
-
-                    # Otherwise, attempt to give the user the role below theirs.
-                    elif times[person][1] - 1 > 0:
-                        previous_role = utils.find(lambda role: previous_rank 
-                                == role.name, context.message.server.roles)
-                        try:
-                            await bot.replace_roles(person_obj, previous_role, 
-                                    *given_roles)
-                        except discord.errors.Forbidden as e:
-                            logger.info('%s:%s : Failed to update' % 
-                                    (person_obj.name, person))
-                            continue
-
-                    # Update user's next role to attain.
-                    times[person][1] -= 1
-                    sql.update_user(server_id, person, 
-                            times[person][0], times[person][1])
-
-                # If the updated role is now below a role it was previously
-                # above, that means the user should recieve the previous
-                # role.
-                # Ex.               
-                #   Before update: [Peasant, Craftsman,     Noble, Royalty]
-                #                                            ^
-                #                                           User
-                #
-                #    After update: [Peasant,     Noble, Craftsman, Royalty]
-                #                                            ^
-                #                                           User
-                #
-                # i.e., the user was a Noble, but after some shifts in time,
-                # the user is now a craftsman, which is higher ranked than a
-                # Noble now.
-                elif (times[person][0] > new_time and 
-                        previous_rank_time > new_time):
-
-                    previous_role = utils.find(lambda role: previous_rank
-                            == role.name, context.message.server.roles)
-                    try:
-                        await bot.replace_roles(person_obj, previous_role, 
-                                *given_roles)
-                    except discord.errors.Forbidden as e:
-                        logger.info('%s:%s : Failed to update' % 
-                                (person_obj.name, person))
-                        continue
-
-            # Might not affect current role but need to update users' role
-            # integers to stay in line with role orders.
-            else:
-
-                # If the updated role was previously below the user's role
-                # but is now above the user's role and the user has not reached
-                # the new milestone, decrement role integer for next rank.
-                if (times[person][1] > 0 and curr_rank is not None and 
-                        rank_before_new < curr_rank_pos and
-                        rank_after_new >= curr_rank_pos):
-                    times[person][1] -= 1
-                    sql.update_user(server_id, person, 
-                            times[person][0], times[person][1])
-
-                # The reverse. If the updated role was previously above
-                # the user's role but is now below the user's role and the
-                # user has passed the time milestonem increment the 
-                # role integer for their next rank.
-                elif (times[person][1] < len(role_orders[server_id]) and
-                        curr_rank is not None and
-                        rank_before_new > curr_rank_pos and 
-                        rank_after_new <= curr_rank_pos):
-                    times[person][1] += 1
-                    sql.update_user(server_id, person, 
-                            times[person][0], times[person][1])
-
-            # Update TimeTracker thread fields.
-            try:
-                try:
-                    new_rank = role_orders[server_id][times[person][1]]
-                    new_rank_time = convert_time(
-                            server_configs[server_id][new_rank])
-                    active_threads[server_id][person].next_rank = new_rank
-                    active_threads[server_id][person].rank_time = new_rank_time
-                except IndexError as e:
-                    active_threads[server_id][person].rank_time = None
-            except (AttributeError, KeyError) as exc:
-                continue
-        server_events[server_id].set()
-
-    # Otherwise, a role that previously did not have a time milestone was
-    # added. This is only slightly more simple.
-    else:
-
-        # Try to prevent race conditions.
-        server_events[server_id].clear()
-        for person in active_threads[server_id]:
-            while not active_threads[server_id][person].block_update:
-                continue
-
-        # Again, get deep copies of previous role orders to compare with the
-        # updated role orders.
-        old_server_configs = copy.deepcopy(server_configs[server_id])
-        change_config(server_id, rank, str(time))
-        previous_role_orders = copy.deepcopy(role_orders[server_id])
-        role_orders.update(
-                {server_id:get_roles_in_order(context.message.server)})
-        rank_after_new = role_orders[server_id].index(rank)
-        rank_obj = utils.find(lambda role: role.name == rank, 
-                context.message.server.roles)
-
-        # For everyone not on the whitelist
-        for person in (set(times.keys()) - server_wl[server_id]):
-            person_obj = utils.find(lambda member: member.id == person,
-                                    context.message.server.members)
-
-            # Get all roles without time milestones to reassign to the user.
-            try:
-                given_roles = [role for role in person_obj.roles 
-                        if role.name not in role_orders[server_id]]
-            except AttributeError as e:
-                pass
-
-            # Gets user's current role name
-            if times[person][1] - 1 >= 0:
-                curr_rank = previous_role_orders[times[person][1] - 1]
-                curr_rank_time = convert_time(old_server_configs[curr_rank])
-                curr_rank_pos = role_orders[server_id].index(curr_rank)
-            else:
-                curr_rank = None
-                curr_rank_time = -1
-
-            # If user's current role is below the new role and the user has
-            # already reached the new role's time, assign the new role.
-            if curr_rank_time < new_time and times[person][0] >= new_time:
-                try:
-                    await bot.replace_roles(person_obj, rank_obj, *given_roles)
-                except discord.errors.Forbidden as e:
-                    logger.info('%s:%s : Failed to update' % 
-                            (person_obj.name, person))
-
-                # Update next role integer
-                if times[person][1] < len(role_orders[server_id]):
-                    times[person][1] += 1
-                    sql.update_user(server_id, person, times[person][0], 
-                            times[person][1])
-
-            # Otherwise, if the role is below the user's current role, just 
-            # update next role integer.
-            elif curr_rank is not None and rank_after_new < curr_rank_pos:
-                times[person][1] += 1
-                sql.update_user(server_id, person, times[person][0], 
-                        times[person][1])
-
-            # Update TimeTracker thread fields if it exists.
-            try:
-                try:
-                    new_rank = role_orders[server_id][times[person][1]]
-                    new_rank_time = convert_time(
-                            server_configs[server_id][new_rank])
-                    active_threads[server_id][person].next_rank = new_rank
-                    active_threads[server_id][person].rank_time = new_rank_time
-                except IndexError as e:
-                    active_threads[server_id][person].rank_time = None
-            except (AttributeError, KeyError) as exc:
-                continue
-
-        server_events[server_id].set()
+    # Other reconfigurations of this server wait for this one to finish while
+    # rank ups skip the server until it is rescheduled.
+    async with server_locks[server_id]:
+        await set_milestones(context.message.server,
+                server_configs[server_id].with_milestone(rank, new_time))
+    reschedule_server(server_id)
     await bot.say('Done!')
 
 @bot.command(pass_context=True)
@@ -1120,15 +1008,14 @@ async def rm_ranktime(context, *args):
         raise commands.MissingRequiredArgument()
     server = context.message.server
     rank = ' '.join(args)
-    if rank not in role_orders[server.id]:
+    if rank not in milestone_tables[server.id]:
         bot.say('Cannot find rank with the name %s.' % rank
                 + 'Usage: `~rm_ranktime [role_name]`\n'
                 + 'Example: ```~rm_ranktime A Cool Role```')
 
     # Updates user's roles.
     else:
-        await on_server_role_delete(utils.find(lambda role: role.name == rank, 
-                context.message.server.roles))
+        await on_server_role_delete(role_index.get(server, rank))
         await bot.say('Done!')
 
 @bot.command(pass_context=True)
@@ -1149,41 +1036,53 @@ async def rm_usertime(context, *args):
         raise commands.MissingRequiredArgument()
 
     server_id = context.message.server.id
+
+    # Reconciling applies differences to times, which a reset would throw off.
+    if server_id in unreconciled:
+        await bot.say("I'm still catching up on this server. Please try again "
+                + "in a moment.")
+        return
     user = find_user(context.message.server, args)
     if user is None:
-        await bot.say("I can't find this person.")
+        await bot.say("I can't find this person."
+                + suggest_users(context.message.server, args))
 
     # If user is found, reset role integer and time to 0.
     else:
         times = global_member_times[server_id]
         given_roles = [role for role in user.roles 
-                if role.name not in role_orders[server_id]]
-        times[user.id][0] = 0
-        times[user.id][1] = 0
-
-        # Attempt to update running TimeTracker threads.
-        try:
-            next_rank = role_orders[server_id][0]
-            rank_time = server_configs[server_id][next_rank]
-            active_threads[server_id][user.id].next_rank = next_rank
-            active_threads[server_id][user.id].rank_time = rank_time
-        except (KeyError, ValueError, IndexError) as e:
-            pass
-        await bot.replace_roles(user, *given_roles)
+                if role.name not in milestone_tables[server_id]]
+        times[user.id].banked = 0
+        times[user.id].rank = 0
+        session_engine.rebank(server_id, user.id)
+        save_rank(server_id, user.id)
+
+        # Discard time from the user's running session if there is one.
+        session_engine.restart_session(server_id, user.id)
+        session_ledger.reset(server_id, user.id)
+        schedule_rank_up(server_id, user.id)
+        if not await role_dispatcher.submit(user, given_roles):
+            await bot.say("I reset their time but couldn't take away their "
+                    + "ranks. Make sure my role is above theirs!")
+            return
         await bot.say("Done!")
 
 @bot.command(pass_context=True)
 @commands.has_permissions(manage_roles=True)
 async def toggle_messages(context):
-    """Updates _send_messages324906 (determines where to send certain messages).
+    """Toggles whether congratulations go to the server or to the user.
 
     Args:
         context (Context): Described in the discord.ext.commands API referece.
 
     """
     server_id = context.message.server.id
-    change_config(server_id, "_send_messages324906", 
-            not bool(server_configs[server_id]["_send_messages324906"]))
+    settings = server_configs[server_id]
+    change_config(server_id,
+            settings.with_send_messages(not settings.send_messages))
+
+    # Rank ups already waiting on Discord give up once the version changes.
+    reschedule_server(server_id)
 
 @bot.command(pass_context=True)
 async def github(context):
@@ -1215,92 +1114,549 @@ async def donate(context):
 
 
 
-def stats_start(server):
-    """Fills in global_member_times and server_wl dictionaries.
-    
-        Creates and populates a table in the database if no such table exists
-        for this server.
+async def join_all_servers(servers):
+    """Sets up many servers concurrently.
+
+    Servers are set up in batches of config["init_batch_size"], with at most
+    config["init_concurrency"] batches loading at the same time. Servers with
+    members in voice channels go first so their time starts counting as
+    soon as possible. Each server is usable as soon as its own batch is done.
+
+    Args:
+        servers (list): Server objects described in the Discord API reference
+            page.
+
+    """
+    servers = sorted(servers, key=lambda server: not any(
+            channel.voice_members for channel in server.channels))
+    limit = asyncio.Semaphore(config["init_concurrency"])
+    size = config["init_batch_size"]
+    results = await asyncio.gather(*[load_servers(servers[start:start + size],
+            limit) for start in range(0, len(servers), size)],
+            return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(''.join(traceback.format_exception(
+                    type(result), result, result.__traceback__)))
+
+
+def load_servers(servers, limit=None):
+    """Starts setting up servers which are neither loaded nor loading.
+
+    Args:
+        servers (list): Server objects described in the Discord API reference
+            page.
+        limit (Semaphore): Held while loading if given.
+
+    Returns:
+        Task: Finishes once every server given is set up.
+
+    """
+    servers = [server for server in servers
+            if server.id not in ready_servers and server.id not in loading]
+
+    async def load():
+        if limit is None:
+            await join_servers(servers)
+            return
+        async with limit:
+            await join_servers(servers)
+
+    task = bot.loop.create_task(load())
+    for server in servers:
+        loading[server.id] = task
+
+    def done(task):
+        for server in servers:
+            if loading.get(server.id) is task:
+                del loading[server.id]
+
+    task.add_done_callback(done)
+    return task
+
+
+async def ensure_server(server):
+    """Loads a server if it is not loaded yet and marks it as used.
 
     Args:
         server (Server): Server object described in the Discord API reference
-            page. We populate global_member_times with this server.
+            page.
 
     """
-    member_times = {}
-    server_wl[server.id] = set()
-    results = sql.fetch_all(server.id)
+    last_used[server.id] = time.time()
+    if server.id in ready_servers:
+        return
+    task = loading.get(server.id)
+    if task is None:
+        task = load_servers([server])
+    await asyncio.shield(task)
+
+
+def unload_server(server_id):
+    """Removes a server's configs and stats from the attribute dictionaries.
+
+    Sessions in the server are dropped without being banked.
+
+    Args:
+        server_id (string): Unique id of the server to unload.
+
+    """
+    last_used.pop(server_id, None)
+    unreconciled.discard(server_id)
+    if server_id not in ready_servers:
+        return
+
+    # Deletion of dictionary values.
+    ready_servers.discard(server_id)
+    try:
+        del global_member_times[server_id]
+        del server_configs[server_id]
+        del milestone_tables[server_id]
+        del server_wl[server_id]
+        del server_locks[server_id]
+    except (ValueError, KeyError) as e:
+        logger.error('Failed to remove server information from ' + server_id)
+
+    # Stops all running sessions in that server.
+    session_engine.remove_server(server_id)
+    rank_scheduler.cancel_server(server_id)
+    role_dispatcher.cancel_server(server_id)
+    render_cache.drop_server(server_id)
+    role_index.drop(server_id)
+    member_index.drop(server_id)
+
+
+async def evict_idle_servers():
+    """Unloads servers nobody has used in a while.
+
+    Runs forever on the event loop. A server is evicted once it has been
+    unused for config["evict_idle_time"] seconds, or sooner if more than
+    config["member_budget"] members are loaded, least recently used servers
+    first. Servers with members accumulating time, being reconfigured or
+    not yet reconciled with the database are never evicted, as reloading
+    the latter would restore them from the snapshot again. Everything
+    buffered is flushed first and servers used while flushing are kept, so
+    nothing is evicted with unwritten changes.
+
+    """
+    while True:
+        await asyncio.sleep(config["evict_check_time"])
+        try:
+            now = time.time()
+            loaded = sum(len(global_member_times[server_id])
+                    for server_id in ready_servers)
+            idle = sorted((server_id for server_id in ready_servers
+                    if not session_engine.active_users(server_id) and
+                    not server_locks[server_id].locked() and
+                    server_id not in unreconciled),
+                    key=lambda server_id: last_used.get(server_id, 0))
+            chosen = []
+            for server_id in idle:
+                if (now - last_used.get(server_id, 0) <
+                        config["evict_idle_time"] and
+                        loaded <= config["member_budget"]):
+                    break
+                chosen.append(server_id)
+                loaded -= len(global_member_times[server_id])
+            if not chosen:
+                continue
+
+            await async_sql.flush(session_ledger)
+            await async_sql.flush(write_queue)
+            for server_id in chosen:
+                if (server_id in ready_servers and
+                        last_used.get(server_id, 0) < now and
+                        not session_engine.active_users(server_id)):
+                    unload_server(server_id)
+            logger.info("Evicted %s idle servers", len(chosen))
+        except Exception as e:
+            logger.exception("Failed to evict idle servers")
+
+
+async def join_servers(servers):
+    """Sets up every attribute dictionary for the servers given.
+
+    Servers in the snapshot are restored from it. Others are read from the
+    database, and their configurations from their files, which are created
+    for new servers. Also starts sessions to start accumulating times for
+    users in voice channels upon the bot joining.
+
+    Args:
+        servers (list): Server objects described in the Discord API reference
+            page.
+
+    """
+    for server in servers:
+        if server.name is not None:
+            logger.info('Joining server ' + server.name)
+
+    # Fills up attribute dictionaries and creates appropriate text files.
+    restored = restore_servers(servers)
+    fresh = [server for server in servers if server.id not in restored]
+    await stats_start(fresh)
+    server_configs.update(await bot.loop.run_in_executor(None,
+            config_store.load_all, [server.id for server in fresh]))
+    for server in fresh:
+        milestone_tables[server.id] = compile_milestones(server)
+    for server in servers:
+        session_engine.add_server(server.id)
+        server_locks.update({server.id:asyncio.Lock()})
+        config_versions.setdefault(server.id, 0)
+
+        # Start sessions for people in voice channels.
+        message_user = False
+        for channel in server.channels:
+            for person in channel.voice_members:
+                m_voice = person.voice
+                if (not m_voice.is_afk and not m_voice.deaf and 
+                        not m_voice.self_deaf):
+                    session_engine.start_session(server.id, person.id)
+                    schedule_rank_up(server.id, person.id)
+        message_user = True
+        ready_servers.add(server.id)
+        last_used.setdefault(server.id, time.time())
+
+
+def restore_servers(servers):
+    """Fills in attribute dictionaries for servers found in the snapshot.
+
+    Members who joined while the bot was off are added.
+
+    Args:
+        servers (list): Server objects described in the Discord API reference
+            page.
+
+    Returns:
+        set: Unique ids of the servers restored.
 
-    # Table didn't exist. Create it
-    if results == None:
-        vals = []
+    """
+    restored = set()
+    if snapshot is None:
+        return restored
+    for server in servers:
+        state = snapshot.load(server.id)
+        if state is None:
+            continue
+        members, order, settings = state
+        times = dict()
+        whitelist = set()
+        for user_id, spent, rank, wl_status in members:
+            times[user_id] = MemberState(spent, rank)
+            if wl_status:
+                whitelist.add(user_id)
         for member in server.members:
-            vals.append((member.id,))
-            member_times[member.id] = [0, 0]
-        sql.create_table(server.id, vals)
+            if member.id not in times:
+                times[member.id] = MemberState()
+                write_queue.add_user(server.id, member.id)
 
-    # Otherwise use the results to populate global_member_times
-    else:
-        for result in results:
-            user_id = result[_ID_INDEX]
-            time = result[_TIME_INDEX]
-            rank = result[_RANK_INDEX]
+        global_member_times[server.id] = times
+        server_wl[server.id] = whitelist
+        milestone_tables[server.id] = MilestoneTable(settings.milestones,
+                order)
+        server_configs[server.id] = settings
+        unreconciled.add(server.id)
+        restored.add(server.id)
+    return restored
+
+
+async def open_snapshot():
+    """Opens the snapshot the previous run saved if it can be trusted.
+
+    It is trusted if the database still holds its token, so no other
+    snapshot was saved since and the database was not swapped out. Ledger
+    compaction is held off until the snapshot is reconciled.
+
+    Returns:
+        set: Unique ids of the servers in the snapshot. Empty if there is
+            no snapshot to trust.
+
+    """
+    global snapshot
+    opened = await bot.loop.run_in_executor(None, StateSnapshot.open,
+            config["snapshot_path"])
+    if opened is None:
+        return set()
+    if opened.token != await async_sql.snapshot_token():
+        logger.warning("Snapshot %s does not match the database", opened.token)
+        opened.close()
+        return set()
+    snapshot = opened
+    session_ledger.hold_compaction()
+    logger.info("Restoring %s servers from snapshot %s",
+            len(opened.server_ids()), opened.token)
+    return set(opened.server_ids())
+
+
+async def reconcile_snapshot():
+    """Brings servers restored from the snapshot in line with the database.
+
+    The database can be ahead of the snapshot, e.g. if the bot was killed
+    some time after saving it. Servers are reconciled in batches of
+    config["init_batch_size"] while the bot keeps serving them. The
+    snapshot is closed and compaction resumes once every restored server is
+    reconciled.
+
+    """
+    global snapshot
+    try:
+        while unreconciled:
+            batch = list(unreconciled)[:config["init_batch_size"]]
+            results = await async_sql.fetch_servers(batch, boot_time)
+            configs = await bot.loop.run_in_executor(None,
+                    config_store.load_all, batch)
+
+            stored = {server_id:dict() for server_id in batch}
+            for result in results:
+                stored[str(result[_SERVER_INDEX])][str(result[_ID_INDEX])] = (
+                        result)
+            for server_id in batch:
+                if server_id in unreconciled:
+                    reconcile_server(server_id, stored[server_id],
+                            configs[server_id])
+    except Exception as e:
+        logger.exception("Failed to reconcile snapshot")
+    finally:
+        unreconciled.clear()
+        snapshot.close()
+        snapshot = None
+        session_ledger.release_compaction()
+
+
+def reconcile_server(server_id, stored, settings):
+    """Applies what changed since the snapshot was saved to a server.
+
+    Each member's time in the snapshot is compared with their time in the
+    database counting only sessions from before this run, and the
+    difference is added to their current time so nothing since startup is
+    lost. Ranks, whitelist statuses and the configuration are taken from
+    the database and config files unless they changed since startup.
+
+    Args:
+        server_id (string): Unique id of the server to reconcile.
+        stored (dict): Holds (user_id, tuple) pairs where the tuple is the
+            member's row in the database.
+        settings (ServerConfig): The server's saved configuration.
+
+    """
+    unreconciled.discard(server_id)
+    members, order, snapshot_settings = snapshot.load(server_id)
+    baseline = {member[0]:member for member in members}
+    times = global_member_times[server_id]
+    whitelist = server_wl[server_id]
+
+    for user_id, result in stored.items():
+        spent, rank, wl_status = baseline.get(user_id,
+                (user_id, 0, 0, False))[1:]
+        state = times.setdefault(user_id, MemberState())
+        state.banked += result[_TIME_INDEX] - spent
+        session_engine.rebank(server_id, user_id)
+        if state.rank == rank:
+            state.rank = result[_RANK_INDEX]
+        if (user_id in whitelist) == wl_status:
             if result[_WL_STATUS_INDEX] == True:
-                server_wl[server.id].add(user_id)
-            member_times[user_id] = [time, rank]
-    global_member_times[server.id] = member_times
+                whitelist.add(user_id)
+            else:
+                whitelist.discard(user_id)
+    wl_versions[server_id] = wl_versions.get(server_id, 0) + 1
+    for user_id in times:
+        if user_id not in stored:
+            write_queue.add_user(server_id, user_id)
+
+    # Roles may have been renamed or deleted while the bot was off.
+    if (server_configs[server_id] == snapshot_settings and
+            settings != snapshot_settings):
+        server_configs[server_id] = settings
+        config_versions[server_id] = config_versions.get(server_id, 0) + 1
+    server = bot.get_server(server_id)
+    if server is not None:
+        table = compile_milestones(server)
+        if table != milestone_tables[server_id]:
+            milestone_tables[server_id] = table
+            config_versions[server_id] = config_versions.get(server_id, 0) + 1
+    reschedule_server(server_id)
+
+
+def capture_state():
+    """Copies every loaded server's state for a snapshot.
+
+    Times are taken up to where open sessions were last recorded in the
+    ledger, matching what the database will hold. Must be called from the
+    event loop's thread.
+
+    Returns:
+        list: (server_id, members, role_order, settings) tuples as taken by
+            write_snapshot.
+
+    """
+    servers = []
+    for server_id in ready_servers:
+        whitelist = server_wl[server_id]
+        members = [(user_id, state.total(state.recorded), state.rank,
+                user_id in whitelist) for user_id, state
+                in global_member_times[server_id].items()]
+        servers.append((server_id, members,
+                list(milestone_tables[server_id].roles),
+                server_configs[server_id]))
+    return servers
+
+
+def save_snapshot(servers):
+    """Writes servers' state to the snapshot file.
+
+    The snapshot's token is recorded in the database before the file
+    replaces the previous snapshot.
+
+    Args:
+        servers (list): (server_id, members, role_order, settings) tuples as
+            returned by capture_state.
+
+    """
+    token = random.getrandbits(63)
+    write_snapshot(config["snapshot_path"], token, servers,
+            lambda: sql.set_snapshot_token(token))
+
+
+async def stats_start(servers):
+    """Fills in global_member_times and server_wl dictionaries.
     
+        Every server's members are read in one streamed pass rather than a
+        query per server. Members who joined while the bot was off are added
+        to the database in one batch.
 
+    Args:
+        servers (list): Server objects described in the Discord API reference
+            page. We populate global_member_times with these servers.
+
+    """
+    member_times = {server.id:dict() for server in servers}
+    whitelists = {server.id:set() for server in servers}
+
+    results = await async_sql.fetch_servers(list(member_times))
+
+    for result in results:
+        server_id = str(result[_SERVER_INDEX])
+        user_id = str(result[_ID_INDEX])
+        time = result[_TIME_INDEX]
+        rank = result[_RANK_INDEX]
+        if result[_WL_STATUS_INDEX] == True:
+            whitelists[server_id].add(user_id)
+        member_times[server_id][user_id] = MemberState(time, rank)
+
+    missing = []
+    for server in servers:
+        server_times = member_times[server.id]
+        for member in server.members:
+            if member.id not in server_times:
+                server_times[member.id] = MemberState()
+                missing.append((server.id, member.id))
+    await async_sql.add_users(missing)
+    server_wl.update(whitelists)
+    global_member_times.update(member_times)
 
 
-def config_start(server):
-    """Fills in server_configs dictionary.
+async def period_times(server_id, period, now):
+    """Works out how much time each member spent in a server over a period.
 
-    Creates new text file with roles and their time milestones (if 
-    a time milestone exists) among other possible configurations. If a text
-    file already exists, the function reads from the existing text file to fill
-    in server_configs.
+    Activity buckets and sessions waiting in the ledger are summed by the
+    database. Sessions still buffered by the ledger and the part of open
+    sessions not yet recorded are added on top.
 
     Args:
-        server (Server): Server object described in the Discord API reference
-            page. We populate server_configs with this server.
+        server_id (string): Unique id of the server whose members are summed.
+        period (string): "week" or "month". (see: activity_rollups)
+        now (float): Timestamp the period ends at.
+
+    Returns:
+        dict: Holds (user_id, float) pairs of seconds spent in the period.
 
     """
-    # If file does not already exist, create one.
-    if not os.path.isfile(server.id + '.txt'):
-        try:
-            curr_config = open(server.id + '.txt', 'w+')
-
-            # _send_messages324906 is named as such to be unique from any
-            # possible role names. If this option is True, we send certain
-            # messages to the server's default channel. Otherwise, send
-            # messages directly to the users involved.
-            settings = {"_send_messages324906":True}
-            curr_config.write("_send_messages324906=True")
-        except:
-            raise
-        finally:
-            curr_config.close()
-
-    # Otherwise a file exists so read from that into server_configs.
+    span, since = period_start(period, now)
+    results = await async_sql.fetch_activity(server_id, span, since)
+
+    spent = {str(result[_ID_INDEX]):result[_TIME_INDEX] for result in results}
+    for user_id, start, end in session_ledger.buffered(server_id):
+        if end > since:
+            spent[user_id] = spent.get(user_id, 0) + end - max(start, since)
+    times = global_member_times[server_id]
+    for user_id in session_engine.active_users(server_id):
+        recorded = max(times[user_id].recorded, since)
+        if now > recorded:
+            spent[user_id] = spent.get(user_id, 0) + now - recorded
+    return spent
+
+
+async def render_leaderboard(server, period, amount, page):
+    """Builds a page of a server's leaderboard.
+
+    All time totals are read in order from the session engine. Weekly and
+    monthly totals are sorted once and the order is cached, so reading
+    other pages of the same leaderboard does not sort them again.
+
+    Args:
+        server (Server): Server to build the leaderboard of.
+        period (string): "week", "month" or "all".
+        amount (int): Amount of people on a page.
+        page (int): Page to build, starting from 1.
+
+    Returns:
+        Embed: The page, or None if no one is on it.
+
+    """
+    start = (page - 1) * amount
+    now = time.time()
+    if period == 'all':
+        top_list = session_engine.top(server.id, amount, now, start)
     else:
+        key = (server.id, 'leaderboard_order', period)
+        version = session_engine.version(server.id)
+        ordered = render_cache.get(key, version)
+        if ordered is None:
+            spent = await period_times(server.id, period, now)
+            ordered = sorted(spent.items(), key=lambda person: person[1],
+                    reverse=True)
+            render_cache.put(key, version, ordered,
+                    config["render_cache_ttl"], now)
+        top_list = ordered[start:start + amount]
+    if not top_list:
+        return None
+
+    if page == 1:
+        title = 'Top %s Server Member Times' % amount
+    else:
+        title = 'Server Member Times #%s-#%s' % (start + 1,
+                start + len(top_list))
+    embeder = Embed(title=title + _BOARD_TITLES[period], colour=_BOARD_COLOR,
+            type='rich')
+    thumbnail = None
+
+    for person, seconds in top_list:
         try:
-            curr_config = open(server.id + '.txt', 'r')
-            readable = curr_config.read()
-        except:
-            raise
-        finally:
-            curr_config.close()
+            top_memb = server.get_member(person)
+            time_spent = convert_from_seconds(seconds)
 
-        settings = dict(pair.split('=') for pair in readable.split(';'))
+            # If user has a default profile picture.
+            if thumbnail is None:
+                thumbnail = top_memb.avatar_url
+
+            # If user has a custom profile picture.
+            if thumbnail == '':
+                thumbnail = top_memb.default_avatar_url
 
-    server_configs.update({server.id:settings})
+            embeder.add_field(name=top_memb.name, value=
+                    ('%s Hours, %s minutes, and %s seconds' % time_spent),
+                    inline=False)
+        except (AttributeError, ValueError, KeyError) as e:
+            logger.error(str(e))
+
+    embeder.set_thumbnail(url=thumbnail)
+    return embeder
 
 
 def check_stats_presence(member):
     """Check if users are recorded in global_member_times and adds them if not.
     
-    This function is called when a a new user joins while the bot is on, or when
-    the bot starts up (meaning that new users joined while the bot was off).
+    This function is called when a a new user joins while the bot is on. Users
+    who joined while the bot was off are added by stats_start.
 
     Args:
         member (Member): Member object described in the Discord API reference
@@ -1308,122 +1664,317 @@ def check_stats_presence(member):
 
     """
     server_id = member.server.id
+
+    # Server was unloaded meanwhile. Loading it again adds the user.
+    if server_id not in ready_servers:
+        return
     if member.id not in global_member_times[server_id]:
-        global_member_times[server_id].update({member.id:[0, 0]})
-        sql.add_user(server_id, member.id)
+        global_member_times[server_id].update({member.id:MemberState()})
+        session_engine.rebank(server_id, member.id)
+        write_queue.add_user(server_id, member.id)
 
 
-def change_config(server_id, option, value):
-    """Changes a server's configuration for an option.
+async def set_milestones(server, settings):
+    """Replaces a server's time milestones and reassigns roles accordingly.
 
-    Used to change values in server_configs, namely roles and their times. Also
-    writes the changes to the appropriate file.
+    Must be called while holding the server's lock.
 
     Args:
-        server_id (string): Unique id of the server to change the option for.
-        option (string): Option to change value for.
-        value: Value to change option to. Type varies.
+        server (Server): Server object described in the Discord API reference
+            page.
+        settings (ServerConfig): Configuration holding the new milestones.
 
     """
-    settings = server_configs[server_id]
-    settings[option] = value
+    # Hold on to the previous table to know which roles members were given
+    # under it. Updates replace it rather than change it in place.
+    previous = milestone_tables[server.id]
+    change_config(server.id, settings)
+    milestone_tables[server.id] = compile_milestones(server)
+    await rerank_server(server, previous)
 
-    try:
-        new_config = open(server_id + '.txt', 'w+')
-        iterator = iter(settings)
-
-        # Format first key, value pair in text file without semi-colon to
-        # parse correctly later.
-        first_key = next(iterator)
-        new_config.write(first_key + '=' + str(settings[first_key]))
-
-        for key in iterator:
-            new_config.write(';' + key + '=' + str(settings[key]))
-    except:
-        raise
-    finally:
-        new_config.close()
 
+async def rerank_server(server, previous):
+    """Gives every member the role their time earns under the current table.
 
-def delete_config(server_id, option):
-    """Removes a server's option, value pair in their configuration.
-    
-    Also writes change to the appropriate file.
+    Every member's rank is worked out from their time in one pass, so
+    however the milestones moved, only members whose rank changed are
+    touched. Those who keep their role have their new ranks queued in one
+    batch and the rest are given their new role. Must be called while
+    holding the server's lock.
 
     Args:
-        server_id (string): Unique id of the server to change the option for.
-        option (string): Option to remove.
+        server (Server): Server object described in the Discord API reference
+            page.
+        previous (MilestoneTable): Table the members' ranks were given under.
 
     """
-    settings = server_configs[server_id]
-    del settings[option]
+    server_id = server.id
+    table = milestone_tables[server_id]
+    times = global_member_times[server_id]
 
-    try:
-        new_config = open(server_id + '.txt', 'w+')
-        iterator = iter(settings)
-        first_key = next(iterator)
-        # Format first key, value pair in text file without semi-colon to
-        # parse correctly later.
-        new_config.write(first_key + '=' + str(settings[first_key]))
-        for key in iterator:
-            new_config.write(';' + key + '=' + str(settings[key]))
-    except:
-        raise
-    finally:
-        new_config.close()
+    # For all people not on the whitelist
+    whitelist = server_wl[server_id]
+    members = [(person, state) for person, state in times.items()
+            if person not in whitelist]
+    ranked, reroled = plan_rerank(table, previous, members, time.time())
+    for person, rank in ranked:
+        times[person].rank = rank
+    write_queue.update_ranks(server_id, ranked)
+
+    # Only talk to Discord for members whose role changed. The changes are
+    # sent concurrently and members keep their old rank if theirs fails.
+    changes = []
+    for person, rank, new_role in reroled:
+        person_obj = server.get_member(person)
+        if person_obj is None:
+            logger.error("%s: person_obj evaluated to None: %s" %
+                    (server_id, person))
+            continue
+
+        # Roles without time milestones are given back to the user.
+        given_roles = [role for role in person_obj.roles
+                if role.name not in table and role.name not in previous]
+        ranked_role = role_index.get(server, new_role)
+        if ranked_role is not None:
+            given_roles.append(ranked_role)
+        changes.append((person, rank,
+                role_dispatcher.submit(person_obj, given_roles)))
+
+    applied = []
+    for person, rank, change in changes:
+        if await change:
+            times[person].rank = rank
+            applied.append((person, rank))
+    write_queue.update_ranks(server_id, applied)
+
+
+def schedule_rank_up(server_id, user_id):
+    """Schedules the moment a user reaches their next time milestone.
+
+    Any previous deadline for the user is replaced. If the user is not
+    accumulating time, is whitelisted, or already has the highest role, their
+    deadline is cancelled instead.
+
+    Args:
+        server_id (string): Unique id of the server the user is in.
+        user_id (string): Unique id of the user to schedule.
+
+    """
+    times = global_member_times[server_id]
+    if (not session_engine.is_active(server_id, user_id) or
+            user_id in server_wl[server_id] or user_id not in times):
+        rank_scheduler.cancel(server_id, user_id)
+        return
 
+    # If user is already the highest role, there is nothing to reach.
+    rank_time = milestone_tables[server_id].milestone(times[user_id].rank)
+    if rank_time is None:
+        rank_scheduler.cancel(server_id, user_id)
+        return
+    now = time.time()
+    remaining = rank_time - times[user_id].total(now)
+    rank_scheduler.schedule(server_id, user_id, now + max(remaining, 0))
 
-def convert_time(time):
-    """Converts hhh:mm:ss to seconds.
 
-    hhh represents hours, mm represents minutes, ss represents seconds.
+def reschedule_server(server_id):
+    """Recomputes rank up deadlines for everyone accumulating time in a server.
 
     Args:
-        time (string): Time to parse into seconds.
+        server_id (string): Unique id of the server to reschedule.
+
+    """
+    for user_id in session_engine.active_users(server_id):
+        schedule_rank_up(server_id, user_id)
+
+
+async def rank_up(server_id, user_id):
+    """Assigns a user their next rank once they reach its time milestone.
+
+    Called by the rank scheduler when the user's deadline expires. The user's
+    following deadline is scheduled afterwards.
+
+    Args:
+        server_id (string): Unique id of the server the user is in.
+        user_id (string): Unique id of the user to rank up.
+
+    """
+    # Other functions possibly updating some data. They reschedule the server
+    # once they finish.
+    if server_id not in ready_servers or server_locks[server_id].locked():
+        return
+    version = config_versions[server_id]
+    times = global_member_times[server_id]
+    table = milestone_tables[server_id]
+
+    # Deadline may be out of date, e.g. the user was whitelisted or the rank
+    # configuration changed. Let schedule_rank_up sort out which.
+    if user_id not in times:
+        return
+    rank = table.rank_of(times[user_id].total())
+    if user_id in server_wl[server_id] or rank <= times[user_id].rank:
+        schedule_rank_up(server_id, user_id)
+        return
+
+    server = bot.get_server(server_id)
+    member = server.get_member(user_id)
+    if member is None:
+        return
+    next_rank = table.role(rank)
+    next_role = role_index.get(server, next_rank)
+
+    # The role was deleted or renamed after its milestone was set. Keep the
+    # old rank so the member is tried again on their next session.
+    if next_role is None:
+        return
+    given_roles = [role for role in member.roles if role.name not in table]
+
+    # Keep the old rank if the role could not be given so the member is
+    # ranked up again on their next session rather than skipping a role.
+    if not await role_dispatcher.submit(member, [next_role] + given_roles):
+        return
+
+    # The rank configuration may have changed while we waited on Discord. The
+    # rank integer then no longer lines up, so leave it to the reschedule.
+    if (config_versions.get(server_id) != version or
+            server_locks[server_id].locked()):
+        return
+    times[user_id].rank = rank
+    curr_time = times[user_id].total()
+    save_rank(server_id, user_id)
+
+    # Prepare user's next role to reach.
+    schedule_rank_up(server_id, user_id)
+
+    if(message_user):
+
+        hours, minutes, seconds = convert_from_seconds(curr_time)
+        reciever = server.default_channel
+        fmt_tup = (member.mention, hours, minutes, seconds, next_rank)
+        message = ("Congratulations %s! You've spent a total of "
+                    + "in %s hours, %s minutes, and %s seconds in "
+                    + "this server's voice channels and have "
+                    + "therefore earned the rank of %s!") % fmt_tup
+
+        # Sends to server's default text channel if evaluates true.
+        if (reciever is not None and
+                reciever.type == ChannelType.text and
+                server_configs[server_id].send_messages):
+            await bot.send_message(reciever, message)
+
+        # Otherwise send message to the user directly.
+        else:
+            await bot.send_message(member, message)
+
+
+def save_rank(server_id, user_id):
+    """Queues a user's new rank to be written to the database.
+
+    The rank is also recorded in the write ahead log in case the bot dies
+    before the queue is flushed.
+
+    Args:
+        server_id (string): Unique id of the server the user is in.
+        user_id (string): Unique id of the user whose rank changed.
+
+    """
+    write_queue.update_rank(server_id, user_id,
+            global_member_times[server_id][user_id].rank)
+
+
+async def replay_wal(server_id):
+    """Writes changes a previous run left in the write ahead log to database.
+
+    Heartbeats of the same session share a start, so only the furthest one
+    is kept, however many other records came between them. Replaying is safe
+    to repeat as the ledger ignores sessions it already holds.
+
+    Args:
+        server_id (string): Unique id of the server to replay.
 
     Returns:
-        None: If the total seconds is less than 0 (somehow) or a ValueError
-            occurs.
-        int: Returns total seconds if successful and positive.
+        bool: True if anything was replayed.
 
     """
-    try:
-        hours, minutes, seconds = time.split(':')
-        hours = int(hours) * _MINUTES * _SECONDS
-        minutes = int(minutes) * _SECONDS
-        seconds = int(seconds)
-        final_time = hours + minutes + seconds
-        if final_time < 0:
-            return None
-        return final_time
-    except ValueError as e:
-        return None
+    records = write_ahead_log.recovered(server_id)
+    sessions = dict()
+    for record in records:
+        kind = record[0]
+        if kind == "session":
+            user_id, start, end = record[2:]
+            sessions[(user_id, start)] = max(end,
+                    sessions.get((user_id, start), end))
+        elif kind == "rank":
+            await async_sql.update_rank(server_id, record[2], record[3])
+        elif kind == "reset":
+
+            # The user's sessions recorded before a reset need to land first
+            # so it clears them as well. Sessions of other users are still
+            # merged with their later heartbeats.
+            user_id = record[2]
+            earlier = [(server_id, user_id, start, sessions.pop(
+                    (user_id, start))) for person, start in list(sessions)
+                    if person == user_id]
+            if earlier:
+                await async_sql.append_sessions(earlier)
+            await async_sql.reset_user(server_id, user_id)
+        elif kind == "whitelist":
+            await async_sql.update_whitelist([(server_id, record[2],
+                    record[3])])
+        elif kind == "whitelist_all" and record[2]:
+            await async_sql.whitelist_all(server_id)
+        elif kind == "whitelist_all":
+            await async_sql.unwhitelist_all(server_id)
+    if sessions:
+        await async_sql.append_sessions([(server_id, user_id, start, end)
+                for (user_id, start), end in sessions.items()])
+    if records:
+        logger.info("Replayed %s write ahead log records for %s",
+                len(records), server_id)
+    return len(records) > 0
+
+
+async def wal_heartbeat():
+    """Records how far open sessions have run in the write ahead log."""
+
+    while True:
+        await asyncio.sleep(config["wal_heartbeat_time"])
+        session_engine.heartbeat()
+
+
+def change_config(server_id, settings):
+    """Replaces a server's configuration.
+
+    Bumps the server's configuration version and queues the new
+    configuration to be saved to the server's file.
+
+    Args:
+        server_id (string): Unique id of the server to change the
+            configuration of.
+        settings (ServerConfig): New configuration.
 
+    """
+    # Configurations are replaced rather than changed in place so anyone
+    # holding on to the previous one keeps a consistent view of it.
+    server_configs[server_id] = settings
+    config_versions[server_id] = config_versions.get(server_id, 0) + 1
+    config_store.save(server_id, settings)
+
+
+def compile_milestones(server):
+    """Compiles a server's time milestones into a table.
 
-def get_roles_in_order(server):
-    """Returns a list of role names sorted by their time.
+    Roles with milestones that the server no longer has are left out.
 
     Args:
         server (Server): Server object described in the Discord API reference
             page. We get the unique id of the server from this object.
 
     Returns:
-        list: A list of a role names sorted by their time.
+        MilestoneTable: The server's roles sorted by their time.
 
     """
-    to_sort = dict()
-
-    # Put roles and time in a temporary dictionary to be able to sort into a
-    # list. In hindsight, I might as well have put _send_message329406 in
-    # another dictionary and text file because this is super ineffecient to do.
-    for role in server.roles:
-        try:
-            to_sort.update({role.name:convert_time(
-                    server_configs[server.id][role.name])})
-        except KeyError as e:
-            continue
-
-    return sorted(to_sort, key=to_sort.get)
+    return MilestoneTable(server_configs[server.id].milestones,
+            (role.name for role in server.roles))
 
 
 
@@ -1459,8 +2010,7 @@ def find_user(server, name_list):
                 username = last_name
             else:
                 username = username + ' ' + last_name
-            to_list = utils.find((lambda person: person.name == username and
-                    person.discriminator == discrim), server.members)
+            to_list = member_index.find(server, username, discrim)
 
             # Checks if found user.
             if to_list is None:
@@ -1473,6 +2023,32 @@ def find_user(server, name_list):
         return None
 
 
+def suggest_users(server, name_list):
+    """Lists members whose name starts like the name in a list.
+
+    Used to help when find_user fails. Ignores case and the discriminator.
+
+    Args:
+        server (Server): Server object described in the Discord API reference
+            page.
+        name_list (list): List to parse the name from. Comes from command
+            functions with variable length parameter lists.
+
+    Returns:
+        string: A sentence suggesting members, or an empty string if no
+            member's name starts like the given one.
+
+    """
+    name = ' '.join(name_list).rsplit('#', 1)[0]
+    if name == '':
+        return ''
+    found = member_index.suggest(server, name, _MAX_SUGGESTIONS)
+    if not found:
+        return ''
+    return '\n\nDid you mean: %s?' % ', '.join(
+            '%s#%s' % (member.name, member.discriminator) for member in found)
+
+
 def convert_from_seconds(time):
     """Converts seconds to a tuple of hours, minutes, and seconds.
 
@@ -1488,198 +2064,95 @@ def convert_from_seconds(time):
     hours = int((time - (minutes * _MINUTES) - seconds) / _SECONDS / _MINUTES)
     return (str(hours), str(minutes), str(seconds))
 
-def clean_up(sig_num, stack_frame):
-    """Ends extra threads before exiting program.
+def clean_up():
+    """Writes member times to the database before exiting program.
+
+    Runs on the event loop's thread after the signal handler has returned, so
+    whatever the signal interrupted has let go of its locks.
 
-    Arguments are documented in Python's official documentation.
     """
-    for server in active_threads:
-        sql.update_server(server, global_member_times[server])
-        logger.info("Updated database for %s", server)
-        for member in active_threads[server]:
-            if active_threads[server].get(member) != None:
-                active_threads[server][member].bot_in_server = False
+    session_engine.checkpoint()
+    segments = session_ledger.rotate_wal()
+    session_ledger.flush()
+    write_queue.flush()
+    config_store.flush()
+    logger.info("Updated database")
+    try:
+        save_snapshot(capture_state())
+    except Exception as e:
+        logger.exception("Failed to write snapshot")
+    write_ahead_log.discard(segments)
+    write_ahead_log.close()
+    async_sql.close()
     logging.shutdown()
     time.sleep(config["wait_time"])
 
-for sig in (SIGINT, SIGTERM):
-    signal(sig, clean_up)
-
-#------------THREADING CLASSES------------#
-
-
+def on_signal(sig_num, stack_frame):
+    """Schedules clean_up on the event loop when the bot is told to stop.
 
-class TimeTracker(threading.Thread):
-    """Threading class that tracks user time in voice channels.
+    None of the locks clean_up takes are reentrant, so running it inside the
+    handler would deadlock if the signal interrupted code holding one.
 
-    This class is a means to track all user times seperatley while assigning
-    roles accordingly.
-
-    Attributes:
-        server (Server): Server object described in the Discord API reference.
-            Used to find out what server this user belongs to.
-
-        member (Member): Member object described in the Discord API reference.
-            This is the user to start the thread for.
+    Arguments are documented in Python's official documentation.
+    """
+    bot.loop.call_soon_threadsafe(clean_up)
 
-        member_time: Total time spent in the server's voice channels. Type can
-            be float or int.
+for sig in (SIGINT, SIGTERM):
+    signal(sig, on_signal)
 
-        bot_in_server (bool): True if bot is in the server. False otherwise.
+#------------THREADING CLASSES------------#
 
-        stat_event (Event): Threading module's Event object to prevent race
-            conditions.
 
-        block_update (bool): Begins as False and constantly changes. Used
-            to try to prevent race conditions.
 
-        next_rank (int): Role integer of next role for user to attain.
+class PeriodicUpdater(threading.Thread):
+    """Updates database periodically.
 
-        rank_time (int): Time required to achieve next_rank.
+    Records open sessions in the session ledger and flushes it along with the
+    write queue. Write ahead log segments are discarded once
+    everything they recorded has been written. A snapshot of every loaded
+    server is saved afterwards.
 
     """
 
-    def __init__(self, server, member):
-        """Initializes TimeTracker instance the specified user.
-
-        Args:
-            server (Server): Server object described in the Discord API 
-                reference. Used to find out what server this user belongs to.
-            member (Member): Member object described in the Discord API
-                reference. This is the user to start the thread for.
+    def __init__(self):
+        """Initializes thread."""
 
-        """
-        super().__init__()
-        times = global_member_times[server.id]
-        self.server = server
-        self.member = member
-        self.member_time = times[member.id][0]
-        self.bot_in_server = True
-        self.stat_event = server_events[server.id]
-        self.block_update = False
-        try:
-            self.next_rank = role_orders[server.id][times[member.id][1]]
-            self.rank_time = convert_time(
-                    server_configs[server.id][self.next_rank])
+        super().__init__(daemon=True)
 
-        # If user is already the highest role, set to None.
-        except IndexError as e:
-            self.rank_time = None
 
-    def run(self):
-        """Starts thread to begin tracking user's time.
+    def capture(self):
+        """Runs capture_state on the event loop's thread and waits for it.
 
-        Also updates roles if user has reached a time milestone.
+        Returns:
+            list: What capture_state returns.
 
         """
-        now = time.time()
-        times = global_member_times[self.server.id]
+        captured = concurrent.futures.Future()
 
-        # While the user is not deafened, not afk, and the bot is in the server.
-        while (not self.member.voice.deaf and 
-                not self.member.voice.self_deaf and 
-                self.member.voice.voice_channel is not None and 
-                not self.member.voice.is_afk and self.bot_in_server):
-
-            # For some reason server_wl for curr server doesn't exist sometimes
+        def run():
             try:
-                curr_wl = server_wl[self.server.id]
-            except KeyError as e:
-                curr_wl = set()
-                server_wl[self.server.id] = curr_wl
-
-            times[self.member.id][0] = self.member_time + time.time() - now
-
-            # Other functions possibly updating some data, so wait for those to
-            # finish first.
-            self.block_update = True
-            self.stat_event.wait()
-            self.block_update = False
-
-            # If the user is not whitelisted and has reached a time milestone.
-            if (self.member.id not in curr_wl and 
-                    self.rank_time is not None and 
-                    self.member_time + time.time() >= self.rank_time + now):
-
-                given_roles = [role for role in self.member.roles 
-                        if role.name not in role_orders[self.server.id]]
-
-                try:
-                    # This is so we can update roles from this seperate thread 
-                    # which wouldn't be possible otherwise as replace_roles is 
-                    # a coroutine.
-                    future = asyncio.run_coroutine_threadsafe(
-                            bot.replace_roles(self.member, utils.find(
-                            lambda role: role.name == self.next_rank
-                            , self.server.roles), *given_roles), bot.loop)
-                    future.result()
-                except discord.errors.Forbidden as e:
-                    logger.error(str(e))
-
-                times[self.member.id][1] += 1
-                curr_time = times[self.member.id][0]
-                rank = times[self.member.id][1]
-                sql.update_user(self.server.id, self.member.id, curr_time, rank)
-
-                if(message_user):
-
-                    hours, minutes, seconds = convert_from_seconds(
-                            times[self.member.id][0])
-                    reciever = self.server.default_channel
-                    fmt_tup = (self.member.mention, hours, minutes, seconds,
-                                    self.next_rank)
-                    message = ("Congratulations %s! You've spent a total of "
-                                + "in %s hours, %s minutes, and %s seconds in "
-                                + "this server's voice channels and have "
-                                + "therefore earned the rank of %s!") % fmt_tup
-
-                    # Sends to server's default text channel if evaluates true.
-                    if (reciever is not None and 
-                            reciever.type == ChannelType.text and
-                            bool(server_configs[self.server.id]
-                            ["_send_messages324906"])):
-
-                        future = asyncio.run_coroutine_threadsafe(
-                                bot.send_message(reciever, message), bot.loop)
-
-                    # Otherwise send message to the user that this thread belongs 
-                    # to
-                    else:
-                        future = asyncio.run_coroutine_threadsafe(
-                                bot.send_message(self.member, message), 
-                                bot.loop)
-                    future.result()
-
-                # Prepare user's next role to reach.
-                try:
-                    self.next_rank = (role_orders[self.server.id]
-                            [times[self.member.id][1]])
-                    self.rank_time = convert_time(
-                            server_configs[self.server.id][self.next_rank])
-                    rank_time = self.rank_time + now
-                except IndexError as e:
-                    self.rank_time = None
-
-
-class PeriodicUpdater(threading.Thread):
-    """Updates database periodically.
-
-    Writes updated user times and role integers to database
-
-    """
-
-    def __init__(self):
-        """Initializes thread."""
-
-        super().__init__(daemon=True)
+                captured.set_result(capture_state())
+            except Exception as e:
+                captured.set_exception(e)
 
+        bot.loop.call_soon_threadsafe(run)
+        return captured.result()
 
     def run(self):
         """Constantly updates database"""
 
         while True:
-            for server in bot.servers:
-                sql.update_server(server.id, global_member_times[server.id])
+            segments = session_ledger.rotate_wal()
+
+            # Sessions can only be touched from the event loop's thread.
+            bot.loop.call_soon_threadsafe(session_engine.checkpoint)
+            try:
+                session_ledger.flush()
+                write_queue.flush()
+                write_ahead_log.discard(segments)
+                save_snapshot(self.capture())
+            except Exception as e:
+                logger.exception("Periodic update failed")
             time.sleep(config["sleep_time"])
 
 bot.run(config['test_token'])
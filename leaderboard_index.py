@@ -0,0 +1,199 @@
+"""
+Defines the ordered index of member times kept for each server's
+leaderboard.
+
+"""
+
+import random
+
+_MAX_LEVEL = 32               # Levels a skip list node can reach. Plenty for
+                              # 2 ** 32 members.
+_PROMOTE = 0.25               # Chance a node reaches each further level.
+
+
+def _random_level():
+    """Private helper to pick how many levels a new node reaches.
+
+    Returns:
+        int: Between 1 and _MAX_LEVEL.
+
+    """
+    level = 1
+    while level < _MAX_LEVEL and random.random() < _PROMOTE:
+        level += 1
+    return level
+
+
+class _Node():
+    """A skip list node.
+
+    Attributes:
+        key (tuple): (negated time, user_id) so the longest time sorts first.
+
+        next (list): Following node on each level the node reaches.
+
+        width (list): How many nodes each link in next skips over, plus one.
+
+    """
+
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+class LeaderboardIndex():
+    """Members of one server ordered by time, longest first.
+
+    An indexable skip list. Each link also records how many members it skips
+    over, so a member's position is found in O(log n) and the top k members
+    are read in O(k + log n). Ties in time are ordered by user id.
+
+    Attributes:
+        _head (_Node): Node in front of every member.
+
+        _level (int): Amount of levels in use.
+
+        _keys (dict): Holds (user_id, tuple) pairs where the tuple is the
+            member's key in the skip list.
+
+    """
+
+    def __init__(self, members=()):
+        """Builds the index.
+
+        Args:
+            members (iterable): (user_id, time) pairs to start with.
+
+        """
+        self._head = _Node(None, _MAX_LEVEL)
+        self._level = 1
+        self._keys = {user_id:(-spent, user_id) for user_id, spent in members}
+
+        # Linking the members in order avoids searching for each of them.
+        tails = [self._head] * _MAX_LEVEL
+        positions = [0] * _MAX_LEVEL
+        for position, key in enumerate(sorted(self._keys.values()), 1):
+            level = _random_level()
+            self._level = max(self._level, level)
+            node = _Node(key, level)
+            for index in range(level):
+                tails[index].next[index] = node
+                tails[index].width[index] = position - positions[index]
+                tails[index] = node
+                positions[index] = position
+        for index in range(_MAX_LEVEL):
+            tails[index].width[index] = len(self._keys) + 1 - positions[index]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, user_id):
+        return user_id in self._keys
+
+    def _find(self, key):
+        """Private helper to find the last node before a key on each level.
+
+        Args:
+            key (tuple): Key to search for.
+
+        Returns:
+            tuple: (chain, steps) where chain holds the last node before
+                key on each level and steps how many members come up to and
+                including each of those nodes.
+
+        """
+        chain = [self._head] * self._level
+        steps = [0] * self._level
+        node = self._head
+        position = 0
+        for level in range(self._level - 1, -1, -1):
+            while (node.next[level] is not None and
+                    node.next[level].key < key):
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            steps[level] = position
+        return chain, steps
+
+    def set(self, user_id, spent):
+        """Adds a member or moves them to their new time.
+
+        Args:
+            user_id (string): Unique identifier for the user.
+            spent (float): The member's time.
+
+        """
+        self.discard(user_id)
+        key = (-spent, user_id)
+        level = _random_level()
+        if level > self._level:
+            for unused in range(self._level, level):
+                self._head.width[unused] = len(self._keys) + 1
+            self._level = level
+
+        chain, steps = self._find(key)
+        node = _Node(key, level)
+        position = steps[0] + 1
+        for index in range(level):
+            before = chain[index]
+            node.next[index] = before.next[index]
+            before.next[index] = node
+            skipped = position - steps[index]
+            node.width[index] = before.width[index] - skipped + 1
+            before.width[index] = skipped
+        for index in range(level, self._level):
+            chain[index].width[index] += 1
+        self._keys[user_id] = key
+
+    def discard(self, user_id):
+        """Removes a member if they are in the index.
+
+        Args:
+            user_id (string): Unique identifier for the user.
+
+        """
+        key = self._keys.pop(user_id, None)
+        if key is None:
+            return
+        chain, steps = self._find(key)
+        node = chain[0].next[0]
+        for index in range(self._level):
+            before = chain[index]
+            if before.next[index] is node:
+                before.width[index] += node.width[index] - 1
+                before.next[index] = node.next[index]
+            else:
+                before.width[index] -= 1
+
+    def top(self, amount):
+        """Reads the members with the longest times.
+
+        Args:
+            amount (int): Maximum amount of members to read.
+
+        Returns:
+            list: (user_id, time) pairs, longest time first.
+
+        """
+        found = []
+        node = self._head.next[0]
+        while node is not None and len(found) < amount:
+            found.append((node.key[1], -node.key[0]))
+            node = node.next[0]
+        return found
+
+    def count_above(self, spent):
+        """Counts members with a longer time than given.
+
+        Args:
+            spent (float): Time to compare against.
+
+        Returns:
+            int: Amount of members with a strictly longer time.
+
+        """
+        chain, steps = self._find((-spent,))
+        return steps[0]
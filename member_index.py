@@ -0,0 +1,209 @@
+"""
+Defines the index of each server's members by username.
+
+"""
+
+
+class _TrieNode():
+    """A node of the name trie.
+
+    Attributes:
+        children (dict): Holds (character, _TrieNode) pairs.
+
+        ids (set): User ids of the members whose name ends at this node.
+
+    """
+
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children = dict()
+        self.ids = set()
+
+
+def _normalize(name):
+    """Private helper to fold a name for case-insensitive matching.
+
+    Args:
+        name (string): Name to fold.
+
+    Returns:
+        string: The folded name.
+
+    """
+    return name.casefold()
+
+
+class MemberIndex():
+    """Finds a server's members by username without scanning server.members.
+
+    Each server gets a dictionary keyed by (name, discriminator) for exact
+    lookups and a trie over case folded names for suggestions. A server's
+    index is built the first time it is needed and then kept current from
+    member join, leave and update events.
+
+    Attributes:
+        _exact (dict): Holds (server_id, dict) pairs where the dictionary
+            value holds ((name, discriminator), user_id) pairs.
+
+        _tries (dict): Holds (server_id, _TrieNode) pairs where the node is
+            the root of the server's name trie.
+
+        _names (dict): Holds (server_id, dict) pairs where the dictionary
+            value holds (user_id, tuple) pairs. The tuple is the
+            (name, discriminator) the member is indexed under.
+
+    """
+
+    def __init__(self):
+        self._exact = dict()
+        self._tries = dict()
+        self._names = dict()
+
+    def _build(self, server):
+        """Private helper to index a server's members if not done yet.
+
+        Args:
+            server (Server): Server object described in the Discord API
+                reference page.
+
+        """
+        if server.id in self._names:
+            return
+        self._exact[server.id] = dict()
+        self._tries[server.id] = _TrieNode()
+        self._names[server.id] = dict()
+        for member in server.members:
+            self._insert(server.id, member)
+
+    def _insert(self, server_id, member):
+        """Private helper to index one member of a built server.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            member (Member): Member object described in the Discord API
+                reference page.
+
+        """
+        key = (member.name, member.discriminator)
+        self._exact[server_id][key] = member.id
+        self._names[server_id][member.id] = key
+        node = self._tries[server_id]
+        for character in _normalize(member.name):
+            node = node.children.setdefault(character, _TrieNode())
+        node.ids.add(member.id)
+
+    def _remove(self, server_id, user_id):
+        """Private helper to unindex one member of a built server.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+
+        """
+        key = self._names[server_id].pop(user_id, None)
+        if key is None:
+            return
+        if self._exact[server_id].get(key) == user_id:
+            del self._exact[server_id][key]
+
+        # Walk down to the name, then prune nodes left without members.
+        path = [self._tries[server_id]]
+        for character in _normalize(key[0]):
+            node = path[-1].children.get(character)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].ids.discard(user_id)
+        folded = _normalize(key[0])
+        for depth in range(len(folded), 0, -1):
+            node = path[depth]
+            if node.ids or node.children:
+                break
+            del path[depth - 1].children[folded[depth - 1]]
+
+    def add(self, member):
+        """Indexes a member who joined or changed their name.
+
+        Args:
+            member (Member): Member object described in the Discord API
+                reference page.
+
+        """
+        if member.server.id not in self._names:
+            return
+        self._remove(member.server.id, member.id)
+        self._insert(member.server.id, member)
+
+    def remove(self, member):
+        """Unindexes a member who left.
+
+        Args:
+            member (Member): Member object described in the Discord API
+                reference page.
+
+        """
+        if member.server.id in self._names:
+            self._remove(member.server.id, member.id)
+
+    def find(self, server, name, discriminator):
+        """Finds a member by their exact username.
+
+        Args:
+            server (Server): Server object described in the Discord API
+                reference page.
+            name (string): The member's name. Case sensitive.
+            discriminator (string): The four digits after the name.
+
+        Returns:
+            Member: The member, or None if there is no such member.
+
+        """
+        self._build(server)
+        user_id = self._exact[server.id].get((name, discriminator))
+        return None if user_id is None else server.get_member(user_id)
+
+    def suggest(self, server, prefix, limit):
+        """Finds members whose name starts with a prefix, ignoring case.
+
+        Args:
+            server (Server): Server object described in the Discord API
+                reference page.
+            prefix (string): Start of the name.
+            limit (int): Maximum amount of members to find.
+
+        Returns:
+            list: Member objects, shortest names first.
+
+        """
+        self._build(server)
+        node = self._tries[server.id]
+        for character in _normalize(prefix):
+            node = node.children.get(character)
+            if node is None:
+                return []
+
+        # Breadth first so the closest matches come first.
+        found = []
+        level = [node]
+        while level and len(found) < limit:
+            following = []
+            for node in level:
+                for user_id in node.ids:
+                    member = server.get_member(user_id)
+                    if member is not None and len(found) < limit:
+                        found.append(member)
+                following.extend(node.children.values())
+            level = following
+        return found
+
+    def drop(self, server_id):
+        """Forgets a server's index.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        """
+        self._exact.pop(server_id, None)
+        self._tries.pop(server_id, None)
+        self._names.pop(server_id, None)
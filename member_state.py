@@ -0,0 +1,64 @@
+"""
+Defines the per server state kept for each member.
+
+"""
+
+import time
+
+
+class MemberState():
+    """A member's accumulated time and rank in one server.
+
+    Time is never accumulated continuously. Instead the state holds the time
+    banked from closed sessions plus when the open session, if any, started.
+    Readers work out the total with total() whenever they need it, so the
+    state is only written when a session starts or ends.
+
+    Attributes:
+        banked (float): Seconds banked from closed sessions.
+
+        rank (int): Integer representing the member's next role in the role
+            hierarchy organized by role orders.
+
+        session_start (float): Timestamp the open session started at, or None
+            if the member is not accumulating time.
+
+        recorded (float): Timestamp the open session has been written to the
+            session ledger up to, or None if there is no open session.
+
+    """
+
+    __slots__ = ("banked", "rank", "session_start", "recorded")
+
+    def __init__(self, banked=0, rank=0):
+        """Initializes state for a member without an open session.
+
+        Args:
+            banked (float): Seconds already banked.
+            rank (int): Integer representation of the member's next role.
+
+        """
+        self.banked = banked
+        self.rank = rank
+        self.session_start = None
+        self.recorded = None
+
+    def __repr__(self):
+        return "MemberState(%r, %r, %r)" % (self.banked, self.rank,
+                self.session_start)
+
+    def total(self, now=None):
+        """Works out the member's total time including any open session.
+
+        Args:
+            now (float): Timestamp to compute the total at. Defaults to the
+                current time.
+
+        Returns:
+            float: Total seconds spent in the server's voice channels.
+
+        """
+        if self.session_start is None:
+            return self.banked
+        now = time.time() if now is None else now
+        return self.banked + now - self.session_start
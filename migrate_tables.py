@@ -0,0 +1,44 @@
+"""
+Moves member data out of the per server tables used by earlier versions of
+Shouko and into the shared member_times table.
+
+Safe to run while the bot is online. Each server's table is merged in its
+own transaction and recorded in a migration log, so stopping the tool part
+way and running it again never counts a table twice. Migrated tables are
+renamed with a _legacy suffix, or dropped if --drop is given. A running bot
+picks up the merged totals of servers it had already loaded once it
+restarts.
+
+Example:
+
+    $ python3 migrate_tables.py [--drop]
+
+
+"""
+import sys
+import json
+from sql_wrapper import SQLWrapper
+
+
+def main(drop):
+    """Migrates every legacy table left in the database.
+
+    Args:
+        drop (bool): Drops migrated tables if True instead of renaming them.
+
+    """
+    with open('config.json', 'r') as file:
+        config = json.load(file)
+
+    sql = SQLWrapper(config["db_config"])
+    tables = sql.legacy_tables()
+    for count, name in enumerate(tables, 1):
+        if sql.migrate_legacy_table(name):
+            print('%s/%s: migrated %s' % (count, len(tables), name))
+        else:
+            print('%s/%s: %s was already migrated' % (count, len(tables), name))
+        sql.retire_legacy_table(name, drop)
+
+
+if __name__ == '__main__':
+    main('--drop' in sys.argv[1:])
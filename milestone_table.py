@@ -0,0 +1,133 @@
+"""
+Defines the compiled table of a server's time milestones.
+
+"""
+
+import bisect
+
+# numpy is optional. Without it ranks are found one bisect at a time.
+try:
+    import numpy
+except ImportError as e:
+    numpy = None
+
+
+class MilestoneTable():
+    """A server's ranked roles ordered by their time milestones.
+
+    Never changed after it is built. A member's rank is the amount of
+    milestones their time has reached, found by bisecting the sorted
+    milestones, so ranks can always be worked out from time alone.
+
+    Ex.
+
+                Role Hierarchy: [Peasant, Craftsman, Noble, Royalty]
+                    Milestones: [    100,       200,   300,     400]
+
+        A member with 250 seconds has a rank of 2 and holds Craftsman.
+
+    Attributes:
+        roles (tuple): Role names in ascending order of milestone.
+
+        seconds (tuple): Milestone of each role in roles, in seconds.
+
+        _positions (dict): Holds (role, int) pairs where int is the role's
+            index in roles.
+
+    """
+
+    __slots__ = ("roles", "seconds", "_positions")
+
+    def __init__(self, milestones=None, present=None):
+        """Compiles the table.
+
+        Args:
+            milestones (dict): Holds (role, int) pairs where int is the
+                role's milestone in seconds.
+            present (iterable): Names of the roles the server has. Milestones
+                of other roles are left out. All are kept if not given.
+
+        """
+        milestones = milestones or dict()
+        if present is not None:
+            present = set(present)
+            milestones = {role:seconds for role, seconds in milestones.items()
+                    if role in present}
+        ordered = sorted(milestones, key=lambda role: (milestones[role], role))
+        self.roles = tuple(ordered)
+        self.seconds = tuple(milestones[role] for role in ordered)
+        self._positions = {role:index for index, role in enumerate(ordered)}
+
+    def __len__(self):
+        return len(self.roles)
+
+    def __contains__(self, role):
+        return role in self._positions
+
+    def __eq__(self, other):
+        return (isinstance(other, MilestoneTable) and
+                self.roles == other.roles and self.seconds == other.seconds)
+
+    def __repr__(self):
+        return "MilestoneTable(%r)" % dict(zip(self.roles, self.seconds))
+
+    def rank_of(self, spent):
+        """Works out the rank a time earns.
+
+        Args:
+            spent (float): Time in seconds.
+
+        Returns:
+            int: Amount of milestones reached.
+
+        """
+        return bisect.bisect_right(self.seconds, spent)
+
+    def rank_many(self, spent):
+        """Works out the ranks of many times in one pass.
+
+        Uses numpy's searchsorted when numpy is installed.
+
+        Args:
+            spent (array): Times in seconds, as an array of doubles.
+
+        Returns:
+            list: Rank of each time, in the same order.
+
+        """
+        if numpy is not None:
+            return numpy.searchsorted(numpy.asarray(self.seconds),
+                    numpy.frombuffer(spent, dtype=numpy.float64),
+                    side="right").tolist()
+        seconds = self.seconds
+        find = bisect.bisect_right
+        return [find(seconds, each) for each in spent]
+
+    def role(self, rank):
+        """Names the role held at a rank.
+
+        Args:
+            rank (int): Amount of milestones reached.
+
+        Returns:
+            string: Name of the highest role reached, or None for rank 0.
+
+        """
+        if rank <= 0:
+            return None
+        return self.roles[min(rank, len(self.roles)) - 1]
+
+    def milestone(self, rank):
+        """Finds the milestone following a rank.
+
+        Args:
+            rank (int): Amount of milestones reached.
+
+        Returns:
+            int: Seconds needed for the next rank, or None if rank is the
+                highest.
+
+        """
+        if rank < len(self.seconds):
+            return self.seconds[rank]
+        return None
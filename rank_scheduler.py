@@ -0,0 +1,206 @@
+"""
+Defines the deadline driven scheduler used to fire rank ups.
+
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import traceback
+
+logger = logging.getLogger("discord")
+_COMPACT_RATIO = 2            # Rebuild the heap once stale entries outnumber
+                              # live ones by this factor.
+
+
+class RankScheduler():
+    """Keeps every active member's next rank up deadline in a timer heap.
+
+    Scheduling and cancelling cost O(log n). Cancelled or replaced deadlines
+    are left in the heap and skipped when they surface, so nothing has to be
+    searched for. A single coroutine sleeps until the earliest deadline and
+    only wakes early if an even earlier one is scheduled. Each expired
+    deadline is handled in its own task so a slow one never holds up the
+    rest.
+
+    Attributes:
+        _heap (list): Heap of (deadline, sequence, server_id, user_id) tuples.
+
+        _entries (dict): Holds (server_id, dict) pairs where the dictionary
+            value holds (user_id, int) pairs. The int is the sequence number
+            of the user's live heap entry. Any heap entry whose sequence does
+            not match is stale.
+
+        _sequence (int): Sequence number given to the next heap entry.
+
+        _live (int): Amount of live deadlines.
+
+        _wakeup (Event): Set when the earliest deadline changes.
+
+        _firing (set): Tasks handling expired deadlines which have not
+            finished yet. Kept so they are not garbage collected.
+
+        running (bool): True once run has been scheduled on the event loop.
+
+    """
+
+    def __init__(self):
+        """Initializes an empty scheduler."""
+
+        self._heap = []
+        self._entries = dict()
+        self._sequence = 0
+        self._live = 0
+        self._wakeup = asyncio.Event()
+        self._firing = set()
+        self.running = False
+
+    def __len__(self):
+        """Returns the amount of live deadlines."""
+
+        return self._live
+
+    def schedule(self, server_id, user_id, deadline):
+        """Sets a user's rank up deadline, replacing any previous one.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            deadline (float): Timestamp at which the user reaches their next
+                time milestone.
+
+        """
+        self._sequence += 1
+        users = self._entries.setdefault(server_id, dict())
+        if user_id not in users:
+            self._live += 1
+        users[user_id] = self._sequence
+        entry = (deadline, self._sequence, server_id, user_id)
+        heapq.heappush(self._heap, entry)
+
+        # Only wake the scheduler if this is now the earliest deadline.
+        if self._heap[0] is entry:
+            self._wakeup.set()
+        self._maybe_compact()
+
+    def cancel(self, server_id, user_id):
+        """Removes a user's rank up deadline if they have one.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+
+        """
+        users = self._entries.get(server_id)
+        if users is not None and users.pop(user_id, None) is not None:
+            self._live -= 1
+
+    def cancel_server(self, server_id):
+        """Removes every rank up deadline for a server.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        """
+        self._live -= len(self._entries.pop(server_id, ()))
+        self._maybe_compact()
+
+    def _is_live(self, entry):
+        """Private helper to check if a heap entry has not been replaced.
+
+        Args:
+            entry (tuple): Heap entry to check.
+
+        Returns:
+            bool: True if the entry is the user's current deadline.
+
+        """
+        deadline, sequence, server_id, user_id = entry
+        return self._entries.get(server_id, dict()).get(user_id) == sequence
+
+    def _maybe_compact(self):
+        """Private helper to drop stale entries once they pile up."""
+
+        if len(self._heap) > _COMPACT_RATIO * self._live + 1:
+            self._heap = [entry for entry in self._heap if self._is_live(entry)]
+            heapq.heapify(self._heap)
+
+    def _pop_expired(self, now):
+        """Private helper to pop the earliest live deadline if it expired.
+
+        Args:
+            now (float): Current timestamp.
+
+        Returns:
+            tuple: (server_id, user_id) if a deadline expired, otherwise None.
+
+        """
+        while self._heap:
+            entry = self._heap[0]
+            if not self._is_live(entry):
+                heapq.heappop(self._heap)
+                continue
+            if entry[0] > now:
+                return None
+            heapq.heappop(self._heap)
+            deadline, sequence, server_id, user_id = entry
+            del self._entries[server_id][user_id]
+            self._live -= 1
+            return (server_id, user_id)
+        return None
+
+    def _next_deadline(self):
+        """Private helper to peek at the earliest live deadline.
+
+        Returns:
+            float: Earliest deadline, or None if nothing is scheduled.
+
+        """
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def _fired(self, task):
+        """Private helper to forget a finished task and log its error.
+
+        Args:
+            task (Task): Task that handled an expired deadline.
+
+        """
+        self._firing.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        e = task.exception()
+        logger.error(''.join(traceback.format_exception(
+                type(e), e, e.__traceback__)))
+
+    async def run(self, on_expire):
+        """Fires deadlines as they expire.
+
+        Meant to be scheduled once on the bot's event loop.
+
+        Args:
+            on_expire (coroutine function): Called with (server_id, user_id)
+                once the user's deadline has passed. Calls for different
+                users run concurrently.
+
+        """
+        self.running = True
+        while True:
+            self._wakeup.clear()
+            expired = self._pop_expired(time.time())
+            if expired is not None:
+                task = asyncio.get_event_loop().create_task(
+                        on_expire(*expired))
+                self._firing.add(task)
+                task.add_done_callback(self._fired)
+                continue
+
+            # Sleep until the next deadline or until an earlier one is added.
+            deadline = self._next_deadline()
+            timeout = None if deadline is None else deadline - time.time()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError as e:
+                pass
@@ -0,0 +1,97 @@
+"""
+Defines the cache of rendered command replies.
+
+"""
+
+import time
+from collections import OrderedDict
+
+
+class RenderCache():
+    """Keeps rendered replies so repeated commands skip building them.
+
+    Entries are keyed by (server_id, command, arguments) and stored with the
+    version of the state they were rendered from. An entry is only reused
+    while the caller's current version still matches it and it has not
+    outlived its time to live, so replies showing live times go stale after
+    a few seconds at most. The least recently used entries are dropped once
+    the cache is full.
+
+    Attributes:
+        _max_size (int): Maximum amount of entries kept.
+
+        _entries (OrderedDict): Holds (key, tuple) pairs where the tuple is
+            (version, expiry, value). Ordered from least to most recently
+            used.
+
+    """
+
+    def __init__(self, max_size):
+        """Initializes an empty cache.
+
+        Args:
+            max_size (int): Maximum amount of entries kept.
+
+        """
+        self._max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version, now=None):
+        """Reads an entry if it is still current.
+
+        Args:
+            key (tuple): (server_id, command, arguments) the entry is kept
+                under.
+            version: Version of the state the reply would be rendered from
+                now. Compared to the version the entry was rendered from.
+            now (float): Timestamp to check expiry against. Defaults to the
+                current time.
+
+        Returns:
+            The cached value, or None if there is no current entry.
+
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        cached_version, expiry, value = entry
+        if cached_version != version or expiry <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, version, value, ttl=None, now=None):
+        """Stores a rendered reply.
+
+        Args:
+            key (tuple): (server_id, command, arguments) to keep the entry
+                under.
+            version: Version of the state the reply was rendered from.
+            value: The rendered reply.
+            ttl (float): Seconds the entry may be reused for. Kept until its
+                version changes if not given.
+            now (float): Timestamp the reply was rendered at. Defaults to the
+                current time.
+
+        """
+        now = time.time() if now is None else now
+        expiry = float('inf') if ttl is None else now + ttl
+        self._entries[key] = (version, expiry, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def drop_server(self, server_id):
+        """Removes every entry rendered for a server.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        """
+        for key in [key for key in self._entries if key[0] == server_id]:
+            del self._entries[key]
@@ -0,0 +1,281 @@
+"""
+Defines the dispatcher every role change is sent to Discord through.
+
+"""
+
+import asyncio
+import logging
+import traceback
+from collections import deque
+from collections import OrderedDict
+
+logger = logging.getLogger("discord")
+_TOO_MANY_REQUESTS = 429      # HTTP status Discord rate limits with.
+
+
+def _status(error):
+    """Private helper to read the HTTP status an error came with.
+
+    Args:
+        error (Exception): Error raised while sending a change.
+
+    Returns:
+        int: The status, or None if the error did not come from a response.
+
+    """
+    return getattr(getattr(error, "response", None), "status", None)
+
+
+def _resolve(future, result):
+    """Private helper to resolve a future unless its waiter gave up on it.
+
+    Args:
+        future (Future): Future to resolve.
+        result (bool): Result to resolve it with.
+
+    """
+    if not future.done():
+        future.set_result(result)
+
+
+def _chain(future, following):
+    """Private helper to resolve a future once another one is.
+
+    Args:
+        future (Future): Future to resolve.
+        following (Future): Future whose result is copied.
+
+    """
+    following.add_done_callback(lambda done: _resolve(future,
+            not done.cancelled() and done.result()))
+
+
+class _Change():
+    """A member's role set waiting to be sent.
+
+    Attributes:
+        member (Member): Member to give the roles to.
+
+        roles (list): Every role the member should end up with.
+
+        future (Future): Resolved with True once the roles are applied, or
+            False if they could not be.
+
+    """
+
+    __slots__ = ("member", "roles", "future")
+
+    def __init__(self, member, roles, future):
+        self.member = member
+        self.roles = roles
+        self.future = future
+
+
+class RoleDispatcher():
+    """Sends role changes to Discord from per server queues.
+
+    Each server has its own queue holding at most one change per member. A
+    change queued for a member who already has one waiting replaces its
+    role set, so only the final roles are sent. Workers take turns between
+    servers, one change per turn, so a server re-ranking thousands of
+    members only gets its share. Discord rate limits role changes per
+    server, so only a few changes per server are in flight at once while
+    different servers are sent to concurrently. Rate limited changes are
+    retried with exponential backoff.
+
+    Attributes:
+        _send (coroutine function): Called with a member followed by their
+            roles to replace the member's roles.
+
+        _workers (int): Amount of changes in flight at once overall.
+
+        _per_server (int): Amount of changes in flight at once per server.
+
+        _retries (int): Times a rate limited change is retried.
+
+        _backoff (float): Seconds to wait before the first retry. Doubled
+            for each following one.
+
+        _queues (dict): Holds (server_id, OrderedDict) pairs where the
+            OrderedDict holds (user_id, _Change) pairs in the order they
+            were queued.
+
+        _turns (deque): Server ids with queued changes, in the order they
+            get their next turn.
+
+        _busy (dict): Holds (server_id, int) pairs where the int is the
+            amount of the server's changes in flight.
+
+        _in_flight (set): Holds (server_id, user_id) pairs of members with a
+            change in flight. Their next change waits for it to finish.
+
+        _wakeup (Event): Set when a change is queued or one finishes.
+
+        running (bool): True once run has been scheduled on the event loop.
+
+    """
+
+    def __init__(self, send, workers, per_server, retries, backoff):
+        """Initializes an empty dispatcher.
+
+        Args:
+            send (coroutine function): Called with a member followed by their
+                roles to replace the member's roles.
+            workers (int): Amount of changes in flight at once overall.
+            per_server (int): Amount of changes in flight at once per server.
+            retries (int): Times a rate limited change is retried.
+            backoff (float): Seconds to wait before the first retry.
+
+        """
+        self._send = send
+        self._workers = workers
+        self._per_server = per_server
+        self._retries = retries
+        self._backoff = backoff
+        self._queues = dict()
+        self._turns = deque()
+        self._busy = dict()
+        self._in_flight = set()
+        self._wakeup = asyncio.Event()
+        self.running = False
+
+    def __len__(self):
+        """Returns the amount of queued changes."""
+
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, member, roles):
+        """Queues replacing a member's roles.
+
+        Args:
+            member (Member): Member object described in the Discord API
+                reference page.
+            roles (list): Every role the member should end up with.
+
+        Returns:
+            Future: Resolved with True once the member's roles are replaced,
+                possibly by a later change, or False if they could not be.
+
+        """
+        server_id = member.server.id
+        queue = self._queues.get(server_id)
+        if queue is None:
+            queue = self._queues[server_id] = OrderedDict()
+            self._turns.append(server_id)
+        waiting = queue.get(member.id)
+        if waiting is not None:
+            waiting.member = member
+            waiting.roles = list(roles)
+            return waiting.future
+        future = asyncio.get_event_loop().create_future()
+        queue[member.id] = _Change(member, list(roles), future)
+        self._wakeup.set()
+        return future
+
+    def cancel_server(self, server_id):
+        """Drops every queued change for a server.
+
+        Changes already in flight still finish.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        """
+        queue = self._queues.pop(server_id, None)
+        if queue is None:
+            return
+        self._turns.remove(server_id)
+        for change in queue.values():
+            _resolve(change.future, False)
+
+    def _next(self):
+        """Private helper to take the next change in turn.
+
+        Servers with their share of changes in flight are passed over, as
+        are members whose previous change is still in flight.
+
+        Returns:
+            tuple: (server_id, user_id, _Change), or None if nothing can be
+                sent right now.
+
+        """
+        for turn in range(len(self._turns)):
+            server_id = self._turns.popleft()
+            queue = self._queues[server_id]
+            taken = None
+            if self._busy.get(server_id, 0) < self._per_server:
+                for user_id in queue:
+                    if (server_id, user_id) not in self._in_flight:
+                        taken = (server_id, user_id, queue.pop(user_id))
+                        break
+            if queue:
+                self._turns.append(server_id)
+            else:
+                del self._queues[server_id]
+            if taken is not None:
+                return taken
+        return None
+
+    async def _apply(self, server_id, user_id, change):
+        """Private helper to send a change, retrying if rate limited.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            change (_Change): Change to send.
+
+        """
+        for attempt in range(self._retries + 1):
+            try:
+                await self._send(change.member, *change.roles)
+                _resolve(change.future, True)
+                return
+            except Exception as e:
+                if (_status(e) != _TOO_MANY_REQUESTS or
+                        attempt == self._retries):
+                    logger.info('%s:%s : Failed to update roles: %s' %
+                            (change.member.name, user_id, e))
+                    _resolve(change.future, False)
+                    return
+            await asyncio.sleep(self._backoff * 2 ** attempt)
+
+            # A change queued meanwhile holds newer roles, so send that one.
+            newer = self._queues.get(server_id, dict()).get(user_id)
+            if newer is not None:
+                _chain(change.future, newer.future)
+                return
+
+    async def _work(self):
+        """Private helper run by each worker to send changes as they come."""
+
+        while True:
+            job = self._next()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            server_id, user_id, change = job
+            self._busy[server_id] = self._busy.get(server_id, 0) + 1
+            self._in_flight.add((server_id, user_id))
+            try:
+                await self._apply(server_id, user_id, change)
+            except Exception as e:
+                logger.error(''.join(traceback.format_exception(
+                        type(e), e, e.__traceback__)))
+                _resolve(change.future, False)
+            finally:
+                self._in_flight.discard((server_id, user_id))
+                self._busy[server_id] -= 1
+                if not self._busy[server_id]:
+                    del self._busy[server_id]
+                self._wakeup.set()
+
+    async def run(self):
+        """Sends queued changes until cancelled.
+
+        Meant to be scheduled once on the bot's event loop.
+
+        """
+        self.running = True
+        await asyncio.gather(*[self._work() for worker
+                in range(self._workers)])
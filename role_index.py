@@ -0,0 +1,91 @@
+"""
+Defines the index of each server's roles by name.
+
+"""
+
+
+class RoleIndex():
+    """Finds a server's roles by name without scanning server.roles.
+
+    Each server's index is built the first time it is needed and rebuilt
+    whenever one of its roles is created, deleted or updated, so lookups in
+    per member loops cost O(1). Role names are not unique, so every role
+    with a name is kept in the order server.roles lists them.
+
+    Attributes:
+        _roles (dict): Holds (server_id, dict) pairs where the dictionary
+            value holds (name, list) pairs. The list holds the server's Role
+            objects with that name.
+
+    """
+
+    def __init__(self):
+        self._roles = dict()
+
+    def _index(self, server):
+        """Private helper to read a server's index, building it if needed.
+
+        Args:
+            server (Server): Server object described in the Discord API
+                reference page.
+
+        Returns:
+            dict: Holds (name, list) pairs.
+
+        """
+        index = self._roles.get(server.id)
+        if index is None:
+            index = dict()
+            for role in server.roles:
+                index.setdefault(role.name, []).append(role)
+            self._roles[server.id] = index
+        return index
+
+    def get(self, server, name):
+        """Finds a role by name.
+
+        Args:
+            server (Server): Server object described in the Discord API
+                reference page.
+            name (string): Name of the role.
+
+        Returns:
+            Role: The first role with the name, or None if there is none.
+
+        """
+        roles = self._index(server).get(name)
+        return roles[0] if roles else None
+
+    def named(self, server, name):
+        """Finds every role with a name.
+
+        Args:
+            server (Server): Server object described in the Discord API
+                reference page.
+            name (string): Name of the roles.
+
+        Returns:
+            list: Role objects with the name. Empty if there are none.
+
+        """
+        return list(self._index(server).get(name, ()))
+
+    def refresh(self, server):
+        """Rebuilds a server's index after its roles changed.
+
+        Args:
+            server (Server): Server object described in the Discord API
+                reference page.
+
+        """
+        self._roles.pop(server.id, None)
+        self._index(server)
+
+    def drop(self, server_id):
+        """Forgets a server's index.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        """
+        self._roles.pop(server_id, None)
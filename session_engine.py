@@ -0,0 +1,313 @@
+"""
+Defines the session engine which keeps track of voice channel time for every
+server from inside the bot's event loop.
+
+"""
+
+import time
+import heapq
+import logging
+from leaderboard_index import LeaderboardIndex
+
+logger = logging.getLogger("discord")
+
+
+class SessionEngine():
+    """Tracks voice channel sessions for all servers on a single event loop.
+
+    Rather than keeping a thread alive for each member in a voice channel, the
+    engine only records the moment a member began accumulating time on their
+    MemberState. Accrued time is worked out from that timestamp whenever it is
+    needed, so idle cost does not grow with the amount of people in voice
+    channels. Reaching time milestones is left to the RankScheduler.
+
+    Members without an open session have a fixed total, so they are kept
+    ordered in a LeaderboardIndex per server as sessions bank time. Members
+    with an open session are left out of it and ranked among them when
+    asked, which keeps leaderboard queries exact.
+
+    Attributes:
+        _member_times (dict): Reference to global_member_times.
+
+        _ledger (SessionLedger): Ledger that closed session intervals are
+            appended to.
+
+        _active (dict): Holds (server_id, set) pairs where the set holds the
+            user ids with an open session in that server.
+
+        _boards (dict): Holds (server_id, LeaderboardIndex) pairs where the
+            LeaderboardIndex orders the members without an open session by
+            their banked time.
+
+        _versions (dict): Holds (server_id, int) pairs where the int is
+            bumped whenever a member's total changes other than by time
+            passing in an open session.
+
+    """
+
+    def __init__(self, member_times, ledger):
+        """Initializes the engine.
+
+        Args:
+            member_times (dict): Reference to global_member_times.
+            ledger (SessionLedger): Ledger to record session intervals in.
+
+        """
+        self._member_times = member_times
+        self._ledger = ledger
+        self._active = dict()
+        self._boards = dict()
+        self._versions = dict()
+
+    def add_server(self, server_id):
+        """Prepares session bookkeeping for a server.
+
+        Must be called once the server's members are in member_times.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        """
+        active = self._active.setdefault(server_id, set())
+        self._boards[server_id] = LeaderboardIndex(
+                (user_id, state.banked) for user_id, state
+                in self._member_times[server_id].items()
+                if user_id not in active)
+        self._bump(server_id)
+
+    def remove_server(self, server_id):
+        """Drops all sessions for a server without banking them.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        """
+        self._active.pop(server_id, None)
+        self._boards.pop(server_id, None)
+        self._versions.pop(server_id, None)
+
+    def _bump(self, server_id):
+        """Private helper to mark that a server's totals changed.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        """
+        self._versions[server_id] = self._versions.get(server_id, 0) + 1
+
+    def version(self, server_id):
+        """Reads how many times a server's totals changed.
+
+        Time passing in open sessions does not count as a change, so anything
+        showing live totals must also expire on its own.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        Returns:
+            int: The server's current version.
+
+        """
+        return self._versions.get(server_id, 0)
+
+    def is_active(self, server_id, user_id):
+        """Checks if a user is currently accumulating time.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+
+        Returns:
+            bool: True if the user has an open session.
+
+        """
+        return user_id in self._active.get(server_id, ())
+
+    def active_users(self, server_id):
+        """Lists users currently accumulating time in a server.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        Returns:
+            list: User ids with an open session.
+
+        """
+        return list(self._active.get(server_id, ()))
+
+    def start_session(self, server_id, user_id, now=None):
+        """Records that a user began accumulating time.
+
+        Does nothing if the user already has an open session.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            now (float): Timestamp to start the session at. Defaults to the
+                current time.
+
+        Returns:
+            bool: True if a new session was started.
+
+        """
+        active = self._active[server_id]
+        if user_id in active:
+            return False
+        now = time.time() if now is None else now
+        state = self._member_times[server_id][user_id]
+        state.session_start = now
+        state.recorded = now
+        active.add(user_id)
+        self._boards[server_id].discard(user_id)
+        return True
+
+    def end_session(self, server_id, user_id, now=None):
+        """Closes a user's session and banks the time spent in it.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            now (float): Timestamp to end the session at. Defaults to the
+                current time.
+
+        Returns:
+            float: Seconds banked, or None if there was no open session.
+
+        """
+        try:
+            self._active[server_id].remove(user_id)
+        except KeyError as e:
+            return None
+        now = time.time() if now is None else now
+        state = self._member_times[server_id][user_id]
+        elapsed = now - state.session_start
+        self._ledger.append(server_id, user_id, state.recorded, now)
+        state.banked += elapsed
+        state.session_start = None
+        state.recorded = None
+        self._boards[server_id].set(user_id, state.banked)
+        return elapsed
+
+    def rebank(self, server_id, user_id):
+        """Re-sorts a member whose banked time changed outside a session.
+
+        Also used to add new members to the leaderboard.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+
+        """
+        if server_id in self._boards and not self.is_active(server_id,
+                user_id):
+            self._boards[server_id].set(user_id,
+                    self._member_times[server_id][user_id].banked)
+        self._bump(server_id)
+
+    def top(self, server_id, amount, now=None, start=0):
+        """Reads the members with the most time in a server.
+
+        Takes O(start + amount + log n) for n members plus the members with
+        an open session.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            amount (int): Maximum amount of members to read.
+            now (float): Timestamp to compute totals at. Defaults to the
+                current time.
+            start (int): Amount of members with the most time to skip, for
+                reading later pages of the leaderboard.
+
+        Returns:
+            list: (user_id, float) pairs, most time first.
+
+        """
+        now = time.time() if now is None else now
+        server_times = self._member_times[server_id]
+        active = [(user_id, server_times[user_id].total(now))
+                for user_id in self._active[server_id]]
+        end = start + amount
+        return heapq.nlargest(end, self._boards[server_id].top(end) + active,
+                key=lambda member: member[1])[start:]
+
+    def position(self, server_id, user_id, now=None):
+        """Finds where a member stands among the members of a server.
+
+        Takes O(log n) for n members plus the members with an open session.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            now (float): Timestamp to compute totals at. Defaults to the
+                current time.
+
+        Returns:
+            tuple: (position, count) where position is 1 for the member
+                with the most time and count is the amount of members.
+
+        """
+        now = time.time() if now is None else now
+        server_times = self._member_times[server_id]
+        board = self._boards[server_id]
+        spent = server_times[user_id].total(now)
+        above = board.count_above(spent)
+        for other in self._active[server_id]:
+            if server_times[other].total(now) > spent:
+                above += 1
+        return above + 1, len(board) + len(self._active[server_id])
+
+    def restart_session(self, server_id, user_id, now=None):
+        """Discards unbanked time of an open session.
+
+        Used when a user's time is reset while they are in a voice channel.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            now (float): New start of the session. Defaults to the current
+                time.
+
+        """
+        if self.is_active(server_id, user_id):
+            now = time.time() if now is None else now
+            state = self._member_times[server_id][user_id]
+            state.session_start = now
+            state.recorded = now
+            self._bump(server_id)
+
+    def checkpoint(self, now=None):
+        """Writes the unrecorded part of every open session to the ledger.
+
+        Sessions stay open; only how far they have been recorded moves
+        forward. Must be called from the event loop's thread.
+
+        Args:
+            now (float): Timestamp to record sessions up to. Defaults to the
+                current time.
+
+        """
+        now = time.time() if now is None else now
+        for server_id, active in self._active.items():
+            server_times = self._member_times[server_id]
+            for user_id in active:
+                state = server_times[user_id]
+                self._ledger.append(server_id, user_id, state.recorded, now)
+                state.recorded = now
+
+    def heartbeat(self, now=None):
+        """Records how far every open session has run in the write ahead log.
+
+        Unlike checkpoint, nothing is added to the ledger and sessions are
+        left untouched.
+
+        Args:
+            now (float): Timestamp sessions have run up to. Defaults to the
+                current time.
+
+        """
+        now = time.time() if now is None else now
+        for server_id, active in self._active.items():
+            server_times = self._member_times[server_id]
+            for user_id in active:
+                self._ledger.heartbeat(server_id, user_id,
+                        server_times[user_id].recorded, now)
@@ -0,0 +1,238 @@
+"""
+Defines the append only voice session ledger and its background compactor.
+
+"""
+
+import time
+import logging
+import threading
+from activity_rollups import prune_cutoffs
+
+logger = logging.getLogger("discord")
+_BATCH_SIZE = 500             # Amount of buffered sessions that triggers an
+                              # early write.
+
+
+class SessionLedger(threading.Thread):
+    """Buffers closed voice session intervals and writes them in batches.
+
+    Sessions are appended to the database's session ledger rather than
+    overwriting member totals. Every so often the ledger is compacted, which
+    folds closed sessions into each member's total time and activity buckets
+    and clears them from the ledger, after which buckets past their
+    retention are removed. Everything buffered is also recorded in the write
+    ahead log so it survives a crash before being written.
+
+    Attributes:
+        _sql (Storage): Backend used to write to the database.
+
+        _wal (WriteAheadLog): Local log buffered operations are recorded in.
+
+        _flush_time (int): Maximum seconds a buffered session waits before it
+            is written.
+
+        _compact_time (int): Seconds between compactions.
+
+        _retention (dict): Holds (span_name, int) pairs where int is how many
+            seconds activity buckets of that span are kept.
+
+        _pending (list): Operations waiting to be written, in order. Each is
+            either ("session", (server_id, user_id, start, end)) or
+            ("reset", (server_id, user_id)).
+
+        _lock (Lock): Guards _pending. Never held while calling the write
+            ahead log. Operations are buffered before they are logged, so
+            every operation in a rotated segment is buffered or written.
+
+        _flush_lock (Lock): Held while flushing so flushes from different
+            threads never overlap and write in the order operations were
+            buffered.
+
+        _wakeup (Event): Set when the buffer should be written early.
+
+        _compact_allowed (Event): Cleared while compaction is held off.
+
+    """
+
+    def __init__(self, sql, wal, flush_time, compact_time, retention):
+        """Initializes the ledger thread.
+
+        Args:
+            sql (Storage): Backend used to write to the database.
+            wal (WriteAheadLog): Local log to record buffered operations in.
+            flush_time (int): Maximum seconds a buffered session waits before
+                it is written.
+            compact_time (int): Seconds between compactions.
+            retention (dict): Holds (span_name, int) pairs where int is how
+                many seconds activity buckets of that span are kept.
+
+        """
+        super().__init__(daemon=True)
+        self._sql = sql
+        self._wal = wal
+        self._flush_time = flush_time
+        self._compact_time = compact_time
+        self._retention = retention
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._compact_allowed = threading.Event()
+        self._compact_allowed.set()
+
+    def append(self, server_id, user_id, start, end):
+        """Adds a closed session interval to the ledger.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            start (float): Timestamp the interval began at.
+            end (float): Timestamp the interval ended at.
+
+        """
+        if end <= start:
+            return
+        with self._lock:
+            self._pending.append(("session", (server_id, user_id, start, end)))
+            full = len(self._pending) >= _BATCH_SIZE
+        self._wal.append("session", server_id, user_id, start, end)
+        if full:
+            self._wakeup.set()
+
+    def heartbeat(self, server_id, user_id, start, end):
+        """Records how far an open session has run in the write ahead log only.
+
+        If the bot dies, replaying the log turns the latest heartbeat into a
+        closed session. If the session is written to the ledger later, the
+        replayed copy is ignored since it starts at the same moment.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            start (float): Timestamp the unrecorded part of the session began.
+            end (float): Current timestamp.
+
+        """
+        if end > start:
+            self._wal.append("session", server_id, user_id, start, end)
+
+    def reset(self, server_id, user_id):
+        """Discards a user's recorded sessions and total time.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+
+        """
+        with self._lock:
+            self._pending.append(("reset", (server_id, user_id)))
+        self._wal.append("reset", server_id, user_id)
+
+    def buffered(self, server_id):
+        """Lists a server's sessions that have not been written yet.
+
+        Sessions followed by a reset of their user are left out, as are
+        sessions already being written.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        Returns:
+            list: (user_id, start, end) tuples.
+
+        """
+        with self._lock:
+            pending = list(self._pending)
+        sessions = []
+        for kind, values in pending:
+            if values[0] != server_id:
+                continue
+            if kind == "reset":
+                sessions = [session for session in sessions
+                        if session[0] != values[1]]
+            else:
+                sessions.append(values[1:])
+        return sessions
+
+    def hold_compaction(self):
+        """Holds off compaction until release_compaction is called.
+
+        Used while member totals are compared against the database, which
+        compaction would change underneath.
+
+        """
+        self._compact_allowed.clear()
+
+    def release_compaction(self):
+        """Lets compaction resume."""
+
+        self._compact_allowed.set()
+
+    def rotate_wal(self):
+        """Rotates the write ahead log in step with the buffer.
+
+        Everything recorded in the segments returned is either buffered or
+        already written, so they can be discarded after the next flush.
+
+        Returns:
+            list: Segment numbers to pass to WriteAheadLog.discard.
+
+        """
+        return self._wal.rotate()
+
+    def _write_sessions(self, operations):
+        """Private helper to write a run of session operations in one batch.
+
+        Args:
+            operations (list): ("session", values) tuples to write.
+
+        """
+        if operations:
+            self._sql.append_sessions([values for kind, values in operations])
+
+    def flush(self):
+        """Writes every buffered operation to the database in order.
+
+        Operations that could not be written are put back in the buffer.
+
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = []
+
+            done = 0
+            try:
+                for index, (kind, values) in enumerate(pending):
+                    if kind != "reset":
+                        continue
+
+                    # Sessions recorded before a reset need to land first so
+                    # the reset clears them as well.
+                    self._write_sessions(pending[done:index])
+                    done = index
+                    self._sql.reset_user(*values)
+                    done = index + 1
+                self._write_sessions(pending[done:])
+                done = len(pending)
+            finally:
+                if done < len(pending):
+                    with self._lock:
+                        self._pending[:0] = pending[done:]
+
+    def run(self):
+        """Writes buffered sessions and compacts the ledger periodically."""
+
+        last_compact = time.time()
+        while True:
+            self._wakeup.wait(self._flush_time)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if (time.time() - last_compact >= self._compact_time and
+                        self._compact_allowed.is_set()):
+                    self._sql.compact_sessions(self._wal.safe_time())
+                    self._sql.prune_activity(prune_cutoffs(self._retention))
+                    last_compact = time.time()
+            except Exception as e:
+                logger.exception("Failed to write session ledger")
@@ -4,63 +4,99 @@ Defines wrapper class for sql python connector.
 """
 
 import logging
-from math import floor
+from storage import Storage
+from activity_rollups import rollup_sessions
 from mysql import connector
-from mysql.connector.pooling import MySQLConnectionPool
+from connection_pool import ConnectionPool
 
 connector.threadsafety = 1
 logger = logging.getLogger("discord")
 _POOL_SIZE = 32
+_POOL_OVERFLOW = 8
+_POOL_TIMEOUT = 10
+_CHUNK_SIZE = 1000
+_MEMBER_TABLE = "member_times"
+_LEDGER_TABLE = "voice_sessions"
+_ACTIVITY_TABLE = "member_activity"
+_MIGRATION_TABLE = "migrated_tables"
+_STATE_TABLE = "bot_state"
 
 
-class SQLWrapper():
+class SQLWrapper(Storage):
     """Wrapper class for sql python connector.
 
-    Defines multiple program specfic queries for convenience. Not all are
-    currently in use.
+    The MySQL storage backend. Defines multiple program specfic queries for
+    convenience. Not all are currently in use.
 
     Attributes:
         _config (dict): Connection configuration for database.
 
-        _db_pool (MySQLConnectionPool): Connection pool to the database.
+        _db_pool (ConnectionPool): Bounded connection pool to the database.
 
     """
 
-    def __init__(self, config):
+    def __init__(self, config, size=_POOL_SIZE, overflow=_POOL_OVERFLOW,
+            timeout=_POOL_TIMEOUT):
         """Constructor to initialize the connection pool.
             
         Args:
             config (dict): Connection configuration for database.
+            size (int): Amount of connections the pool keeps open.
+            overflow (int): Amount of extra connections allowed under a
+                    burst.
+            timeout (float): Seconds to wait for a free connection before
+                    giving up.
 
         """
         self._config = config
-        self._db_pool = MySQLConnectionPool(pool_name="disc_pool",
-                                            pool_size=_POOL_SIZE,
-                                            **config)
+        self._db_pool = ConnectionPool(
+                lambda: connector.connect(**config),
+                lambda cnx: cnx.is_connected(),
+                size, overflow, timeout)
+        self.create_tables()
 
 
     def _get_connection(self):
         """Private helper method to get connection to the databse.
         
         Returns:
-            MySQLConnection: Connection object to the database.
+            PooledConnection: Connection object to the database. Closing it
+                returns it to the pool.
+
+        Raises:
+            PoolTimeoutError: If no connection frees up in time.
         """
-        try:
-            return self._db_pool.get_connection()
-        except connector.errors.PoolError as e:
-            logger.warning("POOL LIMIT REACHED")
-            return connector.connect(**(self._config))
+        return self._db_pool.get_connection()
+
+    def pool_stats(self):
+        """Returns the connection pool's counters.
+
+        Returns:
+            dict: Holds (counter, int) pairs. (see: ConnectionPool.stats)
+
+        """
+        return self._db_pool.stats()
+
+    def _transaction(self, statements):
+        """Helper to execute several statements in one transaction.
+
+        The connection always goes back to the pool, and anything not
+        committed because of an error is rolled back.
 
-    def _clean_up(self, cnx, cursor):
-        """Private helper method to finish up task and release connections
-            
         Args:
-            cnx (MySQLConnection): Connection to the database.
-            cursor (MySQLCursor): Cursor object from cnx.
+            statements (list): (query, tuple) pairs where the tuple holds
+                    the query's arguments.
+
         """
-        cnx.commit()
-        cursor.close()
-        cnx.close()
+        cnx = self._get_connection()
+        cursor = cnx.cursor()
+        try:
+            for query, args in statements:
+                cursor.execute(query, args)
+            cnx.commit()
+        finally:
+            cursor.close()
+            cnx.close()
 
     def _update_query(self, query, *args):
         """Helper to execuate database updates
@@ -69,10 +105,7 @@ class SQLWrapper():
             query (string): Query to execute.
 
         """
-        cnx = self._get_connection()
-        cursor = cnx.cursor()
-        cursor.execute(query, args)
-        self._clean_up(cnx, cursor)
+        self._transaction([(query, args)])
 
     def _fetch_query(self, query, *args):
         """Helper execuate database fetches
@@ -96,157 +129,481 @@ class SQLWrapper():
         return result
 
 
-    def create_table(self, server_id, vals):
-        """Creates and populates table in database for the given server.
+    def create_tables(self):
+        """Creates the member, voice session ledger, activity and state tables
+        if needed.
+
+        Every server's members share the member table, keyed on
+        (server_id, user_id). The ledger holds closed voice session intervals
+        which have not yet been folded into their member's total time. The
+        activity table holds each member's time per hourly, daily and
+        monthly bucket, keyed so a server's buckets of one span are read in
+        order. The state table holds named values the bot keeps about
+        itself, such as the token of its last snapshot.
+
+        """
+        query = ("CREATE TABLE IF NOT EXISTS `%s` ("
+                    "server_id BIGINT UNSIGNED NOT NULL, "
+                    "user_id BIGINT UNSIGNED NOT NULL, "
+                    "time INT NOT NULL DEFAULT 0, "
+                    "`rank` INT NOT NULL DEFAULT 0, "
+                    "wl_status BOOLEAN NOT NULL DEFAULT false, "
+                    "PRIMARY KEY (server_id, user_id), "
+                    "INDEX server_time (server_id, time), "
+                    "INDEX whitelisted (wl_status))" % _MEMBER_TABLE)
+        self._update_query(query)
+        query = ("CREATE TABLE IF NOT EXISTS `%s` ("
+                    "id BIGINT AUTO_INCREMENT PRIMARY KEY, "
+                    "server_id BIGINT UNSIGNED NOT NULL, "
+                    "user_id BIGINT UNSIGNED NOT NULL, "
+                    "started DOUBLE NOT NULL, ended DOUBLE NOT NULL, "
+                    "UNIQUE KEY session (server_id, user_id, started))"
+                    % _LEDGER_TABLE)
+        self._update_query(query)
+        query = ("CREATE TABLE IF NOT EXISTS `%s` ("
+                    "server_id BIGINT UNSIGNED NOT NULL, "
+                    "user_id BIGINT UNSIGNED NOT NULL, "
+                    "span TINYINT UNSIGNED NOT NULL, "
+                    "bucket INT UNSIGNED NOT NULL, "
+                    "seconds DOUBLE NOT NULL DEFAULT 0, "
+                    "PRIMARY KEY (server_id, span, bucket, user_id), "
+                    "INDEX activity_age (span, bucket))" % _ACTIVITY_TABLE)
+        self._update_query(query)
+        query = ("CREATE TABLE IF NOT EXISTS `%s` ("
+                    "name VARCHAR(32) PRIMARY KEY, "
+                    "value BIGINT NOT NULL)" % _STATE_TABLE)
+        self._update_query(query)
+
+
+    def add_users(self, rows):
+        """Adds users to any number of servers in bulk.
+
+        Users a server already has are left as they are.
+
+        Args:
+            rows (list): (server_id, user_id) tuples.
+
+        """
+        query = ("INSERT IGNORE INTO `%s` (server_id, user_id) VALUES (%s, %s)"
+                    % (_MEMBER_TABLE, "%s", "%s"))
+        self._chunked_query(query, rows)
+
+
+    def update_ranks(self, rows):
+        """Writes new rank values for members of any number of servers.
+
+        Rows are upserted in bulk and committed in chunks of _CHUNK_SIZE, so
+        a flush costs about one round trip per chunk rather than one per
+        member. Times are not written here. They reach the table through the
+        session ledger instead. (see: append_sessions, compact_sessions)
+
+        Args:
+            rows (list): (server_id, user_id, rank) tuples.
+
+        """
+        query = ("INSERT INTO `%s` (server_id, user_id, `rank`) "
+                    "VALUES (%s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE `rank`=VALUES(`rank`)"
+                    % (_MEMBER_TABLE, "%s", "%s", "%s"))
+        self._chunked_query(query, rows)
+
+
+    def update_whitelist(self, rows):
+        """Writes new whitelist statuses for members of any number of servers.
+
+        Rows are upserted in bulk and committed in chunks of _CHUNK_SIZE.
 
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
-            vals (list): List of values to insert into the database.
+            rows (list): (server_id, user_id, wl_status) tuples.
 
         """
+        query = ("INSERT INTO `%s` (server_id, user_id, wl_status) "
+                    "VALUES (%s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE wl_status=VALUES(wl_status)"
+                    % (_MEMBER_TABLE, "%s", "%s", "%s"))
+        self._chunked_query(query, rows)
+
+
+    def _chunked_query(self, query, rows):
+        """Private helper to run a statement over many rows in chunks.
+
+        Each chunk of _CHUNK_SIZE rows is sent in one batch and committed.
+
+        Args:
+            query (string): Query to execute for every row.
+            rows (list): Parameters for each execution.
+
+        """
+        if not rows:
+            return
         cnx = self._get_connection()
         cursor = cnx.cursor()
-        query = ("CREATE TABLE `%s` (id VARCHAR(25) PRIMARY KEY, "
-                    "time INT DEFAULT 0, rank INT DEFAULT 0, "
-                    "`wl_status` BOOLEAN DEFAULT false)")
-        query = query % (server_id)
-        cursor.execute(query)
-        query = "INSERT INTO `%s` (id) VALUES (%s)" % (server_id, "%s")
-        cursor.executemany(query, vals)
-        self._clean_up(cnx, cursor)
+        try:
+            for start in range(0, len(rows), _CHUNK_SIZE):
+                cursor.executemany(query, rows[start:start + _CHUNK_SIZE])
+                cnx.commit()
+        finally:
+            cursor.close()
+            cnx.close()
+
+
+    def append_sessions(self, sessions):
+        """Appends closed voice session intervals to the ledger.
+
+        Sessions already in the ledger are ignored, so writing the same
+        interval twice is harmless.
+
+        Args:
+            sessions (list): (server_id, user_id, start, end) tuples.
+
+        """
+        query = ("INSERT IGNORE INTO `%s` (server_id, user_id, started, ended) "
+                    "VALUES (%s, %s, %s, %s)" 
+                    % (_LEDGER_TABLE, "%s", "%s", "%s", "%s"))
+        self._chunked_query(query, sessions)
+
 
+    def compact_sessions(self, before):
+        """Folds closed ledger sessions into each member's total time.
 
-    def update_server(self, server_id, server_times):
-        """Updates a server's respective table with new values.
+        The sessions are also summed into their members' activity buckets.
+        Every server is folded and cleared from the ledger in one transaction
+        so neither totals nor buckets ever count a session twice. Members
+        without a row yet, e.g. added right before a crash, get one so their
+        sessions are never cleared without being counted.
 
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
-            server_time (dict): Dictionary with new values.
+            before (float): Only sessions that ended before this timestamp
+                    are folded. Later ones might still be replayed from the
+                    write ahead log.
 
         """
+        watermark = self._fetch_query("SELECT MAX(id) FROM `%s` "
+                "WHERE ended < %s" % (_LEDGER_TABLE, "%s"), before)
+        if not watermark or watermark[0][0] is None:
+            return
+        watermark = watermark[0][0]
+
+        select = ("SELECT server_id, user_id, started, ended FROM `%s` "
+                    "WHERE id <= %s AND ended < %s FOR UPDATE"
+                    % (_LEDGER_TABLE, "%s", "%s"))
+        add = ("INSERT INTO `%s` (server_id, user_id, span, bucket, seconds) "
+                    "VALUES (%s, %s, %s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE seconds=seconds + VALUES(seconds)"
+                    % (_ACTIVITY_TABLE, "%s", "%s", "%s", "%s", "%s"))
+        fold = ("INSERT INTO `%s` (server_id, user_id, time) "
+                    "SELECT server_id, user_id, "
+                    "ROUND(SUM(ended - started)) AS spent FROM `%s` "
+                    "WHERE id <= %s AND ended < %s "
+                    "GROUP BY server_id, user_id "
+                    "ON DUPLICATE KEY UPDATE time = time + VALUES(time)"
+                    % (_MEMBER_TABLE, _LEDGER_TABLE, "%s", "%s"))
+        clear = ("DELETE FROM `%s` WHERE id <= %s AND ended < %s"
+                    % (_LEDGER_TABLE, "%s", "%s"))
+
         cnx = self._get_connection()
         cursor = cnx.cursor()
-        query = "UPDATE `%s` SET time=%s, rank=%s WHERE id=%s"
+        try:
+            # Locking the sessions keeps a concurrent reset from discarding
+            # them between summing them into buckets and clearing them.
+            cursor.execute(select, (watermark, before))
+            rows = rollup_sessions(cursor.fetchall())
+            for start in range(0, len(rows), _CHUNK_SIZE):
+                cursor.executemany(add, rows[start:start + _CHUNK_SIZE])
+            cursor.execute(fold, (watermark, before))
+            cursor.execute(clear, (watermark, before))
+            cnx.commit()
+        finally:
+            cursor.close()
+            cnx.close()
+        logger.info("Compacted session ledger up to %s", watermark)
 
-        # Race conditions may change dict size and .keys() returns an iterator.
-        key_list = list(server_times)
-        for member in key_list:
-            time = floor(server_times[member][0])
-            rank = server_times[member][1]
-            spec_query = query % (server_id, time, rank, "%s")
-            cursor.execute(spec_query, (member,))
-        self._clean_up(cnx, cursor)
 
-        
-    def add_user(self, server_id, user_id):
-        """Adds user to the specified server's table.
+    def prune_activity(self, cutoffs):
+        """Removes activity buckets past their retention.
 
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
-            user_id (string): Unique identifier for the user whose values are
-                    being updated.
-
+            cutoffs (list): (span, bucket) tuples. Buckets of span starting
+                    before bucket are removed.
 
         """
-        query = ("INSERT INTO `%s` VALUES (%s, 0, 0, false)" 
-                % (server_id, "%s"))
-        self._update_query(query, user_id)
+        query = ("DELETE FROM `%s` WHERE span=%s AND bucket < %s"
+                    % (_ACTIVITY_TABLE, "%s", "%s"))
+        self._chunked_query(query, cutoffs)
+
 
+    def reset_user(self, server_id, user_id):
+        """Sets a user's total time to 0 and discards their ledger sessions.
 
-    def update_user(self, server_id, user_id, time, rank):
-        """Updates table values for specified user.
+        Their activity buckets are discarded as well.
 
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
+            server_id (string): Unique identifier for the server the user is
+                    in.
             user_id (string): Unique identifier for the user whose values are
                     being updated.
-            time (int): User's total accumulated time.
-            rank (int): Integer representation of user's rank.
 
         """
-        query = ("UPDATE `%s` SET time=%s, rank=%s WHERE id=%s" 
-                % (server_id, floor(time), rank, "%s"))
-        self._update_query(query, user_id)
+        clear = ("DELETE FROM `%s` WHERE server_id=%s AND user_id=%s"
+                    % (_LEDGER_TABLE, "%s", "%s"))
+        forget = ("DELETE FROM `%s` WHERE server_id=%s AND user_id=%s"
+                    % (_ACTIVITY_TABLE, "%s", "%s"))
+        reset = ("UPDATE `%s` SET time=0 WHERE server_id=%s AND user_id=%s"
+                    % (_MEMBER_TABLE, "%s", "%s"))
+        self._transaction([(clear, (server_id, user_id)),
+                (forget, (server_id, user_id)),
+                (reset, (server_id, user_id))])
 
+        
     def whitelist_user(self, server_id, user_id):
         """Whitelists a specified user by making their whitelist status true.
 
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
+            server_id (string): Unique identifier for the server the user is
+                    in.
             user_id (string): Unique identifier for the user whose values are
                     being updated.
 
         """
-        query = "UPDATE `%s` SET wl_status=true WHERE id=%s" % (server_id, "%s")
-        self._update_query(query, user_id)
+        query = ("UPDATE `%s` SET wl_status=true WHERE server_id=%s "
+                "AND user_id=%s" % (_MEMBER_TABLE, "%s", "%s"))
+        self._update_query(query, server_id, user_id)
 
     def unwhitelist_user(self, server_id, user_id):
         """UnWhitelists a specified user by making their whitelist status false.
 
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
+            server_id (string): Unique identifier for the server the user is
+                    in.
             user_id (string): Unique identifier for the user whose values are
                     being updated.
 
         """
-        query = ("UPDATE `%s` SET wl_status=false WHERE id=%s" 
-                % (server_id, "%s"))
-        self._update_query(query, user_id)
+        query = ("UPDATE `%s` SET wl_status=false WHERE server_id=%s "
+                "AND user_id=%s" % (_MEMBER_TABLE, "%s", "%s"))
+        self._update_query(query, server_id, user_id)
 
     def whitelist_all(self, server_id):
         """Whitelists all users.
 
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
+            server_id (string): Unique identifier for the server whose users
+                    are whitelisted.
 
         """
-        query = "UPDATE `%s` SET wl_status=true" % server_id
-        self._update_query(query)
+        query = ("UPDATE `%s` SET wl_status=true WHERE server_id=%s" 
+                % (_MEMBER_TABLE, "%s"))
+        self._update_query(query, server_id)
 
     def unwhitelist_all(self, server_id):
         """Unwhitelists all users.
 
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
+            server_id (string): Unique identifier for the server whose users
+                    are unwhitelisted.
 
         """
-        query = "UPDATE `%s` SET wl_status=false" % server_id
-        self._update_query(query)
+        query = ("UPDATE `%s` SET wl_status=false WHERE server_id=%s" 
+                % (_MEMBER_TABLE, "%s"))
+        self._update_query(query, server_id)
 
     def fetch_user(self, server_id, user_id):
         """Gets a specified user's data.
 
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
+            server_id (string): Unique identifier for the server the user is
+                    in.
             user_id (string): Unique identifier for the user whose values are
-                    being updated.
+                    being fetched.
 
         Returns:
             list: Fetched data
 
         """
-        query = "SELECT * FROM `%s` WHERE id=%s" % (server_id, "%s")
-        return self._fetch_query(query, user_id)
+        query = ("SELECT user_id, time, `rank`, wl_status FROM `%s` "
+                "WHERE server_id=%s AND user_id=%s" 
+                % (_MEMBER_TABLE, "%s", "%s"))
+        return self._fetch_query(query, server_id, user_id)
 
     def fetch_all(self, server_id):
         """Gets all users' data for the specified server.
 
+        Times include sessions still waiting in the ledger.
+
         Args:
-            server_id (string): Unique identifier for the server whose table
-                    is being created.
+            server_id (string): Unique identifier for the server whose users
+                    are fetched.
 
         Returns:
             list: Fetched data
 
         """
-        query = "SELECT * FROM `%s`" % server_id
-        return self._fetch_query(query)
+        query = ("SELECT t.user_id, t.time + COALESCE(l.spent, 0), t.`rank`, "
+                    "t.wl_status FROM `%s` AS t LEFT JOIN (SELECT user_id, "
+                    "SUM(ended - started) AS spent FROM `%s` "
+                    "WHERE server_id=%s GROUP BY user_id) AS l "
+                    "ON t.user_id = l.user_id WHERE t.server_id=%s"
+                    % (_MEMBER_TABLE, _LEDGER_TABLE, "%s", "%s"))
+        return self._fetch_query(query, server_id, server_id)
+
+    def fetch_activity(self, server_id, span, since):
+        """Gets how much time each user spent in a server since a moment.
+
+        Args:
+            server_id (string): Unique identifier for the server whose users
+                    are fetched.
+            span (int): Span of the buckets to sum.
+            since (int): Start of the first bucket to sum.
+
+        Returns:
+            list: (user_id, seconds) rows.
+
+        """
+        query = ("SELECT user_id, SUM(seconds) FROM ("
+                    "SELECT user_id, seconds FROM `%s` WHERE server_id=%s "
+                    "AND span=%s AND bucket >= %s UNION ALL "
+                    "SELECT user_id, ended - GREATEST(started, %s) FROM `%s` "
+                    "WHERE server_id=%s AND ended > %s) AS a GROUP BY user_id"
+                    % (_ACTIVITY_TABLE, "%s", "%s", "%s", "%s", _LEDGER_TABLE,
+                    "%s", "%s"))
+        return self._fetch_query(query, server_id, span, since, since,
+                server_id, since)
+
+    def fetch_servers(self, server_ids, before=None):
+        """Gets all users' data for many servers at once.
+
+        Servers are queried _CHUNK_SIZE at a time and rows are read in
+        chunks of _CHUNK_SIZE, so neither the query nor its result grows
+        with the amount of servers. Times include sessions still waiting in
+        the ledger.
+
+        Args:
+            server_ids (list): Unique identifiers for the servers whose
+                    users are fetched.
+            before (float): If given, only ledger sessions that started
+                    before this timestamp are included.
+
+        Yields:
+            tuple: (user_id, time, rank, wl_status, server_id) rows.
+
+        """
+        started = "" if before is None else " AND started < %s"
+        for start in range(0, len(server_ids), _CHUNK_SIZE):
+            chunk = server_ids[start:start + _CHUNK_SIZE]
+            marks = ", ".join(["%s"] * len(chunk))
+            args = chunk + ([] if before is None else [before]) + chunk
+            query = ("SELECT t.user_id, t.time + COALESCE(l.spent, 0), "
+                        "t.`rank`, t.wl_status, t.server_id FROM `%s` AS t "
+                        "LEFT JOIN (SELECT server_id, user_id, "
+                        "SUM(ended - started) AS spent FROM `%s` "
+                        "WHERE server_id IN (%s)%s "
+                        "GROUP BY server_id, user_id) "
+                        "AS l ON t.server_id = l.server_id "
+                        "AND t.user_id = l.user_id WHERE t.server_id IN (%s)"
+                        % (_MEMBER_TABLE, _LEDGER_TABLE, marks, started,
+                        marks))
+            cnx = self._get_connection()
+            cursor = cnx.cursor()
+            try:
+                cursor.execute(query, args)
+                rows = cursor.fetchmany(_CHUNK_SIZE)
+                while rows:
+                    yield from rows
+                    rows = cursor.fetchmany(_CHUNK_SIZE)
+            finally:
+                cursor.close()
+                cnx.close()
+
+    def snapshot_token(self):
+        """Gets the token of the last snapshot written.
+
+        Returns:
+            int: The token, or None if no snapshot was ever written.
+
+        """
+        rows = self._fetch_query("SELECT value FROM `%s` WHERE name=%s"
+                % (_STATE_TABLE, "%s"), "snapshot")
+        return rows[0][0] if rows else None
+
+    def set_snapshot_token(self, token):
+        """Records the token of a snapshot being written.
+
+        Args:
+            token (int): Identifies the snapshot.
+
+        """
+        self._update_query("INSERT INTO `%s` (name, value) VALUES (%s, %s) "
+                "ON DUPLICATE KEY UPDATE value=VALUES(value)"
+                % (_STATE_TABLE, "%s", "%s"), "snapshot", token)
+
+    def legacy_tables(self):
+        """Lists the per server tables used by earlier versions of the bot.
+
+        Those tables were named after the server's id.
+
+        Returns:
+            list: Names of the legacy tables left in the database.
+
+        """
+        return [name for (name,) in self._fetch_query("SHOW TABLES") or ()
+                if name.isdigit()]
+
+    def migrate_legacy_table(self, name):
+        """Merges one per server table into the member table.
+
+        The copy and a record of it in the migration log are committed
+        together, so a table is never counted twice even if this is run
+        again after a crash. Members the bot already added to the member
+        table while online keep what they accumulated in it, on top of their
+        legacy time.
+
+        Args:
+            name (string): Name of the legacy table, which is also the id of
+                    its server.
+
+        Returns:
+            bool: True if the table was copied, False if it had already been.
+
+        """
+        self._update_query("CREATE TABLE IF NOT EXISTS `%s` "
+                "(name VARCHAR(64) PRIMARY KEY)" % _MIGRATION_TABLE)
+        cnx = self._get_connection()
+        cursor = cnx.cursor()
+        try:
+            cursor.execute("INSERT IGNORE INTO `%s` (name) VALUES (%s)"
+                    % (_MIGRATION_TABLE, "%s"), (name,))
+            if cursor.rowcount == 0:
+                cnx.rollback()
+                return False
+            query = ("INSERT INTO `%s` (server_id, user_id, time, `rank`, "
+                        "wl_status) SELECT %s, id, time, `rank`, wl_status "
+                        "FROM `%s` ON DUPLICATE KEY UPDATE "
+                        "time = `%s`.time + VALUES(time), "
+                        "`rank` = GREATEST(`%s`.`rank`, VALUES(`rank`)), "
+                        "wl_status = `%s`.wl_status OR VALUES(wl_status)"
+                        % (_MEMBER_TABLE, "%s", name, _MEMBER_TABLE,
+                        _MEMBER_TABLE, _MEMBER_TABLE))
+            cursor.execute(query, (name,))
+            cnx.commit()
+        except:
+            cnx.rollback()
+            raise
+        finally:
+            cursor.close()
+            cnx.close()
+        return True
+
+    def retire_legacy_table(self, name, drop=False):
+        """Moves a migrated per server table out of the way.
+
+        Args:
+            name (string): Name of the legacy table.
+            drop (bool): Drops the table if True. Otherwise it is renamed
+                    with a _legacy suffix.
+
+        """
+        if drop:
+            self._update_query("DROP TABLE `%s`" % name)
+        else:
+            self._update_query("RENAME TABLE `%s` TO `%s_legacy`" 
+                    % (name, name))
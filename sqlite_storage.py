@@ -0,0 +1,391 @@
+"""
+Defines the embedded SQLite storage backend.
+
+"""
+
+import logging
+import sqlite3
+import threading
+from storage import Storage
+from activity_rollups import rollup_sessions
+
+logger = logging.getLogger("discord")
+_CHUNK_SIZE = 1000
+_MEMBER_TABLE = "member_times"
+_LEDGER_TABLE = "voice_sessions"
+_ACTIVITY_TABLE = "member_activity"
+_STATE_TABLE = "bot_state"
+
+
+class SQLiteStorage(Storage):
+    """Storage backend kept in a local SQLite database file.
+
+    Needs no database server, which suits small deployments, offline runs
+    and benchmarks. The database runs in WAL journal mode so reads do not
+    wait on writes, and bulk writes go through one transaction per chunk of
+    _CHUNK_SIZE rows. A single connection is shared by every thread and
+    guarded by a lock since SQLite only allows one writer at a time anyway.
+
+    Attributes:
+        _cnx (Connection): Connection to the database file.
+
+        _lock (Lock): Guards _cnx.
+
+    """
+
+    def __init__(self, path):
+        """Opens the database file and creates missing tables.
+
+        Args:
+            path (string): Path to the database file. Created if missing.
+
+        """
+        self._cnx = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._cnx.execute("PRAGMA journal_mode=WAL")
+            self._cnx.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def _update_query(self, query, *args):
+        """Private helper to run one statement in its own transaction.
+
+        Args:
+            query (string): Query to execute.
+
+        """
+        with self._lock, self._cnx:
+            self._cnx.execute(query, args)
+
+    def _fetch_query(self, query, *args):
+        """Private helper to run a query and fetch every row.
+
+        Args:
+            query (string): Query to execute.
+
+        Returns:
+            list: Fetched data.
+
+        """
+        with self._lock:
+            return self._cnx.execute(query, args).fetchall()
+
+    def _chunked_query(self, query, rows):
+        """Private helper to run a statement over many rows in chunks.
+
+        Each chunk of _CHUNK_SIZE rows is written in one transaction.
+
+        Args:
+            query (string): Query to execute for every row.
+            rows (list): Parameters for each execution.
+
+        """
+        for start in range(0, len(rows), _CHUNK_SIZE):
+            with self._lock, self._cnx:
+                self._cnx.executemany(query, rows[start:start + _CHUNK_SIZE])
+
+    def create_tables(self):
+        """Creates the member, voice session ledger, activity and state tables
+        if needed.
+
+        """
+
+        with self._lock, self._cnx:
+            self._cnx.execute("CREATE TABLE IF NOT EXISTS %s ("
+                    "server_id INTEGER NOT NULL, "
+                    "user_id INTEGER NOT NULL, "
+                    "time INTEGER NOT NULL DEFAULT 0, "
+                    "rank INTEGER NOT NULL DEFAULT 0, "
+                    "wl_status INTEGER NOT NULL DEFAULT 0, "
+                    "PRIMARY KEY (server_id, user_id)) WITHOUT ROWID"
+                    % _MEMBER_TABLE)
+            self._cnx.execute("CREATE INDEX IF NOT EXISTS server_time "
+                    "ON %s (server_id, time)" % _MEMBER_TABLE)
+            self._cnx.execute("CREATE INDEX IF NOT EXISTS whitelisted "
+                    "ON %s (wl_status)" % _MEMBER_TABLE)
+            self._cnx.execute("CREATE TABLE IF NOT EXISTS %s ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "server_id INTEGER NOT NULL, "
+                    "user_id INTEGER NOT NULL, "
+                    "started REAL NOT NULL, ended REAL NOT NULL, "
+                    "UNIQUE (server_id, user_id, started))" % _LEDGER_TABLE)
+            self._cnx.execute("CREATE TABLE IF NOT EXISTS %s ("
+                    "server_id INTEGER NOT NULL, "
+                    "user_id INTEGER NOT NULL, "
+                    "span INTEGER NOT NULL, "
+                    "bucket INTEGER NOT NULL, "
+                    "seconds REAL NOT NULL DEFAULT 0, "
+                    "PRIMARY KEY (server_id, span, bucket, user_id)) "
+                    "WITHOUT ROWID" % _ACTIVITY_TABLE)
+            self._cnx.execute("CREATE INDEX IF NOT EXISTS activity_age "
+                    "ON %s (span, bucket)" % _ACTIVITY_TABLE)
+            self._cnx.execute("CREATE TABLE IF NOT EXISTS %s ("
+                    "name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+                    % _STATE_TABLE)
+
+    def add_users(self, rows):
+        """Adds users to any number of servers in bulk.
+
+        Args:
+            rows (list): (server_id, user_id) tuples.
+
+        """
+        self._chunked_query("INSERT OR IGNORE INTO %s (server_id, user_id) "
+                "VALUES (?, ?)" % _MEMBER_TABLE, rows)
+
+    def update_ranks(self, rows):
+        """Writes new rank values for members of any number of servers.
+
+        Args:
+            rows (list): (server_id, user_id, rank) tuples.
+
+        """
+        self._chunked_query("INSERT INTO %s (server_id, user_id, rank) "
+                "VALUES (?, ?, ?) ON CONFLICT (server_id, user_id) "
+                "DO UPDATE SET rank=excluded.rank" % _MEMBER_TABLE, rows)
+
+    def update_whitelist(self, rows):
+        """Writes new whitelist statuses for members of any number of servers.
+
+        Args:
+            rows (list): (server_id, user_id, wl_status) tuples.
+
+        """
+        self._chunked_query("INSERT INTO %s (server_id, user_id, wl_status) "
+                "VALUES (?, ?, ?) ON CONFLICT (server_id, user_id) "
+                "DO UPDATE SET wl_status=excluded.wl_status" % _MEMBER_TABLE,
+                rows)
+
+    def append_sessions(self, sessions):
+        """Appends closed voice session intervals to the ledger.
+
+        Args:
+            sessions (list): (server_id, user_id, start, end) tuples.
+
+        """
+        self._chunked_query("INSERT OR IGNORE INTO %s (server_id, user_id, "
+                "started, ended) VALUES (?, ?, ?, ?)" % _LEDGER_TABLE,
+                sessions)
+
+    def compact_sessions(self, before):
+        """Folds closed ledger sessions into each member's total time.
+
+        Folding into totals and activity buckets and clearing the ledger
+        happen in one transaction so neither counts a session twice. Members
+        without a row yet get one so their sessions are never cleared
+        without being counted.
+
+        Args:
+            before (float): Only sessions that ended before this timestamp
+                    are folded.
+
+        """
+        with self._lock, self._cnx:
+            watermark = self._cnx.execute("SELECT MAX(id) FROM %s "
+                    "WHERE ended < ?" % _LEDGER_TABLE, (before,)).fetchone()[0]
+            if watermark is None:
+                return
+            sessions = self._cnx.execute("SELECT server_id, user_id, "
+                    "started, ended FROM %s WHERE id <= ? AND ended < ?"
+                    % _LEDGER_TABLE, (watermark, before)).fetchall()
+            self._cnx.executemany("INSERT INTO %s (server_id, user_id, span, "
+                    "bucket, seconds) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (server_id, span, bucket, user_id) "
+                    "DO UPDATE SET seconds = seconds + excluded.seconds"
+                    % _ACTIVITY_TABLE, rollup_sessions(sessions))
+            self._cnx.execute("INSERT INTO %s (server_id, user_id, time) "
+                    "SELECT server_id, user_id, "
+                    "CAST(ROUND(SUM(ended - started)) AS INTEGER) FROM %s "
+                    "WHERE id <= ? AND ended < ? GROUP BY server_id, user_id "
+                    "ON CONFLICT (server_id, user_id) "
+                    "DO UPDATE SET time = time + excluded.time"
+                    % (_MEMBER_TABLE, _LEDGER_TABLE), (watermark, before))
+            self._cnx.execute("DELETE FROM %s WHERE id <= ? AND ended < ?"
+                    % _LEDGER_TABLE, (watermark, before))
+        logger.info("Compacted session ledger up to %s", watermark)
+
+    def prune_activity(self, cutoffs):
+        """Removes activity buckets past their retention.
+
+        Args:
+            cutoffs (list): (span, bucket) tuples. Buckets of span starting
+                    before bucket are removed.
+
+        """
+        self._chunked_query("DELETE FROM %s WHERE span=? AND bucket < ?"
+                % _ACTIVITY_TABLE, cutoffs)
+
+    def reset_user(self, server_id, user_id):
+        """Sets a user's total time to 0 and discards their ledger sessions.
+
+        Their activity buckets are discarded as well.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+
+        """
+        with self._lock, self._cnx:
+            self._cnx.execute("DELETE FROM %s WHERE server_id=? AND user_id=?"
+                    % _LEDGER_TABLE, (server_id, user_id))
+            self._cnx.execute("DELETE FROM %s WHERE server_id=? AND user_id=?"
+                    % _ACTIVITY_TABLE, (server_id, user_id))
+            self._cnx.execute("UPDATE %s SET time=0 WHERE server_id=? "
+                    "AND user_id=?" % _MEMBER_TABLE, (server_id, user_id))
+
+    def whitelist_user(self, server_id, user_id):
+        """Whitelists a specified user by making their whitelist status true.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+
+        """
+        self._update_query("UPDATE %s SET wl_status=1 WHERE server_id=? "
+                "AND user_id=?" % _MEMBER_TABLE, server_id, user_id)
+
+    def unwhitelist_user(self, server_id, user_id):
+        """UnWhitelists a specified user by making their whitelist status false.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+
+        """
+        self._update_query("UPDATE %s SET wl_status=0 WHERE server_id=? "
+                "AND user_id=?" % _MEMBER_TABLE, server_id, user_id)
+
+    def whitelist_all(self, server_id):
+        """Whitelists all users.
+
+        Args:
+            server_id (string): Unique identifier for the server whose users
+                    are whitelisted.
+
+        """
+        self._update_query("UPDATE %s SET wl_status=1 WHERE server_id=?"
+                % _MEMBER_TABLE, server_id)
+
+    def unwhitelist_all(self, server_id):
+        """Unwhitelists all users.
+
+        Args:
+            server_id (string): Unique identifier for the server whose users
+                    are unwhitelisted.
+
+        """
+        self._update_query("UPDATE %s SET wl_status=0 WHERE server_id=?"
+                % _MEMBER_TABLE, server_id)
+
+    def fetch_user(self, server_id, user_id):
+        """Gets a specified user's data.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+
+        Returns:
+            list: Fetched data
+
+        """
+        return self._fetch_query("SELECT user_id, time, rank, wl_status "
+                "FROM %s WHERE server_id=? AND user_id=?" % _MEMBER_TABLE,
+                server_id, user_id)
+
+    def fetch_all(self, server_id):
+        """Gets all users' data for the specified server.
+
+        Times include sessions still waiting in the ledger.
+
+        Args:
+            server_id (string): Unique identifier for the server whose users
+                    are fetched.
+
+        Returns:
+            list: Fetched data
+
+        """
+        return self._fetch_query("SELECT t.user_id, t.time + "
+                "COALESCE(l.spent, 0), t.rank, t.wl_status FROM %s AS t "
+                "LEFT JOIN (SELECT user_id, SUM(ended - started) AS spent "
+                "FROM %s WHERE server_id=? GROUP BY user_id) AS l "
+                "ON t.user_id = l.user_id WHERE t.server_id=?"
+                % (_MEMBER_TABLE, _LEDGER_TABLE), server_id, server_id)
+
+    def fetch_activity(self, server_id, span, since):
+        """Gets how much time each user spent in a server since a moment.
+
+        Args:
+            server_id (string): Unique identifier for the server whose users
+                    are fetched.
+            span (int): Span of the buckets to sum.
+            since (int): Start of the first bucket to sum.
+
+        Returns:
+            list: (user_id, seconds) rows.
+
+        """
+        return self._fetch_query("SELECT user_id, SUM(seconds) FROM ("
+                "SELECT user_id, seconds FROM %s WHERE server_id=? "
+                "AND span=? AND bucket >= ? UNION ALL "
+                "SELECT user_id, ended - MAX(started, ?) FROM %s "
+                "WHERE server_id=? AND ended > ?) GROUP BY user_id"
+                % (_ACTIVITY_TABLE, _LEDGER_TABLE), server_id, span, since,
+                since, server_id, since)
+
+    def fetch_servers(self, server_ids, before=None):
+        """Gets all users' data for many servers at once.
+
+        Servers are queried _CHUNK_SIZE at a time. Times include sessions
+        still waiting in the ledger.
+
+        Args:
+            server_ids (list): Unique identifiers for the servers whose
+                    users are fetched.
+            before (float): If given, only ledger sessions that started
+                    before this timestamp are included.
+
+        Yields:
+            tuple: (user_id, time, rank, wl_status, server_id) rows.
+
+        """
+        started = "" if before is None else " AND started < ?"
+        for start in range(0, len(server_ids), _CHUNK_SIZE):
+            chunk = server_ids[start:start + _CHUNK_SIZE]
+            marks = ", ".join(["?"] * len(chunk))
+            args = chunk + ([] if before is None else [before]) + chunk
+            yield from self._fetch_query("SELECT t.user_id, t.time + "
+                    "COALESCE(l.spent, 0), t.rank, t.wl_status, t.server_id "
+                    "FROM %s AS t LEFT JOIN (SELECT server_id, user_id, "
+                    "SUM(ended - started) AS spent FROM %s "
+                    "WHERE server_id IN (%s)%s GROUP BY server_id, user_id) "
+                    "AS l ON t.server_id = l.server_id "
+                    "AND t.user_id = l.user_id WHERE t.server_id IN (%s)"
+                    % (_MEMBER_TABLE, _LEDGER_TABLE, marks, started, marks),
+                    *args)
+
+    def snapshot_token(self):
+        """Gets the token of the last snapshot written.
+
+        Returns:
+            int: The token, or None if no snapshot was ever written.
+
+        """
+        rows = self._fetch_query("SELECT value FROM %s WHERE name=?"
+                % _STATE_TABLE, "snapshot")
+        return rows[0][0] if rows else None
+
+    def set_snapshot_token(self, token):
+        """Records the token of a snapshot being written.
+
+        Args:
+            token (int): Identifies the snapshot.
+
+        """
+        self._update_query("INSERT INTO %s (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value=excluded.value"
+                % _STATE_TABLE, "snapshot", token)
@@ -0,0 +1,271 @@
+"""
+Defines the binary snapshot of every loaded server's state used for fast
+restarts.
+
+The file starts with a fixed header followed by one record per server and
+an index of where each record is. Every number is little endian.
+
+    Header: magic, format version, token, creation time, server count,
+        index offset and a CRC32 of everything after the header.
+
+    Record: member count, send_messages flag, the members as fixed size
+        (user_id, time, rank, wl_status) entries, the role order and the
+        milestones.
+
+    Index: (server_id, offset, length) entries.
+
+"""
+
+import os
+import time
+import zlib
+import mmap
+import struct
+import logging
+from config_store import ServerConfig
+
+logger = logging.getLogger("discord")
+_MAGIC = b"SHKS"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHQdIQI")
+_RECORD = struct.Struct("<IB")
+_MEMBER = struct.Struct("<QdIB")
+_INDEX = struct.Struct("<QQI")
+_COUNT = struct.Struct("<I")
+_NAME = struct.Struct("<H")
+_SECONDS = struct.Struct("<q")
+
+
+def _pack_name(name):
+    """Private helper to pack a length prefixed string.
+
+    Args:
+        name (string): String to pack.
+
+    Returns:
+        bytes: Packed string.
+
+    """
+    encoded = name.encode("utf-8")
+    return _NAME.pack(len(encoded)) + encoded
+
+
+def _unpack_name(view, offset):
+    """Private helper to unpack a length prefixed string.
+
+    Args:
+        view (memoryview): Buffer to read from.
+        offset (int): Where the string starts.
+
+    Returns:
+        tuple: (string, offset) where offset is just past the string.
+
+    """
+    length, = _NAME.unpack_from(view, offset)
+    offset += _NAME.size
+    return str(view[offset:offset + length], "utf-8"), offset + length
+
+
+def _pack_server(members, role_order, settings):
+    """Private helper to pack one server's record.
+
+    Args:
+        members (list): (user_id, time, rank, wl_status) tuples.
+        role_order (list): Role names in ascending order of milestone.
+        settings (ServerConfig): The server's configuration.
+
+    Returns:
+        bytes: Packed record.
+
+    """
+    parts = [_RECORD.pack(len(members), settings.send_messages)]
+    parts.extend(_MEMBER.pack(int(user_id), spent, rank, wl)
+            for user_id, spent, rank, wl in members)
+    parts.append(_COUNT.pack(len(role_order)))
+    parts.extend(_pack_name(role) for role in role_order)
+    parts.append(_COUNT.pack(len(settings.milestones)))
+    for role, seconds in settings.milestones.items():
+        parts.append(_pack_name(role) + _SECONDS.pack(seconds))
+    return b"".join(parts)
+
+
+def write_snapshot(path, token, servers, commit):
+    """Writes a snapshot to a temporary file and puts it in place.
+
+    The previous snapshot is only replaced once commit returns, so a
+    snapshot file never outlives the token commit records for it.
+
+    Args:
+        path (string): Where to keep the snapshot.
+        token (int): Identifies the snapshot. Must fit in 63 bits.
+        servers (list): (server_id, members, role_order, settings) tuples
+            where members holds (user_id, time, rank, wl_status) tuples and
+            settings is the server's ServerConfig.
+        commit (function): Called once the file is written, before it
+            replaces the previous snapshot.
+
+    """
+    temp_path = path + ".tmp"
+    index = []
+    crc = 0
+    with open(temp_path, "wb") as new_snapshot:
+        new_snapshot.write(bytes(_HEADER.size))
+        offset = _HEADER.size
+        for server_id, members, role_order, settings in servers:
+            record = _pack_server(members, role_order, settings)
+            new_snapshot.write(record)
+            crc = zlib.crc32(record, crc)
+            index.append(_INDEX.pack(int(server_id), offset, len(record)))
+            offset += len(record)
+        index = b"".join(index)
+        new_snapshot.write(index)
+        crc = zlib.crc32(index, crc)
+        new_snapshot.seek(0)
+        new_snapshot.write(_HEADER.pack(_MAGIC, _VERSION, token, time.time(),
+                len(servers), offset, crc))
+        new_snapshot.flush()
+        os.fsync(new_snapshot.fileno())
+    commit()
+    os.replace(temp_path, path)
+    logger.info("Wrote snapshot %s of %s servers", token, len(servers))
+
+
+class StateSnapshot():
+    """Snapshot memory mapped for reading.
+
+    Only the header and index are read when opening. Each server's record
+    is decoded straight from the mapped file when asked for.
+
+    Attributes:
+        token (int): Identifies the snapshot.
+
+        created (float): Timestamp the snapshot was written at.
+
+        _file (file): The open snapshot file.
+
+        _map (mmap): The file mapped into memory.
+
+        _index (dict): Holds (server_id, tuple) pairs where the tuple is the
+            (offset, length) of the server's record.
+
+    """
+
+    def __init__(self, snapshot_file, mapped, token, created, index):
+        """Wraps an opened snapshot. Use StateSnapshot.open instead.
+
+        Args:
+            snapshot_file (file): The open snapshot file.
+            mapped (mmap): The file mapped into memory.
+            token (int): Identifies the snapshot.
+            created (float): Timestamp the snapshot was written at.
+            index (dict): Holds (server_id, (offset, length)) pairs.
+
+        """
+        self._file = snapshot_file
+        self._map = mapped
+        self.token = token
+        self.created = created
+        self._index = index
+
+    @staticmethod
+    def open(path):
+        """Maps a snapshot and checks it is intact.
+
+        Args:
+            path (string): Where the snapshot is kept.
+
+        Returns:
+            StateSnapshot: The snapshot, or None if it is missing, of
+                another format version or damaged.
+
+        """
+        try:
+            snapshot_file = open(path, "rb")
+        except FileNotFoundError as e:
+            return None
+        try:
+            mapped = mmap.mmap(snapshot_file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+        except ValueError as e:
+            snapshot_file.close()
+            return None
+
+        try:
+            (magic, version, token, created, count, index_offset,
+                    crc) = _HEADER.unpack_from(mapped, 0)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("unknown format")
+            if zlib.crc32(memoryview(mapped)[_HEADER.size:]) != crc:
+                raise ValueError("checksum mismatch")
+            index = dict()
+            for position in range(count):
+                server_id, offset, length = _INDEX.unpack_from(mapped,
+                        index_offset + position * _INDEX.size)
+                index[str(server_id)] = (offset, length)
+        except (struct.error, ValueError) as e:
+            logger.warning("Ignoring snapshot %s: %s", path, e)
+            mapped.close()
+            snapshot_file.close()
+            return None
+        return StateSnapshot(snapshot_file, mapped, token, created, index)
+
+    def server_ids(self):
+        """Lists the servers in the snapshot.
+
+        Returns:
+            list: Unique identifiers for the servers.
+
+        """
+        return list(self._index)
+
+    def load(self, server_id):
+        """Decodes a server's record.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        Returns:
+            tuple: (members, role_order, settings) where members is a list
+                of (user_id, time, rank, wl_status) tuples, role_order the
+                role names in ascending order of milestone and settings the
+                server's ServerConfig. None if the server is not in the
+                snapshot.
+
+        """
+        if server_id not in self._index:
+            return None
+        offset, length = self._index[server_id]
+        view = memoryview(self._map)[offset:offset + length]
+        try:
+            count, send_messages = _RECORD.unpack_from(view, 0)
+            offset = _RECORD.size
+            end = offset + count * _MEMBER.size
+            members = [(str(user_id), spent, rank, bool(wl))
+                    for user_id, spent, rank, wl
+                    in _MEMBER.iter_unpack(view[offset:end])]
+
+            offset = end
+            role_order = []
+            count, = _COUNT.unpack_from(view, offset)
+            offset += _COUNT.size
+            for position in range(count):
+                role, offset = _unpack_name(view, offset)
+                role_order.append(role)
+
+            milestones = dict()
+            count, = _COUNT.unpack_from(view, offset)
+            offset += _COUNT.size
+            for position in range(count):
+                role, offset = _unpack_name(view, offset)
+                milestones[role], = _SECONDS.unpack_from(view, offset)
+                offset += _SECONDS.size
+        finally:
+            view.release()
+        return (members, role_order,
+                ServerConfig(milestones, bool(send_messages)))
+
+    def close(self):
+        """Unmaps the snapshot and closes its file."""
+
+        self._map.close()
+        self._file.close()
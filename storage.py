@@ -0,0 +1,272 @@
+"""
+Defines the interface every storage backend implements and picks the backend
+named in config.json.
+
+"""
+
+
+def create_storage(config):
+    """Creates the storage backend named by config["storage"].
+
+    Backends are imported only when chosen, so the MySQL connector is not
+    needed to run on SQLite.
+
+    Args:
+        config (dict): Holds (key, value) pairs parsed from config.json.
+
+    Returns:
+        Storage: "sqlite" gives a SQLiteStorage at config["sqlite_path"].
+            Anything else gives a SQLWrapper connected with
+            config["db_config"] through a pool sized by config["db_pool"].
+
+    """
+    if config.get("storage") == "sqlite":
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(config["sqlite_path"])
+    from sql_wrapper import SQLWrapper
+    return SQLWrapper(config["db_config"], **config["db_pool"])
+
+
+class Storage():
+    """Operations the bot needs from a storage backend.
+
+    Members of every server share one table keyed on (server_id, user_id)
+    holding their time, rank and whitelist status. Closed voice sessions
+    are appended to a ledger and folded into member times by
+    compact_sessions, which also sums them into hourly, daily and monthly
+    activity buckets (see: activity_rollups). Ids are passed in as strings
+    and may come back as integers.
+
+    """
+
+    def create_tables(self):
+        """Creates the member table and voice session ledger if needed."""
+
+        raise NotImplementedError
+
+    def add_users(self, rows):
+        """Adds users to any number of servers in bulk.
+
+        Users a server already has are left as they are.
+
+        Args:
+            rows (list): (server_id, user_id) tuples.
+
+        """
+        raise NotImplementedError
+
+    def update_ranks(self, rows):
+        """Writes new rank values for members of any number of servers.
+
+        Args:
+            rows (list): (server_id, user_id, rank) tuples.
+
+        """
+        raise NotImplementedError
+
+    def update_whitelist(self, rows):
+        """Writes new whitelist statuses for members of any number of servers.
+
+        Args:
+            rows (list): (server_id, user_id, wl_status) tuples.
+
+        """
+        raise NotImplementedError
+
+    def append_sessions(self, sessions):
+        """Appends closed voice session intervals to the ledger.
+
+        Sessions already in the ledger are ignored, so writing the same
+        interval twice is harmless.
+
+        Args:
+            sessions (list): (server_id, user_id, start, end) tuples.
+
+        """
+        raise NotImplementedError
+
+    def compact_sessions(self, before):
+        """Folds closed ledger sessions into each member's total time.
+
+        The same sessions are added to their members' activity buckets in
+        the same transaction.
+
+        Args:
+            before (float): Only sessions that ended before this timestamp
+                    are folded.
+
+        """
+        raise NotImplementedError
+
+    def prune_activity(self, cutoffs):
+        """Removes activity buckets past their retention.
+
+        Args:
+            cutoffs (list): (span, bucket) tuples. Buckets of span starting
+                    before bucket are removed.
+
+        """
+        raise NotImplementedError
+
+    def reset_user(self, server_id, user_id):
+        """Sets a user's total time to 0 and discards their ledger sessions.
+
+        Their activity buckets are discarded as well.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+
+        """
+        raise NotImplementedError
+
+    def add_user(self, server_id, user_id):
+        """Adds user to the specified server.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+
+        """
+        self.add_users([(server_id, user_id)])
+
+    def update_rank(self, server_id, user_id, rank):
+        """Updates the rank value for specified user.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+            rank (int): Integer representation of user's rank.
+
+        """
+        self.update_ranks([(server_id, user_id, rank)])
+
+    def whitelist_user(self, server_id, user_id):
+        """Whitelists a specified user by making their whitelist status true.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+
+        """
+        raise NotImplementedError
+
+    def unwhitelist_user(self, server_id, user_id):
+        """UnWhitelists a specified user by making their whitelist status false.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+
+        """
+        raise NotImplementedError
+
+    def whitelist_all(self, server_id):
+        """Whitelists all users.
+
+        Args:
+            server_id (string): Unique identifier for the server whose users
+                    are whitelisted.
+
+        """
+        raise NotImplementedError
+
+    def unwhitelist_all(self, server_id):
+        """Unwhitelists all users.
+
+        Args:
+            server_id (string): Unique identifier for the server whose users
+                    are unwhitelisted.
+
+        """
+        raise NotImplementedError
+
+    def fetch_user(self, server_id, user_id):
+        """Gets a specified user's data.
+
+        Args:
+            server_id (string): Unique identifier for the server the user is
+                    in.
+            user_id (string): Unique identifier for the user.
+
+        Returns:
+            list: (user_id, time, rank, wl_status) row if the user exists.
+
+        """
+        raise NotImplementedError
+
+    def fetch_all(self, server_id):
+        """Gets all users' data for the specified server.
+
+        Times include sessions still waiting in the ledger.
+
+        Args:
+            server_id (string): Unique identifier for the server whose users
+                    are fetched.
+
+        Returns:
+            list: (user_id, time, rank, wl_status) rows.
+
+        """
+        raise NotImplementedError
+
+    def fetch_activity(self, server_id, span, since):
+        """Gets how much time each user spent in a server since a moment.
+
+        Sums the user's activity buckets of a span starting at or after
+        since, plus the part of sessions still waiting in the ledger that
+        falls after since.
+
+        Args:
+            server_id (string): Unique identifier for the server whose users
+                    are fetched.
+            span (int): Span of the buckets to sum. (see: activity_rollups)
+            since (int): Start of the first bucket to sum. Should be the
+                    start of a bucket of span.
+
+        Returns:
+            list: (user_id, seconds) rows.
+
+        """
+        raise NotImplementedError
+
+    def fetch_servers(self, server_ids, before=None):
+        """Gets all users' data for many servers at once.
+
+        Rows are streamed in chunks rather than read into memory together.
+        Times include sessions still waiting in the ledger.
+
+        Args:
+            server_ids (list): Unique identifiers for the servers whose
+                    users are fetched.
+            before (float): If given, only ledger sessions that started
+                    before this timestamp are included.
+
+        Returns:
+            iterator: (user_id, time, rank, wl_status, server_id) rows.
+
+        """
+        raise NotImplementedError
+
+    def snapshot_token(self):
+        """Gets the token of the last snapshot written.
+
+        Returns:
+            int: The token, or None if no snapshot was ever written.
+
+        """
+        raise NotImplementedError
+
+    def set_snapshot_token(self, token):
+        """Records the token of a snapshot being written.
+
+        Args:
+            token (int): Identifies the snapshot.
+
+        """
+        raise NotImplementedError
@@ -0,0 +1,299 @@
+"""
+Defines the local write ahead log which keeps in memory changes safe between
+database flushes.
+
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger("discord")
+_SEGMENT_FORMAT = "wal.%d.log"
+_SAFETY_MARGIN = 60           # Seconds subtracted from segment creation times
+                              # to account for records stamped just before
+                              # they were appended.
+
+
+class WriteAheadLog(threading.Thread):
+    """Append only local log of time and rank changes with group commits.
+
+    Records are buffered and written to the current segment file by this
+    thread, which calls fsync once per batch rather than once per record.
+    Segments are rotated before every database flush and deleted once the
+    flush succeeds, so the log only ever holds changes the database may be
+    missing. Segments left behind by a crash are read back on construction
+    and replayed into the database on startup.
+
+    Each record is a JSON list whose first element is its kind:
+        ["session", server_id, user_id, start, end]
+        ["rank", server_id, user_id, rank]
+        ["reset", server_id, user_id]
+        ["whitelist", server_id, user_id, wl_status]
+        ["whitelist_all", server_id, wl_status]
+
+    Attributes:
+        _directory (string): Directory segment files are kept in.
+
+        _commit_time (float): Maximum seconds a record waits before it is
+            written and synced.
+
+        _buffer (list): Encoded records waiting to be written.
+
+        _lock (Lock): Guards _buffer, _live and which segment is current.
+            Never held while writing to disk, so appending never waits on
+            a sync.
+
+        _write_lock (Lock): Held while writing to and syncing segments so
+            batches reach disk in the order they were buffered.
+
+        _segment (int): Number of the segment being appended to.
+
+        _file (file): Open handle to the current segment.
+
+        _live (dict): Holds (segment, float) pairs for every segment that
+            has not been discarded. The float is when it was created.
+
+        _recovered (dict): Holds (server_id, list) pairs of records read back
+            from segments left behind by a previous run.
+
+    """
+
+    def __init__(self, directory, commit_time):
+        """Reads leftover segments and opens a new one.
+
+        Args:
+            directory (string): Directory to keep segment files in.
+            commit_time (float): Maximum seconds a record waits before it is
+                written and synced.
+
+        """
+        super().__init__(daemon=True)
+        self._directory = directory
+        self._commit_time = commit_time
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._live = dict()
+        self._recovered = dict()
+        os.makedirs(directory, exist_ok=True)
+
+        leftover = sorted(self._segment_numbers())
+        for segment in leftover:
+            self._read_segment(segment)
+
+            # Leftover segments are only safe to drop once replayed.
+            self._live[segment] = 0
+        self._segment = leftover[-1] + 1 if leftover else 0
+        self._open_segment()
+
+    def _segment_numbers(self):
+        """Private helper to list the numbers of segment files on disk.
+
+        Returns:
+            list: Segment numbers.
+
+        """
+        numbers = []
+        for name in os.listdir(self._directory):
+            try:
+                prefix, number, suffix = name.split('.')
+                if prefix + '.%d.' + suffix == _SEGMENT_FORMAT:
+                    numbers.append(int(number))
+            except ValueError as e:
+                continue
+        return numbers
+
+    def _path(self, segment):
+        """Private helper to build the path of a segment file.
+
+        Args:
+            segment (int): Segment number.
+
+        Returns:
+            string: Path to the segment file.
+
+        """
+        return os.path.join(self._directory, _SEGMENT_FORMAT % segment)
+
+    def _read_segment(self, segment):
+        """Private helper to load a leftover segment into _recovered.
+
+        A torn record at the end of the file, from a crash in the middle of a
+        write, is skipped.
+
+        Args:
+            segment (int): Segment number.
+
+        """
+        with open(self._path(segment), 'r', encoding='utf-8') as log:
+            for line in log:
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    logger.warning("Skipping torn WAL record in segment %s",
+                            segment)
+                    continue
+                self._recovered.setdefault(record[1], []).append(record)
+
+    def _open_segment(self):
+        """Private helper to start appending to a new segment."""
+
+        self._file = open(self._path(self._segment), 'a', encoding='utf-8')
+        self._live[self._segment] = time.time()
+
+    def _take_buffer(self):
+        """Private helper to swap out the buffered records.
+
+        Must be called while holding _lock.
+
+        Returns:
+            list: Encoded records that were buffered.
+
+        """
+        buffer = self._buffer
+        self._buffer = []
+        return buffer
+
+    def _write(self, log, buffer):
+        """Private helper to write and sync records to a segment.
+
+        Must be called while holding _write_lock but not _lock.
+
+        Args:
+            log (file): Open handle to the segment.
+            buffer (list): Encoded records to write.
+
+        """
+        if not buffer:
+            return
+        log.write(''.join(buffer))
+        log.flush()
+        os.fsync(log.fileno())
+
+    def _commit(self):
+        """Private helper to write and sync buffered records."""
+
+        with self._write_lock:
+            with self._lock:
+                buffer = self._take_buffer()
+            self._write(self._file, buffer)
+
+    def append(self, *record):
+        """Adds a record to the log.
+
+        The record is durable once the next group commit finishes.
+
+        Args:
+            *record: Kind of the record followed by its fields.
+
+        """
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+
+    def rotate(self):
+        """Commits the current segment and starts appending to a new one.
+
+        Returns:
+            list: Numbers of every segment before the new one that has not
+                been discarded. Pass it to discard once the database holds
+                everything they recorded.
+
+        """
+        with self._write_lock:
+            previous = self._file
+            following = self._segment + 1
+            opened = open(self._path(following), 'a', encoding='utf-8')
+            with self._lock:
+                buffer = self._take_buffer()
+                self._segment = following
+                self._file = opened
+                self._live[following] = time.time()
+                segments = [segment for segment in self._live
+                        if segment != following]
+
+            # Records buffered before the swap belong to the old segment.
+            self._write(previous, buffer)
+            previous.close()
+        return segments
+
+    def discard(self, segments):
+        """Deletes segments whose changes have reached the database.
+
+        Args:
+            segments (list): Segment numbers returned by rotate.
+
+        """
+        with self._lock:
+            segments = [segment for segment in segments
+                    if segment != self._segment]
+        for segment in segments:
+            try:
+                os.remove(self._path(segment))
+            except FileNotFoundError as e:
+                pass
+            with self._lock:
+                self._live.pop(segment, None)
+
+    def recovered(self, server_id):
+        """Takes the records a previous run left behind for a server.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+
+        Returns:
+            list: Records in the order they were appended.
+
+        """
+        return self._recovered.pop(server_id, [])
+
+    def recovered_servers(self):
+        """Lists servers with records left behind by a previous run.
+
+        Returns:
+            list: Unique identifiers of the servers.
+
+        """
+        return list(self._recovered)
+
+    def discard_recovered(self):
+        """Drops leftover segments once every server has been replayed."""
+
+        self._recovered = dict()
+        self.discard([segment for segment in self._live
+                if self._live[segment] == 0])
+
+    def safe_time(self):
+        """Returns the time before which no live segment holds records.
+
+        Ledger sessions that ended before this time will never be replayed
+        again, so they are safe to compact.
+
+        Returns:
+            float: Timestamp.
+
+        """
+        with self._lock:
+            return min(self._live.values()) - _SAFETY_MARGIN
+
+    def close(self):
+        """Commits any buffered records and closes the current segment."""
+
+        with self._write_lock:
+            with self._lock:
+                buffer = self._take_buffer()
+            self._write(self._file, buffer)
+            self._file.close()
+
+    def run(self):
+        """Group commits buffered records periodically."""
+
+        while True:
+            time.sleep(self._commit_time)
+            try:
+                self._commit()
+            except Exception as e:
+                logger.exception("Failed to commit write ahead log")
@@ -0,0 +1,196 @@
+"""
+Defines the background queue which coalesces per member database writes.
+
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger("discord")
+
+
+class WriteQueue(threading.Thread):
+    """Merges per member writes and flushes them in batches.
+
+    Adding a member, changing their rank and changing their whitelist status
+    are queued rather than written straight away. Repeated writes to the
+    same (server_id, user_id) are merged so only the latest value of each
+    field is written. The queue is flushed once it holds batch_size members
+    or every flush_time seconds, costing a few bulk statements instead of a
+    transaction per write. Ranks and whitelist statuses are also recorded in
+    the write ahead log so they survive a crash before being flushed.
+
+    Attributes:
+        _sql (Storage): Backend used to write to the database.
+
+        _wal (WriteAheadLog): Local log queued writes are recorded in.
+
+        _flush_time (int): Maximum seconds a write waits before it is flushed.
+
+        _batch_size (int): Amount of queued members that triggers an early
+            flush.
+
+        _pending (dict): Holds ((server_id, user_id), dict) pairs where the
+            dictionary value holds the fields waiting to be written. Each
+            field is one of "add", "rank" or "wl_status".
+
+        _lock (Lock): Guards _pending.
+
+        _flush_lock (Lock): Held while flushing so flushes never overlap and
+            write in the order writes were queued.
+
+        _wakeup (Event): Set when the queue should be flushed early.
+
+    """
+
+    def __init__(self, sql, wal, flush_time, batch_size):
+        """Initializes the queue thread.
+
+        Args:
+            sql (Storage): Backend used to write to the database.
+            wal (WriteAheadLog): Local log to record queued writes in.
+            flush_time (int): Maximum seconds a write waits before it is
+                flushed.
+            batch_size (int): Amount of queued members that triggers an
+                early flush.
+
+        """
+        super().__init__(daemon=True)
+        self._sql = sql
+        self._wal = wal
+        self._flush_time = flush_time
+        self._batch_size = batch_size
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def __len__(self):
+        """Returns the amount of members with queued writes."""
+
+        return len(self._pending)
+
+    def _queue(self, server_id, user_id, field, value):
+        """Private helper to merge a write into the queue.
+
+        Must be called while holding _lock.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            field (string): Field being written.
+            value: Value to write.
+
+        """
+        fields = self._pending.setdefault((server_id, user_id), dict())
+        fields[field] = value
+        if len(self._pending) >= self._batch_size:
+            self._wakeup.set()
+
+    def add_user(self, server_id, user_id):
+        """Queues adding a user to a server.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+
+        """
+        with self._lock:
+            self._queue(server_id, user_id, "add", True)
+
+    def update_rank(self, server_id, user_id, rank):
+        """Queues a user's new rank.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+            rank (int): Integer representation of user's rank.
+
+        """
+        with self._lock:
+            self._queue(server_id, user_id, "rank", rank)
+            self._wal.append("rank", server_id, user_id, rank)
+
+    def update_ranks(self, server_id, rows):
+        """Queues many users' new ranks at once.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            rows (list): (user_id, rank) pairs.
+
+        """
+        with self._lock:
+            for user_id, rank in rows:
+                self._queue(server_id, user_id, "rank", rank)
+                self._wal.append("rank", server_id, user_id, rank)
+
+    def whitelist_user(self, server_id, user_id):
+        """Queues whitelisting a user.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+
+        """
+        with self._lock:
+            self._queue(server_id, user_id, "wl_status", True)
+            self._wal.append("whitelist", server_id, user_id, True)
+
+    def unwhitelist_user(self, server_id, user_id):
+        """Queues unwhitelisting a user.
+
+        Args:
+            server_id (string): Unique identifier for the server.
+            user_id (string): Unique identifier for the user.
+
+        """
+        with self._lock:
+            self._queue(server_id, user_id, "wl_status", False)
+            self._wal.append("whitelist", server_id, user_id, False)
+
+    def flush(self):
+        """Writes every queued write to the database and waits for it.
+
+        Also used to drain the queue on shutdown. Writes that could not be
+        made are queued again unless a newer value was queued meanwhile.
+
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = dict()
+            if not pending:
+                return
+
+            added = []
+            ranks = []
+            statuses = []
+            for (server_id, user_id), fields in pending.items():
+                if "add" in fields:
+                    added.append((server_id, user_id))
+                if "rank" in fields:
+                    ranks.append((server_id, user_id, fields["rank"]))
+                if "wl_status" in fields:
+                    statuses.append((server_id, user_id, fields["wl_status"]))
+            try:
+                self._sql.add_users(added)
+                self._sql.update_ranks(ranks)
+                self._sql.update_whitelist(statuses)
+            except:
+                with self._lock:
+                    for key, fields in pending.items():
+                        newer = self._pending.setdefault(key, dict())
+                        for field, value in fields.items():
+                            newer.setdefault(field, value)
+                raise
+
+    def run(self):
+        """Flushes queued writes periodically."""
+
+        while True:
+            self._wakeup.wait(self._flush_time)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Failed to flush write queue")